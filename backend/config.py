@@ -1,13 +1,108 @@
+from typing import Literal, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field
 
 class Settings(BaseSettings):
-    redcap_url: str = Field(..., alias="REDCAP_API_URL")
-    redcap_super_api_token: str = Field(..., alias="REDCAP_SUPER_API_TOKEN")
+    redcap_url: str = Field(
+        "https://tuspl22-redcap.srv.mwn.de/redcap/api/", alias="REDCAP_API_URL"
+    )
+    # only needed to create new REDCap projects; checked when that happens
+    redcap_super_api_token: Optional[str] = Field(None, alias="REDCAP_SUPER_API_TOKEN")
     mongo_url: str = Field(..., alias="MONGO_URL")
     mongo_db: str = Field(..., alias="MONGO_DB")
-    huggingface_token: str = Field(..., alias="HUGGINGFACE_TOKEN")
-    openai_api_key: str = Field(..., alias="OPENAI_API_KEY")
+    # not used by any code path, kept for experimentation
+    huggingface_token: Optional[str] = Field(None, alias="HUGGINGFACE_TOKEN")
+    openai_api_key: Optional[str] = Field(None, alias="OPENAI_API_KEY")
+
+    # ─── Connection pools & startup ──────────────────────────────────
+    mongo_max_pool_size: int = Field(100, alias="MONGO_MAX_POOL_SIZE")
+    mongo_min_pool_size: int = Field(5, alias="MONGO_MIN_POOL_SIZE")
+    http_max_connections: int = Field(100, alias="HTTP_MAX_CONNECTIONS")
+    http_max_keepalive_connections: int = Field(20, alias="HTTP_MAX_KEEPALIVE_CONNECTIONS")
+    startup_warmup_timeout_s: float = Field(10.0, alias="STARTUP_WARMUP_TIMEOUT_S")
+    # responses smaller than this are sent uncompressed
+    compression_min_bytes: int = Field(1024, alias="COMPRESSION_MIN_BYTES")
+    # larger responses are compressed in a thread, off the event loop
+    compression_thread_bytes: int = Field(64 * 1024, alias="COMPRESSION_THREAD_BYTES")
+
+    # ─── Health probing ──────────────────────────────────────────────
+    health_probe_interval_s: float = Field(10.0, alias="HEALTH_PROBE_INTERVAL_S")
+    health_probe_timeout_s: float = Field(3.0, alias="HEALTH_PROBE_TIMEOUT_S")
+
+    # ─── Response ingestion ──────────────────────────────────────────
+    idempotency_cache_size: int = Field(10_000, alias="IDEMPOTENCY_CACHE_SIZE")
+    idempotency_cache_ttl_s: float = Field(600.0, alias="IDEMPOTENCY_CACHE_TTL_S")
+    idempotency_key_ttl_days: int = Field(30, alias="IDEMPOTENCY_KEY_TTL_DAYS")
+    # a claim whose request hasn't finished after this long was abandoned
+    idempotency_pending_timeout_s: float = Field(60.0, alias="IDEMPOTENCY_PENDING_TIMEOUT_S")
+    idempotency_retry_after_s: int = Field(2, alias="IDEMPOTENCY_RETRY_AFTER_S")
+
+    # ─── REDCap delivery backpressure ────────────────────────────────
+    redcap_max_pending: int = Field(1000, alias="REDCAP_MAX_PENDING")
+    redcap_max_pending_per_server: int = Field(250, alias="REDCAP_MAX_PENDING_PER_SERVER")
+    redcap_initial_concurrency: int = Field(4, alias="REDCAP_INITIAL_CONCURRENCY")
+    redcap_max_concurrency: int = Field(32, alias="REDCAP_MAX_CONCURRENCY")
+    # what to do when the bounds are hit: park in Mongo ("spill") or 429 ("reject")
+    redcap_overflow: Literal["spill", "reject"] = Field("spill", alias="REDCAP_OVERFLOW")
+    redcap_retry_after_s: int = Field(30, alias="REDCAP_RETRY_AFTER_S")
+    redcap_outbox_drain_interval_s: float = Field(5.0, alias="REDCAP_OUTBOX_DRAIN_INTERVAL_S")
+    # failed deliveries are retried from the outbox, backing off, this many times
+    redcap_max_attempts: int = Field(5, alias="REDCAP_MAX_ATTEMPTS")
+
+    # ─── REDCap circuit breakers (one per base URL) ──────────────────
+    redcap_breaker_window: int = Field(20, alias="REDCAP_BREAKER_WINDOW")
+    redcap_breaker_min_calls: int = Field(5, alias="REDCAP_BREAKER_MIN_CALLS")
+    redcap_breaker_failure_rate: float = Field(0.5, alias="REDCAP_BREAKER_FAILURE_RATE")
+    redcap_breaker_open_s: float = Field(30.0, alias="REDCAP_BREAKER_OPEN_S")
+    redcap_breaker_half_open_calls: int = Field(1, alias="REDCAP_BREAKER_HALF_OPEN_CALLS")
+
+    # ─── UI log ingestion (write-behind) ─────────────────────────────
+    log_buffer_capacity: int = Field(50_000, alias="LOG_BUFFER_CAPACITY")
+    log_flush_batch_size: int = Field(500, alias="LOG_FLUSH_BATCH_SIZE")
+    log_flush_interval_s: float = Field(1.0, alias="LOG_FLUSH_INTERVAL_S")
+    # time-series collection for UI events; 0 days keeps them forever
+    log_collection: str = Field("ui_logs", alias="LOG_COLLECTION")
+    log_retention_days: int = Field(365, alias="LOG_RETENTION_DAYS")
+    # share of events also stored raw; counters always see every event
+    log_raw_sample_rate: float = Field(1.0, ge=0.0, le=1.0, alias="LOG_RAW_SAMPLE_RATE")
+    log_counters_flush_interval_s: float = Field(10.0, alias="LOG_COUNTERS_FLUSH_INTERVAL_S")
+    log_counters_max_rows: int = Field(10_000, alias="LOG_COUNTERS_MAX_ROWS")
+    # distinct counters held between flushes; events beyond go to an overflow counter
+    log_counters_max_keys: int = Field(50_000, alias="LOG_COUNTERS_MAX_KEYS")
+
+    # ─── Per-worker caches of studies and REDCap keys ────────────────
+    # a TTL of 0 disables caching; the TTL also bounds staleness after deletes
+    study_cache_size: int = Field(1000, alias="STUDY_CACHE_SIZE")
+    study_cache_ttl_s: float = Field(300.0, alias="STUDY_CACHE_TTL_S")
+    cache_use_change_streams: bool = Field(True, alias="CACHE_USE_CHANGE_STREAMS")
+    cache_poll_interval_s: float = Field(2.0, alias="CACHE_POLL_INTERVAL_S")
+    # participant graph series, extended as responses arrive; the TTL frees idle ones
+    graph_cache_size: int = Field(10_000, alias="GRAPH_CACHE_SIZE")
+    graph_cache_ttl_s: float = Field(3600.0, alias="GRAPH_CACHE_TTL_S")
+
+    # ─── Tracing ─────────────────────────────────────────────────────
+    # "file" appends Zipkin v2 JSON spans to TRACE_FILE, "zipkin" posts them
+    # to TRACE_COLLECTOR_URL (e.g. http://zipkin:9411/api/v2/spans)
+    trace_export: Literal["none", "file", "zipkin"] = Field("none", alias="TRACE_EXPORT")
+    trace_file: str = Field("traces.jsonl", alias="TRACE_FILE")
+    trace_collector_url: Optional[str] = Field(None, alias="TRACE_COLLECTOR_URL")
+    trace_service_name: str = Field("study-backend", alias="TRACE_SERVICE_NAME")
+    # share of traces kept; spans at least TRACE_SLOW_MS long are kept anyway
+    trace_sample_rate: float = Field(0.01, ge=0.0, le=1.0, alias="TRACE_SAMPLE_RATE")
+    trace_slow_ms: float = Field(1000.0, alias="TRACE_SLOW_MS")
+    trace_buffer_size: int = Field(10_000, alias="TRACE_BUFFER_SIZE")
+    trace_flush_interval_s: float = Field(5.0, alias="TRACE_FLUSH_INTERVAL_S")
+
+    # ─── Study validation ────────────────────────────────────────────
+    # bodies at least this large are validated in a process pool
+    study_validation_offload_bytes: int = Field(256 * 1024, alias="STUDY_VALIDATION_OFFLOAD_BYTES")
+    study_validation_workers: int = Field(2, alias="STUDY_VALIDATION_WORKERS")
+    study_validation_max_pending: int = Field(8, alias="STUDY_VALIDATION_MAX_PENDING")
+    study_validation_timeout_s: float = Field(10.0, alias="STUDY_VALIDATION_TIMEOUT_S")
+
+    # ─── Static study snapshots served by Caddy (unset = disabled) ───
+    snapshot_dir: Optional[str] = Field(None, alias="SNAPSHOT_DIR")
+
     model_config = SettingsConfigDict(env_file=".env", extra="allow")
 
-settings = Settings()
\ No newline at end of file
+settings = Settings()
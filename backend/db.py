@@ -1,23 +1,90 @@
 # db.py
 import logging
+from typing import Optional
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from config import settings
 
 logger = logging.getLogger(__name__)
 
-# create one client at import time, bound to the current event loop
-_client: AsyncIOMotorClient = AsyncIOMotorClient(settings.mongo_url)
-_db: AsyncIOMotorDatabase = _client[settings.mongo_db]
+# created lazily on first use, so it binds to the event loop that serves requests
+_client: Optional[AsyncIOMotorClient] = None
+
+
+def get_client() -> AsyncIOMotorClient:
+    """
+    Return the shared Motor client, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        _client = AsyncIOMotorClient(
+            settings.mongo_url,
+            maxPoolSize=settings.mongo_max_pool_size,
+            minPoolSize=settings.mongo_min_pool_size,
+        )
+    return _client
 
-# optionally verify on startup
-try:
-    _client.admin.command("ping")
-    logger.info("Connected to MongoDB %s at %s", settings.mongo_db, settings.mongo_url)
-except Exception:
-    logger.exception("Failed to connect to MongoDB at startup")
 
 def get_db() -> AsyncIOMotorDatabase:
     """
     Dependency that returns the shared Motor database.
     """
-    return _db
\ No newline at end of file
+    return get_client()[settings.mongo_db]
+
+
+async def ping() -> None:
+    """
+    Round-trip to MongoDB; opens the first pooled connection as a side effect.
+    """
+    await get_client().admin.command("ping")
+    logger.info("Connected to MongoDB %s", settings.mongo_db)
+
+
+async def ensure_indexes() -> None:
+    """
+    Create the indexes the routers rely on. Idempotent, run once per worker
+    at startup.
+    """
+    db = get_db()
+    await db["idempotency_keys"].create_index(
+        "created_at",
+        expireAfterSeconds=settings.idempotency_key_ttl_days * 24 * 3600,
+    )
+    await db["redcap_outbox"].create_index([("url", 1), ("created_at", 1)])
+    # responses are upserted on their key, so a retry after a partial
+    # failure doesn't store them twice; not unique, older data has repeats
+    await db["responses"].create_index("idempotency_key", sparse=True)
+    await db["responses_backup"].create_index("idempotency_key", sparse=True)
+    # streamed per study by tools.reconcile_redcap
+    await db["responses_backup"].create_index([("study_id", 1), ("_id", 1)])
+    # participant timelines, paged by (response_time_in_ms, _id)
+    await db["responses_backup"].create_index(
+        [("study_id", 1), ("user_id", 1), ("response_time_in_ms", -1), ("_id", -1)]
+    )
+    await db["responses_backup"].create_index(
+        [("study_id", 1), ("user_id", 1), ("module_id", 1), ("response_time_in_ms", -1), ("_id", -1)]
+    )
+    # graph series, extended with the responses stored after the newest _id seen
+    await db["responses_backup"].create_index(
+        [("study_id", 1), ("user_id", 1), ("module_id", 1), ("_id", 1)]
+    )
+    await db["studies"].create_index([("properties.study_id", 1), ("timestamp", -1)])
+    await db["studies"].create_index([("properties.study_id", 1), ("content_hash", 1)])
+    # lets the health prober's distinct() read the index instead of every study
+    await db["studies"].create_index("properties.redcap_server_api_url", sparse=True)
+    # scanned by the cache bus when change streams aren't available
+    await db["studies"].create_index("timestamp")
+    await db["keys"].create_index("updated_at")
+    await db["log_counters"].create_index(
+        [("study_id", 1), ("minute", 1), ("page", 1), ("event", 1), ("platform", 1)],
+        unique=True,
+    )
+
+
+def close() -> None:
+    """
+    Close the shared client; the next get_client() call builds a fresh one.
+    """
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
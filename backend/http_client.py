@@ -0,0 +1,52 @@
+# http_client.py
+import asyncio
+import logging
+from typing import Iterable, Optional
+
+import httpx
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# one pooled client per worker, created lazily like the Mongo client in db.py
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Return the shared httpx client used for all outbound REDCap calls.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.http_max_connections,
+                max_keepalive_connections=settings.http_max_keepalive_connections,
+            ),
+            timeout=15.0,
+        )
+    return _client
+
+
+async def warm_up(urls: Iterable[str], timeout: float = 5.0) -> None:
+    """
+    Open keep-alive connections to the given hosts. Any HTTP answer counts,
+    we only care that DNS, TCP and TLS are done before the first real push.
+    """
+    client = get_http_client()
+    targets = list(dict.fromkeys(urls))
+    results = await asyncio.gather(
+        *(client.head(url, timeout=timeout) for url in targets),
+        return_exceptions=True,
+    )
+    for url, result in zip(targets, results):
+        if isinstance(result, Exception):
+            logger.warning("HTTP warm-up to %s failed: %r", url, result)
+
+
+async def close() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
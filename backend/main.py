@@ -1,17 +1,108 @@
+import asyncio
 import logging
-import inspect
-from fastapi import FastAPI, Depends, HTTPException
+import time
+from contextlib import asynccontextmanager, suppress
+from typing import Awaitable
+
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+import db
+import http_client
 from config import settings
-from db import get_db
 from routers import studies, responses, logs, redcap, users
+from services import log_store
+from services.cache_bus import bus
+from services.compression import CompressionMiddleware
+from services.health import HealthProber
+from services.media import BinaryBodyMiddleware
+from services.tracing import TraceLogFilter, TracingMiddleware, tracer
+from services.validation_pool import validator
 
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s %(levelname)s %(name)s | %(message)s",
+    format="%(asctime)s %(levelname)s %(name)s [%(trace_id)s] | %(message)s",
 )
+for handler in logging.getLogger().handlers:
+    handler.addFilter(TraceLogFilter())
+logger = logging.getLogger(__name__)
+
+
+async def _timed(app: FastAPI, phase: str, step: Awaitable) -> bool:
+    """
+    Await one startup step, record its duration under `phase` and
+    report whether it succeeded.
+    """
+    t0 = time.perf_counter()
+    try:
+        await asyncio.wait_for(step, timeout=settings.startup_warmup_timeout_s)
+        return True
+    except Exception as e:
+        logger.warning("Startup phase %s failed: %r", phase, e)
+        return False
+    finally:
+        app.state.startup_ms[phase] = round((time.perf_counter() - t0) * 1000, 1)
+
+
+async def _warm_up(app: FastAPI) -> None:
+    """
+    Warm the Mongo and HTTP pools concurrently, then flag the worker ready.
+    Mongo is retried with backoff; REDCap warm-up is best effort.
+    """
+    t0 = time.perf_counter()
+    delay = 1.0
+    mongo_ok, _ = await asyncio.gather(
+        _timed(app, "mongo", db.ping()),
+        _timed(app, "http", http_client.warm_up([settings.redcap_url])),
+    )
+    while not mongo_ok:
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 30.0)
+        mongo_ok = await _timed(app, "mongo", db.ping())
+    await asyncio.gather(
+        _timed(app, "indexes", db.ensure_indexes()),
+        _timed(app, "log_collection", log_store.provision(db.get_db())),
+    )
+
+    app.state.startup_ms["total"] = round((time.perf_counter() - t0) * 1000, 1)
+    app.state.ready = True
+    logger.info("Worker ready, startup phases (ms): %s", app.state.startup_ms)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # serve /live right away; /ready flips once the pools are warm
+    app.state.ready = False
+    app.state.startup_ms = {}
+    app.state.health = HealthProber(
+        interval_s=settings.health_probe_interval_s,
+        timeout_s=settings.health_probe_timeout_s,
+    )
+    warmup = asyncio.create_task(_warm_up(app))
+    app.state.health.start()
+    redcap.delivery.start()
+    logs.buffer.start()
+    logs.counters.start()
+    bus.start()
+    tracer.start()
+    try:
+        yield
+    finally:
+        warmup.cancel()
+        with suppress(asyncio.CancelledError):
+            await warmup
+        await app.state.health.stop()
+        await redcap.delivery.stop()
+        await logs.buffer.stop()
+        await logs.counters.stop()
+        await bus.stop()
+        await tracer.stop()
+        validator.shutdown()
+        await http_client.close()
+        db.close()
+
 
-app = FastAPI(title="Study Designer API")
+app = FastAPI(title="Study Designer API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,27 +111,67 @@ app.add_middleware(
     allow_headers=["*"],
     allow_credentials=True,
 )
+app.add_middleware(
+    CompressionMiddleware,
+    min_size=settings.compression_min_bytes,
+    thread_size=settings.compression_thread_bytes,
+)
+app.add_middleware(BinaryBodyMiddleware)
+# outermost, so the request span covers the other middlewares too
+app.add_middleware(TracingMiddleware)
 
-# @app.on_event("startup")
-# async def on_startup():
-#     await init_db()
+@app.get("/live")
+async def live():
+    """
+    Liveness: the process is up and the event loop is responsive.
+    """
+    return {"status": "alive"}
+
+@app.get("/ready")
+async def ready(request: Request):
+    """
+    Readiness: Mongo answered at least once since startup.
+    """
+    state = request.app.state
+    body = {
+        "status": "ready" if state.ready else "starting",
+        "startup_ms": state.startup_ms,
+    }
+    if not state.ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=body)
+    return body
 
 @app.get("/health")
-async def health(db=Depends(get_db)):
+async def health(request: Request):
     """
-    Ping MongoDB. If db.client.admin.command(...) returns a coroutine,
-    await it; if it returns a plain dict (PyMongo), just use it.
+    Serve the last result of the background prober; never touches Mongo.
+    503 only when Mongo is down, an unreachable REDCap server just degrades.
     """
-    try:
-        ping_result = db.client.admin.command("ping")
-        if inspect.isawaitable(ping_result):
-            await ping_result
-    except Exception:
-        raise HTTPException(status_code=503, detail="MongoDB unreachable")
-    return {"status": "ok", "mongo": "reachable"}
+    prober: HealthProber = request.app.state.health
+    await prober.wait_first_probe()
+    body = prober.snapshot()
+    if body["status"] in ("down", "unknown"):
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=body)
+    return body
+
+@app.get("/metrics")
+async def metrics():
+    """
+    In-process counters for this worker, as JSON.
+    """
+    return {
+        "redcap_delivery":  redcap.delivery.stats(),
+        "redcap_breakers":  redcap.breakers.stats(),
+        "log_buffer":       logs.buffer.stats(),
+        "log_counters":     logs.counters.stats(),
+        "cache_bus":        bus.stats(),
+        "study_validation": validator.stats(),
+        "tracing":          tracer.stats(),
+    }
 
 prefix = '/api/v2'
 app.include_router(studies.router, prefix=prefix, tags=["studies"])
 app.include_router(responses.router, prefix=prefix, tags=["responses"])
+app.include_router(logs.router, prefix=prefix, tags=["logs"])
 app.include_router(redcap.router, prefix=prefix, tags=["redcap"])
 app.include_router(users.router, prefix=prefix, tags=["users"])
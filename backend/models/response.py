@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 
 class ResponseIn(BaseModel):
@@ -12,4 +12,23 @@ class ResponseOut(ResponseIn):
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
     class Config:
-        allow_population_by_field_name = True
\ No newline at end of file
+        allow_population_by_field_name = True
+
+
+class ResponseEntry(BaseModel):
+    """
+    One answered module as the app posts it, see routers.redcap.response_entry.
+    """
+    data_type:           str
+    user_id:             str
+    study_id:            str
+    module_index:        int
+    platform:            str
+    module_id:           str
+    module_name:         str
+    responses:           Optional[str]
+    entries:             Optional[List[int]]
+    response_time:       str
+    response_time_in_ms: int
+    alert_time:          str
+    idempotency_key:     Optional[str] = None
@@ -368,6 +368,8 @@ class StudyOut(BaseModel):
     id: Optional[PyObjectId] = Field(alias="_id")
     type: Literal["study"] = Field(alias="_type")
     timestamp: int
+    # SHA-256 of the version's content, see services/study_hash.py
+    content_hash: Optional[str] = None
     properties: Properties
     modules: List[Module]
 
@@ -1,11 +1,32 @@
-from fastapi import APIRouter, Depends, status
+from datetime import datetime, timedelta, timezone
+from fastapi import APIRouter, Depends, Query, status
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Literal, Optional
 from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from config import settings
 from db import get_db
+from services import log_store
+from services.log_buffer import LogBuffer
+from services.log_counters import COLLECTION as COUNTERS, LogCounters
 
 router = APIRouter(tags=["logs"])
 
+# acknowledged on append, flushed to Mongo in batches (see services/log_buffer.py)
+buffer = LogBuffer(
+    collection       = settings.log_collection,
+    max_batch        = settings.log_flush_batch_size,
+    flush_interval_s = settings.log_flush_interval_s,
+    capacity         = settings.log_buffer_capacity,
+)
+
+# per-minute counts of every event, raw storage may be sampled
+counters = LogCounters(
+    flush_interval_s = settings.log_counters_flush_interval_s,
+    raw_sample_rate  = settings.log_raw_sample_rate,
+    max_keys         = settings.log_counters_max_keys,
+)
+
 class LogEntry(BaseModel):
     data_type:       str
     user_id:         str
@@ -17,14 +38,75 @@ class LogEntry(BaseModel):
     timestamp:       str
     timestamp_in_ms: int
 
+def ingest_log(entry: LogEntry) -> bool:
+    """
+    Count the event, then buffer it raw unless it's sampled out.
+    Returns False only if the raw event was dropped because the buffer is full.
+    """
+    doc = entry.dict()
+    counters.record(doc)
+    if not counters.keep_raw():
+        return True
+    return buffer.add(log_store.to_document(doc))
+
 @router.post(
     "/log",
     status_code=status.HTTP_204_NO_CONTENT,
     summary="Back up a UI event/log to Mongo"
 )
-async def save_log(
-    entry: LogEntry,
-    db: AsyncIOMotorDatabase = Depends(get_db),
+async def save_log(entry: LogEntry):
+    ingest_log(entry)
+    return
+
+@router.post(
+    "/logs/batch",
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Back up many UI events/logs in one request"
+)
+async def save_logs_batch(entries: List[LogEntry]):
+    accepted = sum(1 for e in entries if ingest_log(e))
+    return {"accepted": accepted, "dropped": len(entries) - accepted}
+
+@router.get(
+    "/logs/counters/{study_id}",
+    summary="Event counts per page, event and platform over time"
+)
+async def get_log_counters(
+    study_id:    str,
+    since:       Optional[datetime] = Query(None, description="Defaults to 24 h ago"),
+    until:       Optional[datetime] = Query(None, description="Defaults to now"),
+    granularity: Literal["minute", "hour", "day"] = "minute",
+    page:        Optional[str] = None,
+    event:       Optional[str] = None,
+    platform:    Optional[str] = None,
+    db:          AsyncIOMotorDatabase = Depends(get_db),
 ):
-    await db["logs"].insert_one(entry.dict())
-    return
\ No newline at end of file
+    until = until or datetime.now(timezone.utc)
+    since = since or until - timedelta(days=1)
+    match = {"study_id": study_id, "minute": {"$gte": since, "$lt": until}}
+    for field, value in (("page", page), ("event", event), ("platform", platform)):
+        if value is not None:
+            match[field] = value
+
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {
+                "bucket":   {"$dateTrunc": {"date": "$minute", "unit": granularity}},
+                "page":     "$page",
+                "event":    "$event",
+                "platform": "$platform",
+            },
+            "count": {"$sum": "$count"},
+        }},
+        {"$sort": {"_id.bucket": 1}},
+        {"$limit": settings.log_counters_max_rows},
+    ]
+    rows = await db[COUNTERS].aggregate(pipeline).to_list(length=None)
+    return {
+        "study_id":    study_id,
+        "granularity": granularity,
+        "since":       since,
+        "until":       until,
+        "counters": [{**row["_id"], "count": row["count"]} for row in rows],
+    }
@@ -1,27 +1,53 @@
-import os
 import json
+import time
 from typing import Any, Dict, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Form, status
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException, Header, Request, Response, status
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
 from motor.motor_asyncio import AsyncIOMotorDatabase
 import httpx
 from fastapi.responses import JSONResponse
+from models.response import ResponseEntry
 from models.study import StudyCreate as StudyModel   # no _id/timestamp
+from config import settings
 from db import get_db
+from http_client import get_http_client
+from routers.logs import ingest_log
+from services import branching, idempotency, ingest, media
+from services.cache import TTLCache
+from services.cache_bus import bus
+from services.validation_pool import ValidatedStudy, validated_study
+from services.breaker import BreakerRegistry, CircuitOpenError
+from services.delivery import RedcapDelivery
+from services.study_lookup import redcap_url
+from services.tracing import tracer
 import logging
 
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/redcap", tags=["redcap"])
 
-REDCAP_API_URL     = os.getenv(
-    "REDCAP_API_URL",
-    "https://tuspl22-redcap.srv.mwn.de/redcap/api/"
+# study_id → REDCap API token; evicted across workers by the cache bus
+_key_cache: TTLCache[str] = TTLCache(
+    maxsize=settings.study_cache_size, ttl_s=settings.study_cache_ttl_s
 )
-REDCAP_SUPER_TOKEN = os.getenv("REDCAP_SUPER_API_TOKEN")
-if not REDCAP_SUPER_TOKEN:
-    raise RuntimeError("Missing REDCAP_SUPER_API_TOKEN in environment")
+_codebook_cache: TTLCache[Dict[str, Dict[str, Any]]] = TTLCache(
+    maxsize=settings.study_cache_size, ttl_s=settings.study_cache_ttl_s
+)
+
+
+def _evictor(cache: TTLCache):
+    def evict(study_id: Optional[str]) -> None:
+        if study_id is None:
+            cache.clear()
+        else:
+            cache.pop(study_id)
+    return evict
+
+
+bus.register("keys", _evictor(_key_cache))
+bus.register("keys", _evictor(_codebook_cache))
 
 
 class LogEntry(BaseModel):
@@ -35,54 +61,127 @@ class LogEntry(BaseModel):
     timestamp:      str
     timestamp_in_ms:int
 
-class ResponseEntry(BaseModel):
-    data_type:           str
-    user_id:             str
-    study_id:            str
-    module_index:        int
-    platform:            str
-    module_id:           str
-    module_name:         str
-    responses:           Optional[str]
-    entries:             Optional[List[int]]
-    response_time:       str
-    response_time_in_ms: int
-    alert_time:          str
-
 class Key(BaseModel):
     study_id: str
     api_key:  str
 
 
-async def _get_redcap_api_url(
+async def response_entry(request: Request) -> ResponseEntry:
+    """
+    The posted response: form fields as the app sends them, or one JSON
+    object (MessagePack and CBOR bodies arrive as JSON, see services/media.py).
+    `entries` may be a list or, as in forms, a JSON-encoded list.
+    """
+    try:
+        if media.media_type(request.headers.get("content-type")) == media.JSON:
+            data = await request.json()
+            if not isinstance(data, dict):
+                raise ValueError("expected an object")
+        else:
+            data = dict(await request.form())
+        data.setdefault("responses", None)
+        if isinstance(data["responses"], dict):
+            data["responses"] = json.dumps(data["responses"])
+        entries = data.get("entries")
+        data["entries"] = json.loads(entries) if isinstance(entries, str) and entries else entries or None
+    except ValueError as e:
+        raise RequestValidationError([{"type": "value_error", "loc": ("body",), "msg": str(e), "input": None}])
+    try:
+        return ResponseEntry.model_validate(data)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)]
+        )
+
+
+RESPONSE_BODY = media.body_doc(ResponseEntry.model_json_schema(), form=True)
+
+
+async def _get_api_key(
     db: AsyncIOMotorDatabase,
     study_id: str
-) -> str:
+) -> Optional[str]:
     """
-    Look for a study-specific REDCap URL in Mongo; return it if found,
-    otherwise fall back to the global REDCAP_API_URL.
+    REDCap project token for a study, or None if no project was created yet.
+    Only hits are cached, so a newly created project is picked up at once.
     """
-    doc = await db["studies"].find_one(
-        {"properties.study_id": study_id},
-        {"properties.redcap_server_api_url": 1}
-    )
-    if doc:
-        url = doc.get("properties", {}).get("redcap_server_api_url")
-        if url:
-            return url
-    return REDCAP_API_URL
+    cached = _key_cache.get(study_id)
+    if cached is not None:
+        return cached
+    key_doc = await db["keys"].find_one({"study_id": study_id})
+    if not key_doc:
+        return None
+    _key_cache.put(study_id, key_doc["api_key"])
+    return key_doc["api_key"]
 
 
-async def _submit_to_redcap(
-    db:  AsyncIOMotorDatabase,
-    rsp: ResponseEntry
-) -> None:
-    # look up API key
-    key_doc = await db["keys"].find_one({"study_id": rsp.study_id})
+async def _get_codebook(
+    db: AsyncIOMotorDatabase,
+    study_id: str
+) -> Dict[str, Dict[str, Any]]:
+    """
+    How the study's REDCap project codes multi and yesno answers, see
+    services/branching.py. Empty for projects created before answers were
+    coded, whose fields take the labels as text.
+    """
+    cached = _codebook_cache.get(study_id)
+    if cached is not None:
+        return cached
+    key_doc = await db["keys"].find_one({"study_id": study_id}, {"codebook": 1})
     if not key_doc:
-        return
+        return {}
+    book = key_doc.get("codebook") or {}
+    _codebook_cache.put(study_id, book)
+    return book
+
+
+breakers = BreakerRegistry(
+    window            = settings.redcap_breaker_window,
+    min_calls         = settings.redcap_breaker_min_calls,
+    failure_threshold = settings.redcap_breaker_failure_rate,
+    open_for_s        = settings.redcap_breaker_open_s,
+    half_open_calls   = settings.redcap_breaker_half_open_calls,
+)
+
 
-    api_key = key_doc["api_key"]
+async def _redcap_post(
+    url:     str,
+    payload: Dict[str, Any],
+    timeout: float,
+) -> httpx.Response:
+    """
+    POST to a REDCap API through that server's circuit breaker. Any error
+    raised by the POST, 5xx and 429 count as failures; while the circuit is
+    open this raises CircuitOpenError without touching the network.
+    """
+    breaker = breakers.get(url)
+    with tracer.span("redcap.post", server=url, content=payload.get("content")) as span:
+        if not breaker.allow():
+            raise CircuitOpenError(url)
+        try:
+            r = await get_http_client().post(url, data=payload, timeout=timeout)
+        except BaseException:
+            # even a cancelled call settles its outcome, or a half-open
+            # probe would hold its slot and keep the circuit shut for good
+            breaker.record_failure()
+            raise
+        if span is not None:
+            span.attrs["status"] = r.status_code
+    if r.status_code >= 500 or r.status_code == 429:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return r
+
+
+def _redcap_record(
+    rsp:  ResponseEntry,
+    book: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """
+    The flat REDCap row for one response, as a new repeat instance, with
+    answers coded by the project's codebook.
+    """
     record: Dict[str, Any] = {
         "field_record_id":            rsp.user_id,
         "redcap_repeat_instrument":   f"module_{rsp.module_id}",
@@ -92,14 +191,41 @@ async def _submit_to_redcap(
     }
     if rsp.responses:
         for k, v in json.loads(rsp.responses).items():
-            record[f"field_{k}"] = v
+            record.update(branching.encode_answer(f"field_{k}", v, book or {}))
     if rsp.entries:
         record[rsp.module_id] = rsp.entries
+    return record
+
+
+async def _submit_to_redcap(
+    db:  AsyncIOMotorDatabase,
+    rsp: ResponseEntry,
+    url: Optional[str] = None,
+) -> None:
+    with tracer.span("redcap.submit", study_id=rsp.study_id, module_id=rsp.module_id, server=url):
+        await _submit(db, rsp, url)
 
-    # backup
+
+async def _submit(
+    db:  AsyncIOMotorDatabase,
+    rsp: ResponseEntry,
+    url: Optional[str],
+) -> None:
+    with tracer.span("redcap.lookup_key"):
+        api_key = await _get_api_key(db, rsp.study_id)
+    if not api_key:
+        return
+
+    with tracer.span("redcap.lookup_codebook"):
+        book = await _get_codebook(db, rsp.study_id)
+    record = _redcap_record(rsp, book)
+
+    # backup: the record as sent to REDCap with the raw entry, one per
+    # attempt, as an audit trail next to the copy stored at ingest
     raw = dict(record)
     raw["raw"] = rsp.json()
-    await db["responses_backup"].insert_one(raw)
+    with tracer.span("mongo.insert", collection="responses_backup"):
+        await db["responses_backup"].insert_one(raw)
 
     # post to REDCap
     payload = {
@@ -109,11 +235,14 @@ async def _submit_to_redcap(
         "type":    "flat",
         "data":    json.dumps([record]),
     }
-    url = await _get_redcap_api_url(db, rsp.study_id)
+    if url is None:
+        with tracer.span("redcap.lookup_url"):
+            url = await redcap_url(db, rsp.study_id)
     try:
-        async with httpx.AsyncClient() as client:
-            r = await client.post(url, data=payload, timeout=15.0)
-            r.raise_for_status()
+        r = await _redcap_post(url, payload, timeout=15.0)
+        r.raise_for_status()
+    except CircuitOpenError:
+        raise
     except httpx.HTTPStatusError as e:
         logger.error(
             "REDCap API error %s for study %s, module %s: %s",
@@ -132,93 +261,80 @@ async def _submit_to_redcap(
         raise
 
 
+async def _deliver(url: str, payload: Dict[str, Any]) -> None:
+    await _submit_to_redcap(get_db(), ResponseEntry(**payload), url)
+
+
+delivery = RedcapDelivery(
+    handler                = _deliver,
+    breakers               = breakers,
+    max_pending            = settings.redcap_max_pending,
+    max_pending_per_server = settings.redcap_max_pending_per_server,
+    initial_concurrency    = settings.redcap_initial_concurrency,
+    max_concurrency        = settings.redcap_max_concurrency,
+    drain_interval_s       = settings.redcap_outbox_drain_interval_s,
+    max_attempts           = settings.redcap_max_attempts,
+)
+
+
+# data dictionary columns besides name, form, type and label; all empty by default
+_META_COLUMNS = [
+    "section_header", "select_choices_or_calculations", "field_note",
+    "text_validation_type_or_show_slider_number",
+    "text_validation_min", "text_validation_max",
+    "identifier", "branching_logic", "required_field",
+    "custom_alignment", "question_number",
+    "matrix_group_name", "matrix_ranking",
+    "field_annotation",
+]
+
+
+def _meta_row(field_name: str, form: str, label: str, **columns: str) -> Dict[str, Any]:
+    return {
+        "field_name":  field_name,
+        "form_name":   form,
+        "field_type":  "text",
+        "field_label": label,
+        **{k: "" for k in _META_COLUMNS},
+        **columns,
+    }
+
+
+def _study_modules(study: StudyModel) -> List[Dict[str, Any]]:
+    # plain by-alias dicts, as services/branching.py works on
+    return [m.model_dump(by_alias=True) for m in study.modules]
+
+
 async def _import_metadata(
     db:      AsyncIOMotorDatabase,
     study:   StudyModel,
     api_key: str
 ) -> None:
     meta: List[Dict[str, Any]] = []
+    # choices, slider bounds and branching_logic of multi/yesno/slider questions
+    coded = branching.redcap_fields(_study_modules(study))
 
     for idx, module in enumerate(study.modules):
         form = f"module_{module.id}"
         if idx == 0:
-            meta.append({
-                "field_name":     "field_record_id",
-                "form_name":      form,
-                "section_header": "",
-                "field_type":     "text",
-                "field_label":    "Record ID",
-                **{k: "" for k in [
-                    "select_choices_or_calculations","field_note",
-                    "text_validation_type_or_show_slider_number",
-                    "text_validation_min","text_validation_max",
-                    "identifier","branching_logic","required_field",
-                    "custom_alignment","question_number",
-                    "matrix_group_name","matrix_ranking",
-                    "field_annotation"
-                ]}
-            })
+            meta.append(_meta_row("field_record_id", form, "Record ID"))
 
         for suffix,label in [
             (f"response_time_in_ms_{idx}", "Response Time (ms)"),
             (f"response_time_{idx}",      "Response Time"),
         ]:
-            meta.append({
-                "field_name":     f"field_{suffix}",
-                "form_name":      form,
-                "section_header": "",
-                "field_type":     "text",
-                "field_label":    label,
-                **{k: "" for k in [
-                    "select_choices_or_calculations","field_note",
-                    "text_validation_type_or_show_slider_number",
-                    "text_validation_min","text_validation_max",
-                    "identifier","branching_logic","required_field",
-                    "custom_alignment","question_number",
-                    "matrix_group_name","matrix_ranking",
-                    "field_annotation"
-                ]}
-            })
+            meta.append(_meta_row(f"field_{suffix}", form, label))
 
         params = module.params
         if hasattr(params, "sections"):
             for section in params.sections:
                 for q in section.questions:
-                    meta.append({
-                        "field_name":     f"field_{q.id}",
-                        "form_name":      form,
-                        "section_header": "",
-                        "field_type":     "text",
-                        "field_label":    q.text,
-                        **{k: "" for k in [
-                            "select_choices_or_calculations","field_note",
-                            "text_validation_type_or_show_slider_number",
-                            "text_validation_min","text_validation_max",
-                            "identifier","branching_logic","required_field",
-                            "custom_alignment","question_number",
-                            "matrix_group_name","matrix_ranking",
-                            "field_annotation"
-                        ]}
-                    })
+                    name = f"field_{q.id}"
+                    meta.append(_meta_row(name, form, q.text, **coded.get(name, {})))
         else:
-            meta.append({
-                "field_name":     f"field_{params.id}",
-                "form_name":      form,
-                "section_header": "",
-                "field_type":     "text",
-                "field_label":    "PVT results",
-                **{k: "" for k in [
-                    "select_choices_or_calculations","field_note",
-                    "text_validation_type_or_show_slider_number",
-                    "text_validation_min","text_validation_max",
-                    "identifier","branching_logic","required_field",
-                    "custom_alignment","question_number",
-                    "matrix_group_name","matrix_ranking",
-                    "field_annotation"
-                ]}
-            })
-
-    url = await _get_redcap_api_url(db, study.properties.study_id)
+            meta.append(_meta_row(f"field_{params.id}", form, "PVT results"))
+
+    url = await redcap_url(db, study.properties.study_id)
     payload = {
         "token":   api_key,
         "content": "metadata",
@@ -226,9 +342,8 @@ async def _import_metadata(
         "type":    "flat",
         "data":    json.dumps(meta),
     }
-    async with httpx.AsyncClient() as client:
-        r = await client.post(url, data=payload, timeout=30.0)
-        r.raise_for_status()
+    r = await _redcap_post(url, payload, timeout=30.0)
+    r.raise_for_status()
 
 
 async def _enable_repeating_instruments(
@@ -241,7 +356,7 @@ async def _enable_repeating_instruments(
         for m in study.modules
     ]
 
-    url = await _get_redcap_api_url(db, study.properties.study_id)
+    url = await redcap_url(db, study.properties.study_id)
     payload = {
         "token":   api_key,
         "content": "repeatingFormsEvents",
@@ -249,9 +364,8 @@ async def _enable_repeating_instruments(
         "type":    "flat",
         "data":    json.dumps(repeating),
     }
-    async with httpx.AsyncClient() as client:
-        r = await client.post(url, data=payload, timeout=30.0)
-        r.raise_for_status()
+    r = await _redcap_post(url, payload, timeout=30.0)
+    r.raise_for_status()
 
 
 async def _import_user(
@@ -282,7 +396,7 @@ async def _import_user(
         "forms_export":                 {},
     }]
 
-    url = await _get_redcap_api_url(db, username)
+    url = await redcap_url(db, username)
     payload = {
         "token":   api_key,
         "content": "user",
@@ -290,9 +404,8 @@ async def _import_user(
         "type":    "flat",
         "data":    json.dumps(user_payload),
     }
-    async with httpx.AsyncClient() as client:
-        r = await client.post(url, data=payload, timeout=30.0)
-        r.raise_for_status()
+    r = await _redcap_post(url, payload, timeout=30.0)
+    r.raise_for_status()
 
 
 @router.post(
@@ -302,49 +415,53 @@ async def _import_user(
 )
 async def save_log(
     log: LogEntry                      = Depends(),
-    db:  AsyncIOMotorDatabase         = Depends(get_db),
 ):
-    await db["logs"].insert_one(log.dict())
+    ingest_log(log)
 
 
 @router.post(
     "/response",
     status_code=status.HTTP_202_ACCEPTED,
-    summary="Back up one response and queue REDCap push"
+    summary="Back up one response and queue REDCap push",
+    responses={
+        409: {"description": "A request with this key is still being stored, see Retry-After"},
+        429: {"description": "REDCap delivery is backed up, see Retry-After"},
+    },
+    openapi_extra=RESPONSE_BODY,
 )
 async def save_response(
-    background: BackgroundTasks,
-    data_type:           str  = Form(...),
-    user_id:             str  = Form(...),
-    study_id:            str  = Form(...),
-    module_index:        int  = Form(...),
-    platform:            str  = Form(...),
-    module_id:           str  = Form(...),
-    module_name:         str  = Form(...),
-    responses:           Optional[str] = Form(None),
-    entries:             Optional[str] = Form(None),
-    response_time:       str  = Form(...),
-    response_time_in_ms: int  = Form(...),
-    alert_time:          str  = Form(...),
-    db:                  AsyncIOMotorDatabase = Depends(get_db),
+    response:           Response,
+    rsp:                ResponseEntry = Depends(response_entry),
+    idempotency_header: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db:                 AsyncIOMotorDatabase = Depends(get_db),
 ):
-    rsp = ResponseEntry(
-        data_type           = data_type,
-        user_id             = user_id,
-        study_id            = study_id,
-        module_index        = module_index,
-        platform            = platform,
-        module_id           = module_id,
-        module_name         = module_name,
-        responses           = responses,
-        entries             = json.loads(entries) if entries else None,
-        response_time       = response_time,
-        response_time_in_ms = response_time_in_ms,
-        alert_time          = alert_time,
+    key = idempotency_header or rsp.idempotency_key or idempotency.derive_key(
+        rsp.study_id, rsp.user_id, rsp.module_id, rsp.alert_time
     )
-    await db["responses_backup"].insert_one(rsp.dict())
-    background.add_task(_submit_to_redcap, db, rsp)
-    return {"accepted": True}
+    rsp.idempotency_key = key
+    result = {"accepted": True}
+    response.headers["Idempotency-Key"] = key
+    tracer.set(study_id=rsp.study_id, module_id=rsp.module_id)
+    with tracer.span("idempotency.claim"):
+        original = await idempotency.claim(db, key, rsp.study_id)
+    if original is not None:
+        response.headers["Idempotent-Replayed"] = "true"
+        return original
+    url, admitted = None, False
+    try:
+        with tracer.span("redcap.admit"):
+            url, admitted = await ingest.admit_delivery(db, delivery, rsp.study_id)
+        with tracer.span("mongo.upsert", collection="responses_backup"):
+            await ingest.store_response(db, "responses_backup", rsp)
+        await idempotency.complete(db, key, result)
+    except Exception:
+        # the retry has to go through; what did get stored it upserts again
+        if admitted:
+            delivery.cancel(url)
+        await idempotency.release(db, key)
+        raise
+    await ingest.queue_delivery(delivery, url, admitted, rsp)
+    return result
 
 
 @router.get("/response/{study_id}/{user_id}")
@@ -363,24 +480,23 @@ async def get_combined_response(
     if "_id" in mongo_record:
         mongo_record["_id"] = str(mongo_record["_id"])
 
-    key_doc = await db["keys"].find_one({"study_id": study_id})
+    api_key = await _get_api_key(db, study_id)
     redcap_resp: Optional[Dict[str, Any]] = None
-    if key_doc:
-        url = await _get_redcap_api_url(db, study_id)
+    if api_key:
+        url = await redcap_url(db, study_id)
         payload = {
-            "token": key_doc["api_key"],
+            "token": api_key,
             "content": "record",
             "format": "json",
             "type": "flat",
         }
         try:
-            async with httpx.AsyncClient() as client:
-                r = await client.post(url, data=payload, timeout=15.0)
-                r.raise_for_status()
-                for rec in r.json():
-                    if rec.get("field_record_id") == user_id:
-                        redcap_resp = rec
-                        break
+            r = await _redcap_post(url, payload, timeout=15.0)
+            r.raise_for_status()
+            for rec in r.json():
+                if rec.get("field_record_id") == user_id:
+                    redcap_resp = rec
+                    break
         except Exception:
             redcap_resp = None
 
@@ -396,10 +512,14 @@ async def get_combined_response(
     summary="Create a new REDCap project for this study + user"
 )
 async def create_redcap_project(
-    username: str,
-    study:    StudyModel,
-    db:       AsyncIOMotorDatabase = Depends(get_db),
+    username:  str,
+    validated: ValidatedStudy       = Depends(validated_study),
+    db:        AsyncIOMotorDatabase = Depends(get_db),
 ):
+    """
+    Body: a `StudyCreate` document, validated like in POST /studies.
+    """
+    study = validated.study
     sid = study.properties.study_id
 
     # 0) if we already have a key for this study, don’t re–create
@@ -413,9 +533,14 @@ async def create_redcap_project(
         )
 
     # 1) create the project on the REDCap server
-    url = await _get_redcap_api_url(db, sid)
+    if not settings.redcap_super_api_token:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="REDCAP_SUPER_API_TOKEN is not configured on this server"
+        )
+    url = await redcap_url(db, sid)
     payload = {
-        "token":   REDCAP_SUPER_TOKEN,
+        "token":   settings.redcap_super_api_token,
         "content": "project",
         "format":  "json",
         "type":    "flat",
@@ -428,24 +553,35 @@ async def create_redcap_project(
             "project_notes":                study.properties.instructions,
         }]),
     }
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(url, data=payload, timeout=30.0)
-        try:
-            resp.raise_for_status()
-        except httpx.HTTPError:
-            raise HTTPException(
-                status_code=status.HTTP_502_BAD_GATEWAY,
-                detail=f"REDCap project creation failed: {resp.text}"
-            )
+    try:
+        resp = await _redcap_post(url, payload, timeout=30.0)
+    except CircuitOpenError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"REDCap server {url} is currently unavailable"
+        )
+    try:
+        resp.raise_for_status()
+    except httpx.HTTPError:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"REDCap project creation failed: {resp.text}"
+        )
 
     api_key = resp.text.strip().strip('"')
 
     # 2) persist that API key privately
     await db["keys"].replace_one(
         {"study_id": sid},
-        {"study_id": sid, "api_key": api_key},
+        {
+            "study_id":   sid,
+            "api_key":    api_key,
+            "codebook":   branching.codebook(_study_modules(study)),
+            "updated_at": int(time.time() * 1000),
+        },
         upsert=True
     )
+    bus.publish("keys", sid)
 
     # 3) mirror all modules/forms/users into REDCap
     await _import_metadata(db, study, api_key)
@@ -1,74 +1,266 @@
+import base64
 import json
-from typing import Optional, List
+import re
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, Literal, Optional, List, Tuple
 
-from fastapi import APIRouter, Depends, BackgroundTasks, Form, status
-from pydantic import BaseModel
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
+from config import settings
 from db import get_db
-from routers.redcap import _submit_to_redcap
+from models.response import ResponseEntry
+from routers.redcap import RESPONSE_BODY, delivery, response_entry
+from services import idempotency, ingest
+from services.cache import TTLCache
+from services.downsample import lttb
+from services.study_lookup import latest_module, resolve_study_id
+from services.tracing import tracer
 
 router = APIRouter(tags=["responses"])
 
-class ResponseEntry(BaseModel):
-    data_type:           str
-    user_id:             str
-    study_id:            str
-    module_index:        int
-    platform:            str
-    module_id:           str
-    module_name:         str
-    responses:           Optional[str]   
-    entries:             Optional[List[int]]
-    response_time:       str
-    response_time_in_ms: int
-    alert_time:          str
-
 @router.post(
     "/response",
     status_code=status.HTTP_202_ACCEPTED,
-    summary="Save a response and queue REDCap push"
+    summary="Save a response and queue REDCap push",
+    responses={
+        409: {"description": "A request with this key is still being stored, see Retry-After"},
+        429: {"description": "REDCap delivery is backed up, see Retry-After"},
+    },
+    openapi_extra=RESPONSE_BODY,
 )
 async def save_response(
-    background: BackgroundTasks,
-    data_type:           str  = Form(...),
-    user_id:             str  = Form(...),
-    study_id:            str  = Form(...),
-    module_index:        int  = Form(...),
-    platform:            str  = Form(...),
-    module_id:           str  = Form(...),
-    module_name:         str  = Form(...),
-    responses:           Optional[str] = Form(None),
-    entries:             Optional[str] = Form(None),
-    response_time:       str  = Form(...),
-    response_time_in_ms: int  = Form(...),
-    alert_time:          str  = Form(...),
-    db:                   AsyncIOMotorDatabase = Depends(get_db),
+    response:           Response,
+    rsp:                ResponseEntry = Depends(response_entry),
+    idempotency_header: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db:                 AsyncIOMotorDatabase = Depends(get_db),
+):
+    # a retry of an already stored response gets the original answer, no writes
+    key = idempotency_header or rsp.idempotency_key or idempotency.derive_key(
+        rsp.study_id, rsp.user_id, rsp.module_id, rsp.alert_time
+    )
+    rsp.idempotency_key = key
+    result = {"accepted": True}
+    response.headers["Idempotency-Key"] = key
+    tracer.set(study_id=rsp.study_id, module_id=rsp.module_id)
+    with tracer.span("idempotency.claim"):
+        original = await idempotency.claim(db, key, rsp.study_id)
+    if original is not None:
+        response.headers["Idempotent-Replayed"] = "true"
+        return original
+
+    url, admitted = None, False
+    try:
+        # admission control happens before any write
+        with tracer.span("redcap.admit"):
+            url, admitted = await ingest.admit_delivery(db, delivery, rsp.study_id)
+
+        # back up into Mongo; both writes are upserts on the key, so a retry
+        # after only the first went through doesn't duplicate it
+        with tracer.span("mongo.upsert", collection="responses_backup"):
+            await ingest.store_response(db, "responses_backup", rsp)
+
+        # also save into responses collection
+        with tracer.span("mongo.upsert", collection="responses"):
+            await ingest.store_response(db, "responses", rsp)
+
+        # only now do retries get "accepted" replayed
+        await idempotency.complete(db, key, result)
+    except Exception:
+        # a 429, a failed lookup or a failed write: give the key back for the retry
+        if admitted:
+            delivery.cancel(url)
+        await idempotency.release(db, key)
+        raise
+
+    # queue the REDCap push, or park it in the outbox if REDCap is backed up
+    await ingest.queue_delivery(delivery, url, admitted, rsp)
+
+    return result
+
+
+# fields returned by view=summary; view=full returns the stored document
+_SUMMARY = {
+    "data_type": 1, "module_id": 1, "module_name": 1, "module_index": 1,
+    "platform": 1, "response_time": 1, "response_time_in_ms": 1, "alert_time": 1,
+}
+
+
+def _encode_cursor(doc: Dict[str, Any]) -> str:
+    raw = json.dumps([doc["response_time_in_ms"], str(doc["_id"])]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ms, oid = json.loads(raw)
+        return int(ms), ObjectId(oid)
+    except (ValueError, TypeError, InvalidId):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid cursor")
+
+
+@router.get(
+    "/studies/{study_id}/participants/{user_id}/responses",
+    summary="A participant's responses over time, one page at a time",
+)
+async def list_participant_responses(
+    study_id: str,
+    user_id:  str,
+    module:   Optional[List[str]] = Query(None, description="Only these module ids"),
+    since:    Optional[datetime] = Query(None, description="Responses at or after this time"),
+    until:    Optional[datetime] = Query(None, description="Responses before this time"),
+    order:    Literal["desc", "asc"] = "desc",
+    view:     Literal["summary", "full"] = "summary",
+    limit:    int = Query(50, ge=1, le=500),
+    cursor:   Optional[str] = Query(None, description="next_cursor of the previous page"),
+    db:       AsyncIOMotorDatabase = Depends(get_db),
 ):
-    # hydrate the Pydantic model
-    entries_list = json.loads(entries) if entries else None
-    rsp = ResponseEntry(
-        data_type           = data_type,
-        user_id             = user_id,
-        study_id            = study_id,
-        module_index        = module_index,
-        platform            = platform,
-        module_id           = module_id,
-        module_name         = module_name,
-        responses           = responses,
-        entries             = entries_list,
-        response_time       = response_time,
-        response_time_in_ms = response_time_in_ms,
-        alert_time          = alert_time,
+    """
+    Keyset pagination on (response_time_in_ms, _id), served by the
+    (study_id, user_id[, module_id], response_time_in_ms, _id) indexes,
+    so every page costs the same however deep into the history it is.
+    """
+    # responses are stored under the study_id, also when asked by permalink
+    study_id = await resolve_study_id(db, study_id)
+    query: Dict[str, Any] = {"study_id": study_id, "user_id": user_id}
+    if module:
+        query["module_id"] = module[0] if len(module) == 1 else {"$in": module}
+    window: Dict[str, int] = {}
+    if since:
+        window["$gte"] = int(since.timestamp() * 1000)
+    if until:
+        window["$lt"] = int(until.timestamp() * 1000)
+    if window:
+        query["response_time_in_ms"] = window
+    if cursor:
+        ms, oid = _decode_cursor(cursor)
+        op = "$lt" if order == "desc" else "$gt"
+        query = {"$and": [query, {"$or": [
+            {"response_time_in_ms": {op: ms}},
+            {"response_time_in_ms": ms, "_id": {op: oid}},
+        ]}]}
+
+    direction = -1 if order == "desc" else 1
+    docs = await (
+        db["responses_backup"]
+        .find(query, _SUMMARY if view == "summary" else None)
+        .sort([("response_time_in_ms", direction), ("_id", direction)])
+        .limit(limit + 1)
+        .to_list(length=limit + 1)
     )
+    more = len(docs) > limit
+    docs = docs[:limit]
+    next_cursor = _encode_cursor(docs[-1]) if more else None
+    for doc in docs:
+        doc["_id"] = str(doc["_id"])
+    return {"items": docs, "next_cursor": next_cursor}
+
+
+# variables are question ids; anything else can't be a field path
+_VARIABLE = re.compile(r"^[A-Za-z0-9_-]+$")
+
+# responses are re-read from this far behind the newest one seen, so one
+# stored by another worker with a slightly older _id is still picked up
+_OVERLAP = timedelta(seconds=60)
 
-    # back up into Mongo
-    await db["responses_backup"].insert_one(rsp.dict())
 
-    # also save into responses collection
-    await db["responses"].insert_one(rsp.dict())
+@dataclass
+class _Series:
+    # response _id -> (response_time_in_ms, value)
+    points: Dict[ObjectId, Tuple[int, float]] = field(default_factory=dict)
+    newest: Optional[ObjectId] = None
+
+
+_series: TTLCache[_Series] = TTLCache(
+    maxsize=settings.graph_cache_size, ttl_s=settings.graph_cache_ttl_s
+)
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+async def _extend(db: AsyncIOMotorDatabase, series: _Series, query: Dict[str, Any], variable: str) -> None:
+    """
+    Add the responses stored since the series was last read. The variable
+    is picked out of `answers` in Mongo; responses stored before answers
+    were parsed out have only the raw JSON, which is parsed here.
+    """
+    if series.newest is not None:
+        since = ObjectId.from_datetime(series.newest.generation_time - _OVERLAP)
+        query = {**query, "_id": {"$gte": since}}
+    rows = await db["responses_backup"].aggregate([
+        {"$match": {**query, "answers": {"$exists": True}}},
+        {"$project": {"t": "$response_time_in_ms", "v": f"$answers.{variable}"}},
+    ]).to_list(length=None)
+    legacy = await db["responses_backup"].find(
+        {**query, "answers": {"$exists": False}}, {"response_time_in_ms": 1, "responses": 1}
+    ).to_list(length=None)
+    for doc in legacy:
+        try:
+            answers = json.loads(doc.get("responses") or "{}")
+        except ValueError:
+            answers = {}
+        value = answers.get(variable) if isinstance(answers, dict) else None
+        rows.append({"_id": doc["_id"], "t": doc.get("response_time_in_ms"), "v": value})
+
+    for row in rows:
+        value = _number(row.get("v"))
+        if value is not None and row.get("t") is not None:
+            series.points[row["_id"]] = (row["t"], value)
+        if series.newest is None or row["_id"] > series.newest:
+            series.newest = row["_id"]
+
+
+@router.get(
+    "/studies/{study_id}/participants/{user_id}/graph/{module_id}",
+    summary="A participant's series for a module's feedback graph",
+)
+async def get_participant_graph(
+    study_id:  str,
+    user_id:   str,
+    module_id: str,
+    db:        AsyncIOMotorDatabase = Depends(get_db),
+):
+    """
+    The module's `graph.variable` over time, downsampled to
+    `graph.max_points` with LTTB so peaks survive. Series are cached per
+    participant and only responses stored since the last request are read.
+    """
+    # responses are stored under the study_id, also when asked by permalink
+    study_id = await resolve_study_id(db, study_id)
+    _, module = await latest_module(db, study_id, module_id)
+    graph = module.get("graph") or {}
+    variable = graph.get("variable")
+    if not graph.get("display") or not variable:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, f"Module '{module_id}' has no graph")
+    if not _VARIABLE.match(variable):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Graph variable '{variable}' is not a question id")
 
-    # queue the REDCap push using the same live db client
-    background.add_task(_submit_to_redcap, db, rsp)
+    key = (study_id, user_id, module_id, variable)
+    series = _series.get(key) or _Series()
+    await _extend(db, series, {"study_id": study_id, "user_id": user_id, "module_id": module_id}, variable)
+    _series.put(key, series)
 
-    return {"accepted": True}
\ No newline at end of file
+    points = sorted(series.points.values())
+    return {
+        "module_id":  module_id,
+        "variable":   variable,
+        "title":      graph.get("title"),
+        "type":       graph.get("type"),
+        "total":      len(points),
+        "points":     [list(p) for p in lttb(points, graph.get("max_points") or 0)],
+    }
@@ -1,16 +1,84 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
-from bson import ObjectId
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, status
+from typing import Any, Dict, List, NamedTuple, Optional
 from motor.motor_asyncio import AsyncIOMotorDatabase
+import json
 import time
-from fastapi.responses import JSONResponse
-from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
 
+from config import settings
 from db import get_db
-from models.study import StudyCreate, StudyOut
+from models.study import Module, Properties, Section, StudyOut
+from services.cache import TTLCache
+from services import assets, media, snapshots
+from services.compression import PrecompressedBody, negotiate
+from services.cache_bus import bus
+from services.study_hash import canonical_hash
+from services.study_lookup import latest_module, study_filter
+from services.study_views import COMPILED
+from services.validation_pool import ValidatedStudy, validated_study
 
 router = APIRouter(prefix="/studies", tags=["studies"])
 
+class _Rendered(NamedTuple):
+    etag: str
+    # media type -> body with its gzip/br encodings
+    variants: Dict[str, PrecompressedBody]
+
+
+# rendered latest version per requested id; evicted across workers by the cache bus
+_latest: TTLCache[_Rendered] = TTLCache(
+    maxsize=settings.study_cache_size, ttl_s=settings.study_cache_ttl_s
+)
+
+
+def _evict_study(study_id):
+    if study_id is None:
+        _latest.clear()
+    else:
+        _latest.pop(study_id)
+
+
+bus.register("studies", _evict_study)
+
+# views computed from a version, per content hash; versions never change,
+# so nothing to evict
+_assets: TTLCache[List[Dict[str, Any]]] = TTLCache(
+    maxsize=settings.study_cache_size, ttl_s=settings.study_cache_ttl_s
+)
+_graphs: TTLCache[Dict[str, Any]] = TTLCache(
+    maxsize=settings.study_cache_size, ttl_s=settings.study_cache_ttl_s
+)
+_branching: TTLCache[Dict[str, Any]] = TTLCache(
+    maxsize=settings.study_cache_size, ttl_s=settings.study_cache_ttl_s
+)
+
+# top-level parts a partial fetch can select with ?fields=
+_PARTS = ("properties", "modules")
+
+
+def _split(value: Optional[str]) -> List[str]:
+    return [v.strip() for v in (value or "").split(",") if v.strip()]
+
+
+def _dump(model, data: Dict[str, Any]) -> Dict[str, Any]:
+    # same shape the pieces have in a full StudyOut response
+    return model.model_validate(data).model_dump(mode="json", by_alias=True, exclude_none=True)
+
+
+def _etag(content_hash: str) -> str:
+    # weak: the JSON, MessagePack and compressed bodies are all the same version
+    return f'W/"{content_hash}"'
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    tags = [t.strip() for t in request.headers.get("if-none-match", "").split(",")]
+    return "*" in tags or any(t.removeprefix("W/") == etag.removeprefix("W/") for t in tags)
+
+
+def _negotiated(body: Any, request: Request) -> Response:
+    wanted = media.negotiate(request.headers.get("accept"))
+    return Response(media.encode(body, wanted), media_type=wanted, headers={"Vary": "Accept"})
+
 
 @router.get(
     "/{study_id}",
@@ -20,23 +88,244 @@ router = APIRouter(prefix="/studies", tags=["studies"])
 )
 async def get_latest_study(
     study_id: str,
+    request: Request,
+    fields: Optional[str] = Query(
+        None, description="Comma-separated parts to return: properties, modules"
+    ),
+    modules: Optional[str] = Query(
+        None, description="Comma-separated module ids; only these modules are returned"
+    ),
     db: AsyncIOMotorDatabase = Depends(get_db),
 ):
-    filters = []
-    if ObjectId.is_valid(study_id):
-        filters.append({"_id": ObjectId(study_id)})
-    filters.append({"properties.study_id": study_id})
+    if fields or modules:
+        return await _partial_study(db, study_id, _split(fields), _split(modules), request)
+
+    rendered = _latest.get(study_id)
+    if rendered is None:
+        doc = await db["studies"].find_one(
+            study_filter(study_id),
+            sort=[("timestamp", -1)],
+        )
+        if not doc:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Study '{study_id}' not found"
+            )
+        # versions saved before content hashing get theirs computed here
+        etag = _etag(doc.get("content_hash") or canonical_hash(doc))
+        # same bytes the snapshot holds, i.e. StudyOut without None fields
+        body = PrecompressedBody(snapshots.render(doc), best=_caching())
+        rendered = _Rendered(etag, {media.JSON: body})
+        _latest.put(study_id, rendered)
+
+    headers = {"ETag": rendered.etag, "Vary": "Accept, Accept-Encoding"}
+    if _not_modified(request, rendered.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    wanted = media.negotiate(request.headers.get("accept"))
+    entry = rendered.variants.get(wanted)
+    if entry is None:
+        body = media.encode(json.loads(rendered.variants[media.JSON].body), wanted)
+        entry = rendered.variants[wanted] = PrecompressedBody(body, media_type=wanted, best=_caching())
+    return await _encoded_response(entry, request, headers)
+
+
+async def _partial_study(
+    db: AsyncIOMotorDatabase,
+    study_id: str,
+    fields: List[str],
+    module_ids: List[str],
+    request: Request,
+) -> Response:
+    """
+    Only the selected parts of the latest version. The projection runs in
+    Mongo, so unselected modules are neither transferred nor validated.
+    """
+    unknown = set(fields) - set(_PARTS)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields {sorted(unknown)}, choose from {list(_PARTS)}"
+        )
+    selected = fields or list(_PARTS)
+    projection: Dict[str, Any] = {"_type": 1, "timestamp": 1}
+    if "properties" in selected:
+        projection["properties"] = 1
+    if "modules" in selected:
+        projection["modules"] = {
+            "$filter": {"input": "$modules", "cond": {"$in": ["$$this.id", module_ids]}}
+        } if module_ids else 1
 
     doc = await db["studies"].find_one(
-        {"$or": filters},
-        sort=[("timestamp", -1)],
+        study_filter(study_id), projection, sort=[("timestamp", -1)]
     )
     if not doc:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Study '{study_id}' not found"
         )
-    return doc
+    out: Dict[str, Any] = {"_id": str(doc["_id"]), "_type": doc.get("_type", "study"), "timestamp": doc["timestamp"]}
+    if "properties" in selected:
+        out["properties"] = _dump(Properties, doc["properties"])
+    if "modules" in selected:
+        out["modules"] = [_dump(Module, m) for m in doc.get("modules") or []]
+    return _negotiated(out, request)
+
+
+@router.get(
+    "/{study_id}/modules/{module_id}",
+    summary="One module of the latest study version",
+)
+async def get_study_module(
+    study_id: str,
+    module_id: str,
+    request: Request,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    doc, module = await latest_module(db, study_id, module_id)
+    return _negotiated(
+        {"_id": str(doc["_id"]), "timestamp": doc["timestamp"], "module": _dump(Module, module)},
+        request,
+    )
+
+
+@router.get(
+    "/{study_id}/modules/{module_id}/sections/{section_id}",
+    summary="One survey section of the latest study version",
+)
+async def get_study_section(
+    study_id: str,
+    module_id: str,
+    section_id: str,
+    request: Request,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    doc, module = await latest_module(db, study_id, module_id)
+    sections = module.get("params", {}).get("sections") or []
+    section = next((s for s in sections if s.get("id") == section_id), None)
+    if section is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Section '{section_id}' not found in module '{module_id}'"
+        )
+    return _negotiated(
+        {"_id": str(doc["_id"]), "timestamp": doc["timestamp"], "module_id": module_id,
+         "section": _dump(Section, section)},
+        request,
+    )
+
+
+@router.get(
+    "/{study_id}/assets",
+    summary="Media URLs of the latest study version, for prefetching",
+)
+async def get_study_assets(
+    study_id: str,
+    request: Request,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    """
+    Deduplicated banner, media and thumbnail URLs with their type and the
+    module and question using them, so the app can fetch them all at
+    enrollment instead of when a survey reaches them.
+    """
+    return await _derived(db, study_id, request, _assets, "assets", assets.manifest)
+
+
+@router.get(
+    "/{study_id}/unlock-graph",
+    summary="Compiled module unlock graph of the latest study version",
+)
+async def get_unlock_graph(
+    study_id: str,
+    request: Request,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    """
+    `unlock_after` compiled into topological `order`, `requires` and
+    `unlocks` maps and the modules of each condition, so the app can tell
+    what a completed module unlocks without walking the study. Checked
+    and stored when a version is saved; older versions are compiled on
+    read, and only theirs can have non-empty `errors`.
+    """
+    return await _derived(db, study_id, request, _graphs, "graph", stored="unlock_graph")
+
+
+@router.get(
+    "/{study_id}/branching",
+    summary="Compiled question branching of the latest study version",
+)
+async def get_branching(
+    study_id: str,
+    request: Request,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    """
+    Per survey, the rule that shows each branched question and, per
+    question, the questions its answer affects, so the app re-evaluates
+    only those when an answer changes. Checked and stored when a version
+    is saved.
+    """
+    return await _derived(db, study_id, request, _branching, "branching", stored="branching")
+
+
+async def _derived(
+    db: AsyncIOMotorDatabase,
+    study_id: str,
+    request: Request,
+    cache: TTLCache,
+    key: str,
+    build=None,
+    stored: Optional[str] = None,
+) -> Response:
+    """
+    A view of the latest version, served with the study's ETag: the
+    `stored` field saved with the version, else `build(doc)` (by default
+    its COMPILED builder), cached by content hash. Cache hits only read
+    the hash from Mongo.
+    """
+    projection: Dict[str, Any] = {"content_hash": 1}
+    if stored:
+        projection[stored] = 1
+        build = build or COMPILED[stored]
+    latest = await db["studies"].find_one(
+        study_filter(study_id), projection, sort=[("timestamp", -1)]
+    )
+    if not latest:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Study '{study_id}' not found"
+        )
+    content_hash = latest.get("content_hash")
+    found = latest.get(stored) if stored else None
+    if found is None and content_hash:
+        found = cache.get(content_hash)
+    if found is None:
+        doc = await db["studies"].find_one({"_id": latest["_id"]})
+        content_hash = content_hash or canonical_hash(doc)
+        found = build(doc)
+        cache.put(content_hash, found)
+
+    etag = _etag(content_hash)
+    if _not_modified(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Vary": "Accept"})
+    response = _negotiated(
+        {"_id": str(latest["_id"]), "content_hash": content_hash, key: found}, request
+    )
+    response.headers["ETag"] = etag
+    return response
+
+
+def _caching() -> bool:
+    # with caching off every request compresses again, so only at the fast level
+    return _latest.ttl_s > 0
+
+
+async def _encoded_response(entry: PrecompressedBody, request: Request, headers: Dict[str, str]) -> Response:
+    encoding = negotiate(request.headers.get("accept-encoding"))
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(await entry.get(encoding), media_type=entry.media_type, headers=headers)
 
 
 @router.get(
@@ -47,6 +336,7 @@ async def get_latest_study(
 )
 async def get_all_versions(
     study_id: str,
+    request: Request,
     db: AsyncIOMotorDatabase = Depends(get_db),
 ):
     docs = await (
@@ -55,7 +345,14 @@ async def get_all_versions(
         .sort("timestamp", -1)
         .to_list(length=100)
     )
-    return docs
+    wanted = media.negotiate(request.headers.get("accept"))
+    if wanted == media.JSON:
+        return docs
+    body = [
+        StudyOut.model_validate(d).model_dump(mode="json", by_alias=True, exclude_none=True)
+        for d in docs
+    ]
+    return Response(media.encode(body, wanted), media_type=wanted, headers={"Vary": "Accept"})
 
 
 @router.post(
@@ -64,29 +361,65 @@ async def get_all_versions(
     status_code=status.HTTP_201_CREATED,
 )
 async def create_study(
-    payload: StudyCreate,
+    background: BackgroundTasks,
+    validated: ValidatedStudy = Depends(validated_study),
     db: AsyncIOMotorDatabase = Depends(get_db),
 ):
+    """
+    Body: a `StudyCreate` document. Large bodies are validated off the
+    event loop, see services/validation_pool.py.
+
+    Each version stores the hash of its content. Re-posting a test study
+    whose content matches its latest version returns that version instead
+    of writing a new one.
+    """
+    payload = validated.study
     sid = payload.properties.study_id
-    existing = await db["studies"].find_one({"properties.study_id": sid})
-    if existing and not sid.startswith("test"):
+    doc = dict(validated.doc)
+    content_hash = canonical_hash(doc)
+
+    latest = await db["studies"].find_one(
+        {"properties.study_id": sid}, {"content_hash": 1}, sort=[("timestamp", -1)]
+    )
+    if latest and not sid.startswith("test"):
         return JSONResponse(
             status_code=status.HTTP_200_OK,
             content={
                 "message": "Study already exists. Using existing study.",
-                "permalink": str(existing["_id"]),
+                "permalink": str(latest["_id"]),
             },
         )
+    if latest:
+        latest_hash = latest.get("content_hash") or canonical_hash(
+            await db["studies"].find_one({"_id": latest["_id"]})
+        )
+        if latest_hash == content_hash:
+            # e.g. a designer autosave with nothing changed: no new version
+            return JSONResponse(
+                status_code=status.HTTP_200_OK,
+                content={
+                    "message": "Study unchanged. Using latest version.",
+                    "permalink": str(latest["_id"]),
+                    "content_hash": content_hash,
+                },
+                headers={"ETag": _etag(content_hash)},
+            )
 
-    doc = jsonable_encoder(payload, by_alias=True, exclude_none=True)
     doc["_type"] = "study"
     doc["timestamp"] = int(time.time() * 1000)
+    doc["content_hash"] = content_hash
+    doc.update(validated.views)
 
     result = await db["studies"].insert_one(doc)
+    bus.publish("studies", sid)
+    # static copy for Caddy, written off the event loop after the response
+    background.add_task(snapshots.publish, {**doc, "_id": result.inserted_id})
     return JSONResponse(
         status_code=status.HTTP_201_CREATED,
         content={
             "message": "New study created",
             "permalink": str(result.inserted_id),
+            "content_hash": content_hash,
         },
-    )
\ No newline at end of file
+        headers={"ETag": _etag(content_hash)},
+    )
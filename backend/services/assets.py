@@ -0,0 +1,30 @@
+# services/assets.py
+from typing import Any, Dict, List
+
+
+def _add(assets: Dict[str, Dict[str, Any]], url: Any, kind: str, ref: Dict[str, str]) -> None:
+    if not isinstance(url, str) or not url.strip():
+        return
+    url = url.strip()
+    entry = assets.setdefault(url, {"url": url, "type": kind, "refs": []})
+    entry["refs"].append(ref)
+
+
+def manifest(doc: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Every media URL a study version references, once per URL, in the order
+    the app meets them: the banner, then each media question's src and thumb
+    by module. `refs` lists where a URL is used, so one file shared by
+    several questions is fetched once.
+    """
+    assets: Dict[str, Dict[str, Any]] = {}
+    _add(assets, (doc.get("properties") or {}).get("banner_url"), "image", {"field": "banner_url"})
+    for module in doc.get("modules") or []:
+        for section in (module.get("params") or {}).get("sections") or []:
+            for question in section.get("questions") or []:
+                if question.get("type") != "media":
+                    continue
+                ref = {"module_id": module.get("id"), "question_id": question.get("id")}
+                _add(assets, question.get("src"), question.get("subtype") or "media", {**ref, "field": "src"})
+                _add(assets, question.get("thumb"), "image", {**ref, "field": "thumb"})
+    return list(assets.values())
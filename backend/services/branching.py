@@ -0,0 +1,228 @@
+# services/branching.py
+import logging
+import re
+from collections.abc import Hashable
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# question types the app can branch on
+SOURCE_TYPES = ("multi", "yesno", "slider")
+
+# hide_id of a question that is always shown
+_NO_SOURCE = ("", "none")
+
+# slider hide_value: a direction and an inclusive bound, e.g. ">50"
+_SLIDER_VALUE = re.compile(r"^\s*([<>])\s*(-?\d+(?:\.\d+)?)\s*$")
+
+# operator to show a question, for a rule's hide_if false / true
+_SHOW_OPS = {"=": ("=", "!="), ">": (">=", "<"), "<": ("<=", ">")}
+
+
+def _surveys(modules: List[Dict[str, Any]]) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    for module in modules:
+        sections = (module.get("params") or {}).get("sections")
+        if sections is not None:
+            yield module["id"], [q for s in sections for q in s.get("questions") or []]
+
+
+def _choices(question: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """
+    (code, label) pairs of a multi or yesno question as used in REDCap.
+    """
+    if question.get("type") == "multi":
+        return [(str(i), option) for i, option in enumerate(question.get("options") or [], 1)]
+    if question.get("type") == "yesno":
+        return [("1", question.get("yes_text") or "Yes"), ("0", question.get("no_text") or "No")]
+    return []
+
+
+def _code(source: Dict[str, Any], value: Any) -> Optional[str]:
+    labels = {label: code for code, label in _choices(source)}
+    if source.get("type") == "yesno":
+        # the designer offers plain Yes/No whatever the button texts are
+        labels.update({"Yes": "1", "No": "0", True: "1", False: "0"})
+    return labels.get(value)
+
+
+def _rule(question: Dict[str, Any], source: Optional[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    When `question` is shown, as {"source", "op", "value"}, or why its
+    hide_* fields can't be evaluated.
+    """
+    qid, sid, value = question["id"], question.get("hide_id"), question.get("hide_value")
+    if source is None:
+        return None, f"Question '{qid}' is shown depending on unknown question '{sid}'"
+    if sid == qid:
+        return None, f"Question '{qid}' is shown depending on itself"
+    if source.get("type") not in SOURCE_TYPES:
+        return None, f"Question '{qid}' depends on '{sid}', a {source.get('type')} question; only {', '.join(SOURCE_TYPES)} can be branched on"
+
+    if source["type"] == "slider":
+        match = _SLIDER_VALUE.match(str(value))
+        if not match:
+            return None, f"Question '{qid}' needs a hide_value like '>50' or '<50' for slider '{sid}', not '{value}'"
+        direction, bound = match.groups()
+        value = float(bound) if "." in bound else int(bound)
+    else:
+        direction = "="
+        if _code(source, value) is None:
+            choices = [label for _, label in _choices(source)]
+            return None, f"Question '{qid}' depends on '{sid}' answering '{value}', which is not one of {choices}"
+    op = _SHOW_OPS[direction][bool(question.get("hide_if"))]
+    return {"source": sid, "op": op, "value": value}, None
+
+
+def compile_branching(modules: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    The hide_id/hide_value/hide_if rules of every survey, per module id:
+
+    - `rules`: question id -> {"source", "op", "value"}, the question being
+      shown when the source's answer compares true, e.g. {"op": ">="}
+    - `dependents`: question id -> ids of the questions its answer shows or hides
+
+    plus `errors` for rules that point at unknown questions or values.
+    Works on plain by-alias dicts like compile_graph() in unlock_graph.py.
+    """
+    surveys: Dict[str, Any] = {}
+    errors: List[str] = []
+    for module_id, questions in _surveys(modules):
+        by_id = {q["id"]: q for q in questions}
+        rules: Dict[str, Dict[str, Any]] = {}
+        dependents: Dict[str, List[str]] = {}
+        for q in questions:
+            if q.get("hide_id") in _NO_SOURCE or q.get("hide_id") is None:
+                continue
+            rule, error = _rule(q, by_id.get(q["hide_id"]))
+            if error:
+                errors.append(f"Module '{module_id}': {error}")
+                continue
+            rules[q["id"]] = rule
+            dependents.setdefault(rule["source"], []).append(q["id"])
+        errors.extend(f"Module '{module_id}': {e}" for e in _cycles(rules))
+        surveys[module_id] = {"rules": rules, "dependents": dependents}
+    return {"surveys": surveys, "errors": errors}
+
+
+def compile_study(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    compile_branching() of a stored study document.
+    """
+    return compile_branching(doc.get("modules") or [])
+
+
+def _cycles(rules: Dict[str, Dict[str, Any]]) -> List[str]:
+    # every question has at most one source, so a cycle is found by walking back
+    found: List[str] = []
+    seen: set = set()
+    for start in rules:
+        path: List[str] = []
+        node: Optional[str] = start
+        while node in rules and node not in path and node not in seen:
+            path.append(node)
+            node = rules[node]["source"]
+        seen.update(path)
+        if node in path:
+            loop = path[path.index(node):] + [node]
+            found.append("Branching cycle: " + " -> ".join(f"'{i}'" for i in reversed(loop)))
+    return found
+
+
+# ─── REDCap data dictionary ───────────────────────────────────────────
+
+def _field(question_id: str) -> str:
+    return f"field_{question_id}"
+
+
+def _logic(rule: Dict[str, Any], source: Dict[str, Any]) -> str:
+    field, op, value = _field(rule["source"]), rule["op"], rule["value"]
+    if source["type"] == "slider":
+        return f"[{field}] {op} {value}"
+    code = _code(source, value)
+    if source["type"] == "multi" and not source.get("radio", True):
+        # checkbox: one 0/1 value per option
+        return f"[{field}({code})] = '{1 if op == '=' else 0}'"
+    return f"[{field}] {'=' if op == '=' else '<>'} '{code}'"
+
+
+def redcap_fields(modules: List[Dict[str, Any]]) -> Dict[str, Dict[str, str]]:
+    """
+    Data dictionary columns of each question's REDCap field, by field name:
+    field_type, select_choices_or_calculations, slider bounds and
+    branching_logic. Questions not listed are plain text fields.
+    """
+    out: Dict[str, Dict[str, str]] = {}
+    for _, questions in _surveys(modules):
+        by_id = {q["id"]: q for q in questions}
+        for q in questions:
+            columns: Dict[str, str] = {}
+            kind = q.get("type")
+            if kind in ("multi", "yesno"):
+                columns["field_type"] = "checkbox" if kind == "multi" and not q.get("radio", True) else "radio"
+                # "|" separates choices in REDCap
+                columns["select_choices_or_calculations"] = " | ".join(
+                    f"{code}, {label.replace('|', '/')}" for code, label in _choices(q)
+                )
+            elif kind == "slider":
+                columns.update({
+                    "field_type": "slider",
+                    "select_choices_or_calculations": f"{q.get('hint_left', '')} | | {q.get('hint_right', '')}",
+                    "text_validation_type_or_show_slider_number": "number",
+                    "text_validation_min": str(q.get("min", "")),
+                    "text_validation_max": str(q.get("max", "")),
+                })
+            if q.get("hide_id") not in _NO_SOURCE and q.get("hide_id") in by_id:
+                rule, _ = _rule(q, by_id[q["hide_id"]])
+                if rule:
+                    columns["branching_logic"] = _logic(rule, by_id[rule["source"]])
+            if columns:
+                out[_field(q["id"])] = columns
+    return out
+
+
+def codebook(modules: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    [label, code] pairs of every coded field, with whether it is a checkbox.
+    Stored with a project's token, so records are coded the way its data
+    dictionary was when the project was created. Pairs rather than a dict
+    because labels may hold dots, which Mongo keys can't.
+    """
+    book: Dict[str, Dict[str, Any]] = {}
+    for _, questions in _surveys(modules):
+        for q in questions:
+            if q.get("type") in ("multi", "yesno"):
+                choices = [[label, code] for code, label in _choices(q)]
+                if q["type"] == "yesno":
+                    choices += [["Yes", "1"], ["No", "0"]]
+                book[_field(q["id"])] = {
+                    "choices":  choices,
+                    "checkbox": q["type"] == "multi" and not q.get("radio", True),
+                }
+    return book
+
+
+def encode_answer(field: str, value: Any, book: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    The REDCap columns for one answer. Labels become their codes and a
+    checkbox answer (a list of labels) one 0/1 column per choice; anything
+    the codebook doesn't know is passed through as is. So is an answer of
+    the wrong shape (a checkbox answer that isn't a list of known labels,
+    a list or object for any other coded field), with a warning, rather
+    than recorded as nothing picked or failing the delivery.
+    """
+    entry = book.get(field)
+    if entry is None:
+        return {field: value}
+    choices = {label: code for label, code in entry["choices"]}
+    if entry["checkbox"]:
+        if not isinstance(value, list) or not all(isinstance(v, Hashable) and v in choices for v in value):
+            logger.warning("Checkbox answer for %s isn't a list of known labels: %r", field, value)
+            return {field: value}
+        codes = {choices[v] for v in value}
+        return {f"{field}___{code}": "1" if code in codes else "0" for code in dict.fromkeys(choices.values())}
+    if not isinstance(value, Hashable):
+        logger.warning("Answer for %s isn't a single label: %r", field, value)
+        return {field: value}
+    if isinstance(value, bool):
+        value = "Yes" if value else "No"
+    return {field: choices.get(value, value)}
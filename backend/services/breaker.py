@@ -0,0 +1,145 @@
+# services/breaker.py
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a server whose circuit is open.
+    """
+
+    def __init__(self, url: str) -> None:
+        super().__init__(f"Circuit open for {url}")
+        self.url = url
+
+
+class CircuitBreaker:
+    """
+    Failure-rate breaker over the last `window` calls. Opens once at least
+    `min_calls` were made and `failure_threshold` of them failed, fails fast
+    for `open_for_s`, then lets `half_open_calls` probes through: one failed
+    probe re-opens it, all probes succeeding closes it.
+    """
+
+    def __init__(
+        self,
+        name:              str,
+        window:            int,
+        min_calls:         int,
+        failure_threshold: float,
+        open_for_s:        float,
+        half_open_calls:   int = 1,
+        clock:             Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_threshold = failure_threshold
+        self.open_for_s = open_for_s
+        self.half_open_calls = half_open_calls
+        self._clock = clock
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probes_started = 0
+        self._probes_passed = 0
+        self.times_opened = 0
+        self.rejected = 0
+
+    @property
+    def failure_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def allow(self) -> bool:
+        if self.state == OPEN and self._clock() - self._opened_at >= self.open_for_s:
+            self.state = HALF_OPEN
+            self._probes_started = 0
+            self._probes_passed = 0
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and self._probes_started < self.half_open_calls:
+            self._probes_started += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def is_open(self) -> bool:
+        """
+        True while calls would be rejected, without consuming a probe slot.
+        """
+        if self.state == OPEN:
+            return self._clock() - self._opened_at < self.open_for_s
+        return self.state == HALF_OPEN and self._probes_started >= self.half_open_calls
+
+    def record_success(self) -> None:
+        if self.state == HALF_OPEN:
+            self._probes_passed += 1
+            if self._probes_passed >= self.half_open_calls:
+                self.state = CLOSED
+                self._outcomes.clear()
+                logger.info("Circuit for %s closed again", self.name)
+            return
+        self._outcomes.append(True)
+
+    def record_failure(self) -> None:
+        if self.state == HALF_OPEN:
+            self._trip()
+            return
+        self._outcomes.append(False)
+        if (
+            self.state == CLOSED
+            and len(self._outcomes) >= self.min_calls
+            and self.failure_rate >= self.failure_threshold
+        ):
+            self._trip()
+
+    def _trip(self) -> None:
+        self.state = OPEN
+        self._opened_at = self._clock()
+        self.times_opened += 1
+        logger.warning(
+            "Circuit for %s opened for %.0fs (failure rate %.0f%%)",
+            self.name, self.open_for_s, self.failure_rate * 100,
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state":        OPEN if self.is_open() else self.state,
+            "failure_rate": round(self.failure_rate, 3),
+            "calls":        len(self._outcomes),
+            "times_opened": self.times_opened,
+            "rejected":     self.rejected,
+        }
+
+
+class BreakerRegistry:
+    """
+    One breaker per REDCap base URL, created on first use.
+    """
+
+    def __init__(self, **breaker_opts: Any) -> None:
+        self._opts = breaker_opts
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, url: str) -> CircuitBreaker:
+        breaker = self._breakers.get(url)
+        if breaker is None:
+            breaker = self._breakers[url] = CircuitBreaker(url, **self._opts)
+        return breaker
+
+    def is_open(self, url: str) -> bool:
+        breaker = self._breakers.get(url)
+        return breaker is not None and breaker.is_open()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {url: b.stats() for url, b in self._breakers.items()}
@@ -0,0 +1,155 @@
+# services/cache_bus.py
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from typing import Any, Callable, DefaultDict, Dict, List, Optional
+
+from pymongo.errors import OperationFailure
+
+import db
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# study_id is None when we can't tell which entry changed: evict everything
+Handler = Callable[[Optional[str]], None]
+
+# how to find the study id in a changed document, and which ms-timestamp
+# field the polling fallback scans
+_STUDY_ID_PATH = {"studies": ("properties", "study_id"), "keys": ("study_id",)}
+_POLL_FIELD = {"studies": "timestamp", "keys": "updated_at"}
+
+
+def _study_id(collection: str, doc: Optional[Dict[str, Any]]) -> Optional[str]:
+    value: Any = doc
+    for part in _STUDY_ID_PATH.get(collection, ()):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value if isinstance(value, str) else None
+
+
+class InvalidationBus:
+    """
+    Keeps per-process caches of `studies` and `keys` coherent across workers
+    and replicas. Tails a MongoDB change stream when the deployment supports
+    it (replica set / Atlas) and otherwise polls for recently written
+    documents every `poll_interval_s`. Deletes are only seen by the change
+    stream; with polling, cache TTLs bound how long a deleted entry survives.
+    """
+
+    def __init__(self, poll_interval_s: float, poll_overlap_s: float = 5.0) -> None:
+        self.poll_interval_s = poll_interval_s
+        self.poll_overlap_ms = int(poll_overlap_s * 1000)
+        self._handlers: DefaultDict[str, List[Handler]] = defaultdict(list)
+        self._task: Optional[asyncio.Task] = None
+        self.mode = "stopped"
+        self.events = 0
+        self.last_event_at: Optional[float] = None
+
+    def register(self, collection: str, handler: Handler) -> None:
+        self._handlers[collection].append(handler)
+
+    def publish(self, collection: str, study_id: Optional[str]) -> None:
+        """
+        Evict locally. Writers call this directly so their own worker never
+        serves a stale entry, the bus does it for everyone else.
+        """
+        self.events += 1
+        self.last_event_at = time.time()
+        for handler in self._handlers.get(collection, []):
+            handler(study_id)
+
+    def _evict_all(self) -> None:
+        for collection in list(self._handlers):
+            self.publish(collection, None)
+
+    # ─── Change streams ──────────────────────────────────────────────
+    async def _watch(self) -> None:
+        pipeline = [{"$match": {"ns.coll": {"$in": list(self._handlers)}}}]
+        resume_token = None
+        delay = 1.0
+        while True:
+            try:
+                async with db.get_db().watch(
+                    pipeline, full_document="updateLookup", resume_after=resume_token
+                ) as stream:
+                    self.mode = "change_stream"
+                    delay = 1.0
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        coll = change["ns"]["coll"]
+                        self.publish(coll, _study_id(coll, change.get("fullDocument")))
+            except OperationFailure:
+                if self.mode != "change_stream":
+                    raise  # never opened: not supported here
+                logger.exception("Change stream failed, reopening")
+                resume_token = None
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Change stream interrupted, reopening in %.0fs", delay)
+            # we may have missed events while disconnected
+            self._evict_all()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    # ─── Polling fallback ────────────────────────────────────────────
+    async def poll_once(self, marks: Dict[str, int]) -> None:
+        database = db.get_db()
+        for coll in self._handlers:
+            field = _POLL_FIELD.get(coll)
+            if field is None:
+                continue
+            cursor = (
+                database[coll]
+                .find({field: {"$gt": marks[coll] - self.poll_overlap_ms}}, {"_id": 0})
+                .sort(field, 1)
+            )
+            for doc in await cursor.to_list(length=1000):
+                self.publish(coll, _study_id(coll, doc))
+                marks[coll] = max(marks[coll], doc.get(field, 0))
+
+    async def _poll(self) -> None:
+        self.mode = "polling"
+        start = int(time.time() * 1000)
+        marks = {coll: start for coll in self._handlers}
+        while True:
+            await asyncio.sleep(self.poll_interval_s)
+            try:
+                await self.poll_once(marks)
+            except Exception:
+                logger.exception("Polling for cache invalidations failed")
+                self._evict_all()
+
+    async def _run(self) -> None:
+        if settings.cache_use_change_streams:
+            try:
+                await self._watch()
+            except OperationFailure as e:
+                logger.info("Change streams unavailable (%s), polling for invalidations", e)
+        await self._poll()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.mode = "stopped"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode":          self.mode,
+            "events":        self.events,
+            "last_event_at": self.last_event_at,
+        }
+
+
+bus = InvalidationBus(poll_interval_s=settings.cache_poll_interval_s)
@@ -0,0 +1,139 @@
+# services/compression.py
+import asyncio
+import gzip
+from typing import Dict, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+# preferred first; "br" is dropped when the brotli package is missing
+SUPPORTED = [enc for enc in ("br", "gzip") if enc != "br" or brotli is not None]
+
+_COMPRESSIBLE = ("application/json", "application/msgpack", "application/cbor", "text/")
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Pick our preferred encoding among those the client accepts with q > 0.
+    """
+    if not accept_encoding:
+        return None
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for enc in SUPPORTED:
+        if accepted.get(enc, accepted.get("*", 0.0)) > 0:
+            return enc
+    return None
+
+
+def compress(body: bytes, encoding: str, best: bool = False) -> bytes:
+    """
+    `best` trades CPU for size; only worth it for bodies compressed once and cached.
+    """
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if best else 5)
+    return gzip.compress(body, compresslevel=9 if best else 6, mtime=0)
+
+
+class PrecompressedBody:
+    """
+    A cacheable response body with its encoded variants, each compressed
+    at most once and kept for the lifetime of the cache entry. `best`
+    compression (brotli q11 takes tens of ms on a large study) runs in a
+    thread; pass best=False for bodies that won't be cached.
+    """
+
+    def __init__(self, body: bytes, media_type: str = "application/json", best: bool = True) -> None:
+        self.body = body
+        self.media_type = media_type
+        self.best = best
+        self._encoded: Dict[str, bytes] = {}
+
+    async def get(self, encoding: Optional[str]) -> bytes:
+        if encoding is None:
+            return self.body
+        data = self._encoded.get(encoding)
+        if data is None:
+            if self.best:
+                data = await asyncio.to_thread(compress, self.body, encoding, True)
+            else:
+                data = compress(self.body, encoding)
+            self._encoded[encoding] = data
+        return data
+
+
+class CompressionMiddleware:
+    """
+    Content-negotiated br/gzip for complete (non-streaming) responses of at
+    least `min_size` bytes. Responses that already carry a Content-Encoding,
+    e.g. cached PrecompressedBody hits, pass through untouched. Bodies of
+    `thread_size` bytes or more (a full version history, a timeline export)
+    are compressed in a thread so they don't stall the event loop.
+    """
+
+    def __init__(self, app: ASGIApp, min_size: int = 1024, thread_size: int = 64 * 1024) -> None:
+        self.app = app
+        self.min_size = min_size
+        self.thread_size = thread_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        passthrough = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            compressible = (
+                "content-encoding" not in headers
+                and headers.get("content-type", "").startswith(_COMPRESSIBLE)
+            )
+            if message.get("more_body", False) or not compressible or len(body) < self.min_size:
+                # streaming, already encoded or too small to bother
+                if compressible:
+                    headers.add_vary_header("Accept-Encoding")
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            if len(body) >= self.thread_size:
+                data = await asyncio.to_thread(compress, body, encoding)
+            else:
+                data = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(data))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            await send({"type": "http.response.body", "body": data})
+
+        await self.app(scope, receive, send_wrapper)
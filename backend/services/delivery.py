@@ -0,0 +1,320 @@
+# services/delivery.py
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set, Tuple
+
+import httpx
+
+import db
+from services.breaker import BreakerRegistry, CircuitOpenError
+from services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+OUTBOX = "redcap_outbox"
+
+Handler = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+# payload, traceparent of the request that queued it, monotonic enqueue
+# time, failed attempts so far
+_Item = Tuple[Dict[str, Any], Optional[str], float, int]
+
+
+class AIMDLimit:
+    """
+    Additive-increase / multiplicative-decrease concurrency limit: grows by
+    roughly one slot per window of successes, halves on a congestion signal.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, backoff: float = 0.5) -> None:
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self._limit = float(initial)
+
+    @property
+    def limit(self) -> int:
+        return max(self.minimum, int(self._limit))
+
+    def on_success(self) -> None:
+        self._limit = min(float(self.maximum), self._limit + 1.0 / self._limit)
+
+    def on_congestion(self) -> None:
+        self._limit = max(float(self.minimum), self._limit * self.backoff)
+
+
+class _Lane:
+    """
+    Everything queued or in flight for one REDCap base URL.
+    """
+
+    def __init__(self, limiter: AIMDLimit) -> None:
+        self.limiter = limiter
+        self.in_flight = 0
+        self.reserved = 0
+        self.queue: Deque[_Item] = deque()
+        self.delivered = 0
+        self.failed = 0
+
+    @property
+    def pending(self) -> int:
+        return self.in_flight + self.reserved + len(self.queue)
+
+
+def _is_congestion(exc: BaseException) -> bool:
+    # a 4xx is a problem with our record, not a sign the server is overloaded
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500 or exc.response.status_code == 429
+    return True
+
+
+class RedcapDelivery:
+    """
+    Bounded, per-server REDCap delivery. Each server gets its own queue and
+    AIMD concurrency limit; a global cap and a per-server cap bound memory
+    so one slow host can't starve deliveries to the others.
+
+    Ingest calls reserve() before writing anything. When that fails the
+    caller either rejects with 429 or spills the payload to the Mongo outbox,
+    which a background loop drains once there is room again.
+
+    A failed delivery is spilled too, with its attempt count and a retry
+    time backing off from `drain_interval_s`; after `max_attempts` it is
+    logged and left to tools/reconcile_redcap.py.
+    """
+
+    def __init__(
+        self,
+        handler:                Handler,
+        max_pending:            int,
+        max_pending_per_server: int,
+        initial_concurrency:    int,
+        max_concurrency:        int,
+        drain_interval_s:       float,
+        breakers:               Optional[BreakerRegistry] = None,
+        max_attempts:           int = 5,
+    ) -> None:
+        self.handler = handler
+        self.breakers = breakers
+        self.max_pending = max_pending
+        self.max_pending_per_server = max_pending_per_server
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.drain_interval_s = drain_interval_s
+        self.max_attempts = max_attempts
+        self._lanes: Dict[str, _Lane] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._drainer: Optional[asyncio.Task] = None
+        self.rejected = 0
+        self.spilled = 0
+        self.retried = 0
+        self.given_up = 0
+
+    # ─── Admission ───────────────────────────────────────────────────
+    def _lane(self, url: str) -> _Lane:
+        lane = self._lanes.get(url)
+        if lane is None:
+            lane = self._lanes[url] = _Lane(
+                AIMDLimit(self.initial_concurrency, 1, self.max_concurrency)
+            )
+        return lane
+
+    @property
+    def pending(self) -> int:
+        return sum(lane.pending for lane in self._lanes.values())
+
+    def reserve(self, url: str) -> bool:
+        """
+        Hold a slot for one delivery to `url`; False when either bound is hit.
+        """
+        lane = self._lane(url)
+        if self.pending >= self.max_pending or lane.pending >= self.max_pending_per_server:
+            self.rejected += 1
+            return False
+        lane.reserved += 1
+        return True
+
+    def cancel(self, url: str) -> None:
+        self._lane(url).reserved -= 1
+
+    def submit(
+        self,
+        url:      str,
+        payload:  Dict[str, Any],
+        trace:    Optional[str] = None,
+        attempts: int = 0,
+    ) -> None:
+        """
+        Turn a reservation into a queued delivery. The delivery continues
+        `trace`, by default the trace of the caller.
+        """
+        lane = self._lane(url)
+        lane.reserved -= 1
+        lane.queue.append((payload, trace or tracer.traceparent(), time.monotonic(), attempts))
+        self._pump(url, lane)
+
+    async def spill(
+        self,
+        url:      str,
+        payload:  Dict[str, Any],
+        trace:    Optional[str] = None,
+        attempts: int = 0,
+    ) -> None:
+        now = datetime.now(timezone.utc)
+        doc = {
+            "url":         url,
+            "payload":     payload,
+            "traceparent": trace or tracer.traceparent(),
+            "created_at":  now,
+        }
+        if attempts:
+            doc["attempts"] = attempts
+            doc["retry_at"] = now + timedelta(seconds=self.drain_interval_s * 2 ** (attempts - 1))
+        await db.get_db()[OUTBOX].insert_one(doc)
+        self.spilled += 1
+
+    # ─── Execution ───────────────────────────────────────────────────
+    def _pump(self, url: str, lane: _Lane) -> None:
+        while lane.queue and lane.in_flight < lane.limiter.limit:
+            item = lane.queue.popleft()
+            lane.in_flight += 1
+            # a fresh context: the delivery joins its own request's trace,
+            # not that of whichever request or delivery happened to pump it
+            task = asyncio.create_task(self._run(url, lane, item), context=contextvars.Context())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, url: str, lane: _Lane, item: _Item) -> None:
+        payload, trace, queued_at, attempts = item
+        queued_ms = round((time.monotonic() - queued_at) * 1000, 1)
+        try:
+            with tracer.span("redcap.deliver", parent=trace, server=url, queued_ms=queued_ms):
+                if self.breakers is not None and self.breakers.is_open(url):
+                    raise CircuitOpenError(url)
+                await self.handler(url, payload)
+        except asyncio.CancelledError:
+            raise
+        except CircuitOpenError:
+            # nothing was sent; park it until the server is back
+            await self._park(url, payload, trace, attempts)
+        except Exception as e:
+            # the handler already logged the details
+            lane.failed += 1
+            if _is_congestion(e):
+                lane.limiter.on_congestion()
+            await self._retry(url, payload, trace, attempts + 1)
+        else:
+            lane.delivered += 1
+            lane.limiter.on_success()
+        finally:
+            lane.in_flight -= 1
+            self._pump(url, lane)
+
+    async def _park(
+        self,
+        url:      str,
+        payload:  Dict[str, Any],
+        trace:    Optional[str] = None,
+        attempts: int = 0,
+    ) -> None:
+        try:
+            await self.spill(url, payload, trace, attempts)
+        except Exception:
+            logger.exception("Could not spill REDCap delivery for %s", url)
+
+    async def _retry(self, url: str, payload: Dict[str, Any], trace: Optional[str], attempts: int) -> None:
+        if attempts >= self.max_attempts:
+            self.given_up += 1
+            logger.error(
+                "Giving up on REDCap delivery to %s after %d attempts; left to reconcile_redcap",
+                url,
+                attempts,
+            )
+            return
+        self.retried += 1
+        await self._park(url, payload, trace, attempts)
+
+    # ─── Outbox draining ─────────────────────────────────────────────
+    async def drain_once(self) -> int:
+        """
+        Move spilled deliveries back into memory while we're below half the
+        global cap, skipping servers that are full or whose circuit is open
+        and failed deliveries not yet due for a retry. Returns how many.
+        """
+        coll = db.get_db()[OUTBOX]
+        moved = 0
+        while self.pending < self.max_pending // 2:
+            full = [
+                url for url, lane in self._lanes.items()
+                if lane.pending >= self.max_pending_per_server
+                or (self.breakers is not None and self.breakers.is_open(url))
+            ]
+            due = [{"retry_at": None}, {"retry_at": {"$lte": datetime.now(timezone.utc)}}]
+            doc = await coll.find_one_and_delete(
+                {"url": {"$nin": full}, "$or": due}, sort=[("created_at", 1)]
+            )
+            if doc is None:
+                break
+            if not self.reserve(doc["url"]):
+                await coll.insert_one(doc)
+                break
+            self.submit(doc["url"], doc["payload"], doc.get("traceparent"), doc.get("attempts", 0))
+            moved += 1
+        return moved
+
+    async def _drain_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.drain_interval_s)
+            try:
+                await self.drain_once()
+            except Exception:
+                logger.exception("Draining the REDCap outbox failed")
+
+    def start(self) -> None:
+        self._drainer = asyncio.create_task(self._drain_forever())
+
+    async def stop(self, timeout_s: float = 10.0) -> None:
+        """
+        Spill everything still queued, then give in-flight pushes a grace period.
+        """
+        if self._drainer is not None:
+            self._drainer.cancel()
+            try:
+                await self._drainer
+            except asyncio.CancelledError:
+                pass
+            self._drainer = None
+
+        for url, lane in self._lanes.items():
+            while lane.queue:
+                payload, trace, _, attempts = lane.queue.popleft()
+                await self._park(url, payload, trace, attempts)
+
+        if self._tasks:
+            _, still_running = await asyncio.wait(list(self._tasks), timeout=timeout_s)
+            for task in still_running:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending":     self.pending,
+            "max_pending": self.max_pending,
+            "rejected":    self.rejected,
+            "spilled":     self.spilled,
+            "retried":     self.retried,
+            "given_up":    self.given_up,
+            "servers": {
+                url: {
+                    "limit":     lane.limiter.limit,
+                    "in_flight": lane.in_flight,
+                    "queued":    len(lane.queue),
+                    "delivered": lane.delivered,
+                    "failed":    lane.failed,
+                }
+                for url, lane in self._lanes.items()
+            },
+        }
@@ -0,0 +1,140 @@
+# services/health.py
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import db
+from config import settings
+from http_client import get_http_client
+
+logger = logging.getLogger(__name__)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class HealthProber:
+    """
+    Probes Mongo and every known REDCap server on a fixed interval and keeps
+    the last result in memory, so /health never touches a dependency itself.
+    """
+
+    def __init__(
+        self,
+        interval_s: float,
+        timeout_s: float,
+        url_refresh_every: int = 20,
+    ) -> None:
+        self.interval_s = interval_s
+        self.timeout_s = timeout_s
+        self.url_refresh_every = url_refresh_every
+        self._redcap_urls: List[str] = [settings.redcap_url]
+        self._results: Dict[str, Dict[str, Any]] = {}
+        self._checked_at: Optional[str] = None
+        self._first_probe = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _check(self, name: str, probe: Callable[[], Awaitable[Any]]) -> Dict[str, Any]:
+        prev = self._results.get(name, {})
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(probe(), timeout=self.timeout_s)
+            ok, error = True, None
+        except Exception as e:
+            ok, error = False, repr(e)
+        now = _now()
+        if not ok and prev.get("ok", True):
+            logger.warning("Health probe %s failing: %s", name, error)
+        return {
+            "ok":         ok,
+            "latency_ms": round((time.perf_counter() - t0) * 1000, 1),
+            "checked_at": now,
+            "last_ok_at": now if ok else prev.get("last_ok_at"),
+            "error":      error,
+        }
+
+    async def _ping_mongo(self) -> None:
+        await db.get_client().admin.command("ping")
+
+    async def _head_redcap(self, url: str) -> None:
+        # any HTTP answer means the server is up; only 5xx counts as down
+        r = await get_http_client().head(url, timeout=self.timeout_s)
+        if r.status_code >= 500:
+            raise RuntimeError(f"HTTP {r.status_code}")
+
+    async def _refresh_redcap_urls(self) -> None:
+        """
+        Pick up study-specific REDCap servers. Runs every `url_refresh_every`
+        cycles, not per probe, and reads the index on the field (see
+        db.ensure_indexes) rather than the studies, to keep the prober's own
+        Mongo load negligible.
+        """
+        try:
+            urls = await asyncio.wait_for(
+                db.get_db()["studies"].distinct("properties.redcap_server_api_url"),
+                timeout=self.timeout_s,
+            )
+        except Exception:
+            return
+        self._redcap_urls = list(dict.fromkeys([settings.redcap_url, *filter(None, urls)]))
+
+    async def probe_once(self) -> None:
+        # rebuilt from the current targets, so a server no study uses any
+        # more doesn't keep the status degraded
+        probes: Dict[str, Callable[[], Awaitable[Any]]] = {"mongo": self._ping_mongo}
+        for url in self._redcap_urls:
+            probes[f"redcap:{url}"] = lambda url=url: self._head_redcap(url)
+        results = await asyncio.gather(*(self._check(name, probe) for name, probe in probes.items()))
+        self._results = dict(zip(probes, results))
+        self._checked_at = _now()
+        self._first_probe.set()
+
+    async def _run(self) -> None:
+        cycle = 0
+        while True:
+            if cycle % self.url_refresh_every == 0:
+                await self._refresh_redcap_urls()
+            await self.probe_once()
+            cycle += 1
+            await asyncio.sleep(self.interval_s)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def wait_first_probe(self) -> None:
+        """
+        Only blocks during the first probe after startup.
+        """
+        try:
+            await asyncio.wait_for(self._first_probe.wait(), timeout=self.timeout_s * 2)
+        except asyncio.TimeoutError:
+            pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        mongo = self._results.get("mongo")
+        if mongo is None:
+            overall = "unknown"
+        elif not mongo["ok"]:
+            overall = "down"
+        elif all(r["ok"] for r in self._results.values()):
+            overall = "ok"
+        else:
+            overall = "degraded"
+        return {
+            "status":       overall,
+            "mongo":        "reachable" if mongo and mongo["ok"] else "unreachable",
+            "checked_at":   self._checked_at,
+            "dependencies": dict(self._results),
+        }
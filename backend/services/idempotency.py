@@ -0,0 +1,104 @@
+# services/idempotency.py
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException, status
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+
+from config import settings
+from services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "idempotency_keys"
+
+# a claimed key is pending until its writes are done; keys stored before
+# states existed have no state and count as done
+PENDING = "pending"
+DONE = "done"
+
+# recent keys → original result, so most retries never reach Mongo
+_recent: TTLCache[Dict[str, Any]] = TTLCache(
+    maxsize=settings.idempotency_cache_size,
+    ttl_s=settings.idempotency_cache_ttl_s,
+)
+
+
+def derive_key(study_id: str, user_id: str, module_id: str, alert_time: str) -> str:
+    """
+    Fallback key for clients that don't send one: one response per
+    participant, module and prompt.
+    """
+    raw = "\x1f".join([study_id, user_id, module_id, alert_time])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+async def claim(
+    db:       AsyncIOMotorDatabase,
+    key:      str,
+    study_id: str,
+) -> Optional[Dict[str, Any]]:
+    """
+    Reserve `key` for this request. Returns None if we own it now, or the
+    original result if the key was already used (i.e. this is a retry).
+    The key is the document _id, so the unique index enforces it across workers.
+
+    While the request owning the key is still writing, a retry gets a 409
+    with Retry-After: its outcome isn't known yet, and replaying "accepted"
+    would lose the response if those writes then fail. A claim left pending
+    for `idempotency_pending_timeout_s` (its worker died) is taken over.
+    """
+    cached = _recent.get(key)
+    if cached is not None:
+        return cached
+    now = datetime.now(timezone.utc)
+    try:
+        await db[COLLECTION].insert_one({
+            "_id":        key,
+            "study_id":   study_id,
+            "state":      PENDING,
+            "created_at": now,
+        })
+        return None
+    except DuplicateKeyError:
+        doc = await db[COLLECTION].find_one({"_id": key})
+    if doc is not None and doc.get("state", DONE) == DONE:
+        original = doc.get("result") or {}
+        _recent.put(key, original)
+        logger.info("Replaying response for idempotency key %s (study %s)", key, study_id)
+        return original
+    if doc is not None:
+        stale = now - timedelta(seconds=settings.idempotency_pending_timeout_s)
+        taken = await db[COLLECTION].update_one(
+            {"_id": key, "state": PENDING, "created_at": {"$lt": stale}},
+            {"$set": {"created_at": now}},
+        )
+        if taken.modified_count:
+            logger.warning("Took over abandoned idempotency key %s (study %s)", key, study_id)
+            return None
+    # still being written, or released a moment ago
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="A request with this idempotency key is in progress, retry later",
+        headers={"Retry-After": str(settings.idempotency_retry_after_s)},
+    )
+
+
+async def complete(db: AsyncIOMotorDatabase, key: str, result: Dict[str, Any]) -> None:
+    """
+    Record the result of a claimed key once everything it guarded is
+    written; retries get it replayed from then on.
+    """
+    await db[COLLECTION].update_one({"_id": key}, {"$set": {"state": DONE, "result": result}})
+    _recent.put(key, result)
+
+
+async def release(db: AsyncIOMotorDatabase, key: str) -> None:
+    """
+    Give a key back after the writes it guarded failed, so the retry goes through.
+    """
+    _recent.pop(key)
+    await db[COLLECTION].delete_one({"_id": key})
@@ -0,0 +1,90 @@
+# services/ingest.py
+import json
+import logging
+from typing import Any, Dict, Tuple
+
+from fastapi import HTTPException, status
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from config import settings
+from models.response import ResponseEntry
+from services.delivery import RedcapDelivery
+from services.study_lookup import redcap_url
+
+logger = logging.getLogger(__name__)
+
+
+def stored_response(rsp: ResponseEntry) -> Dict[str, Any]:
+    """
+    The document stored for a response: the entry plus its answers parsed
+    into `answers`, so aggregations can read single answers.
+    """
+    doc = rsp.dict()
+    try:
+        answers = json.loads(rsp.responses) if rsp.responses else None
+    except ValueError:
+        answers = None
+    if isinstance(answers, dict):
+        doc["answers"] = answers
+    return doc
+
+
+async def store_response(
+    db:         AsyncIOMotorDatabase,
+    collection: str,
+    rsp:        ResponseEntry,
+) -> None:
+    """
+    Store a response once per idempotency key: an upsert, so a retry after
+    a partial failure doesn't add a second copy of what did get written.
+    """
+    await db[collection].update_one(
+        {"idempotency_key": rsp.idempotency_key},
+        {"$setOnInsert": stored_response(rsp)},
+        upsert=True,
+    )
+
+
+async def admit_delivery(
+    db:       AsyncIOMotorDatabase,
+    delivery: RedcapDelivery,
+    study_id: str,
+) -> Tuple[str, bool]:
+    """
+    Reserve a REDCap delivery slot before anything is written. When REDCap
+    is saturated and overflow is 'reject', answer 429 so the client retries
+    later; the caller gives its idempotency key back.
+    """
+    url = await redcap_url(db, study_id)
+    admitted = delivery.reserve(url)
+    if not admitted and settings.redcap_overflow == "reject":
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="REDCap delivery is backed up, retry later",
+            headers={"Retry-After": str(settings.redcap_retry_after_s)},
+        )
+    return url, admitted
+
+
+async def queue_delivery(
+    delivery: RedcapDelivery,
+    url:      str,
+    admitted: bool,
+    rsp:      ResponseEntry,
+) -> None:
+    """
+    Hand a stored response to delivery. It is already in Mongo, so a failed
+    spill is logged instead of failing the request; tools/reconcile_redcap.py
+    pushes backups REDCap is missing.
+    """
+    if admitted:
+        delivery.submit(url, rsp.dict())
+        return
+    try:
+        await delivery.spill(url, rsp.dict())
+    except Exception:
+        logger.exception(
+            "Could not park REDCap delivery for study %s, module %s; left to reconcile_redcap",
+            rsp.study_id,
+            rsp.module_id
+        )
@@ -0,0 +1,126 @@
+# services/log_buffer.py
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+from pymongo.errors import BulkWriteError
+
+import db
+
+logger = logging.getLogger(__name__)
+
+
+class LogBuffer:
+    """
+    Write-behind buffer for UI log events. Requests only append to memory;
+    a background task flushes with one unordered insert_many whenever
+    `max_batch` documents are waiting or `flush_interval_s` has passed.
+    Capacity is bounded: once full, new events are dropped and counted.
+    """
+
+    def __init__(
+        self,
+        collection:       str,
+        max_batch:        int,
+        flush_interval_s: float,
+        capacity:         int,
+    ) -> None:
+        self.collection = collection
+        self.max_batch = max_batch
+        self.flush_interval_s = flush_interval_s
+        self.capacity = capacity
+        self._docs: Deque[Dict[str, Any]] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.accepted = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+
+    def add(self, doc: Dict[str, Any]) -> bool:
+        if len(self._docs) >= self.capacity:
+            if self.dropped % 1000 == 0:
+                logger.warning("Log buffer full (%d), dropping events", self.capacity)
+            self.dropped += 1
+            return False
+        self._docs.append(doc)
+        self.accepted += 1
+        if len(self._docs) >= self.max_batch and self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    def add_many(self, docs: Iterable[Dict[str, Any]]) -> int:
+        return sum(1 for doc in docs if self.add(doc))
+
+    async def flush(self) -> int:
+        """
+        Write out everything buffered, in batches of `max_batch`.
+        """
+        written = 0
+        while self._docs:
+            batch: List[Dict[str, Any]] = [
+                self._docs.popleft() for _ in range(min(self.max_batch, len(self._docs)))
+            ]
+            try:
+                await db.get_db()[self.collection].insert_many(batch, ordered=False)
+                written += len(batch)
+            except asyncio.CancelledError:
+                self._docs.extendleft(reversed(batch))
+                raise
+            except BulkWriteError as e:
+                # unordered: everything but the reported errors made it in
+                errors = len(e.details.get("writeErrors", []))
+                written += len(batch) - errors
+                self.failed += errors
+            except Exception:
+                # Mongo unreachable: put the batch back if there is room, retry next tick
+                room = self.capacity - len(self._docs)
+                self._docs.extendleft(reversed(batch[:room]))
+                self.failed += max(0, len(batch) - room)
+                logger.exception("Flushing %d log events failed", len(batch))
+                break
+            finally:
+                self.flushes += 1
+        self.written += written
+        return written
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval_s)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        # created here so it belongs to the loop that runs the flusher
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop the flusher and drain what is left.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._wakeup = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "buffered": len(self._docs),
+            "capacity": self.capacity,
+            "accepted": self.accepted,
+            "dropped":  self.dropped,
+            "written":  self.written,
+            "failed":   self.failed,
+            "flushes":  self.flushes,
+        }
@@ -0,0 +1,121 @@
+# services/log_counters.py
+import asyncio
+import logging
+import random
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import db
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "log_counters"
+# a counter's key in memory and its upsert filter, in this order
+KEY_FIELDS = ("study_id", "page", "event", "platform", "minute")
+
+CounterKey = Tuple[str, str, str, str, int]
+
+# study_id, page, event and platform of the counter that takes the events
+# arriving once `max_keys` counters are held
+OVERFLOW = "_overflow"
+
+
+def _counter_filter(key: CounterKey) -> Dict[str, Any]:
+    doc: Dict[str, Any] = dict(zip(KEY_FIELDS, key))
+    doc["minute"] = datetime.fromtimestamp(doc["minute"] / 1000, tz=timezone.utc)
+    return doc
+
+
+class LogCounters:
+    """
+    Rolling per-minute event counts keyed by (study_id, page, event,
+    platform, minute), kept in memory and flushed as $inc upserts. Counts
+    every event, so raw storage can be sampled without skewing dashboards.
+
+    Every part of the key comes from the client, so at most `max_keys`
+    counters are held between flushes; events for further keys are counted
+    under OVERFLOW at the current minute instead.
+    """
+
+    def __init__(self, flush_interval_s: float, raw_sample_rate: float, max_keys: int = 50_000) -> None:
+        self.flush_interval_s = flush_interval_s
+        self.raw_sample_rate = raw_sample_rate
+        self.max_keys = max_keys
+        self._counts: "Counter[CounterKey]" = Counter()
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.upserts = 0
+        self.overflowed = 0
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        minute = entry["timestamp_in_ms"] // 60_000 * 60_000
+        meta = entry.get("meta") or entry
+        key: CounterKey = (meta["study_id"], entry["page"], entry["event"], entry["platform"], minute)
+        if key not in self._counts and len(self._counts) >= self.max_keys:
+            now = int(time.time() * 1000) // 60_000 * 60_000
+            key = (OVERFLOW, OVERFLOW, OVERFLOW, OVERFLOW, now)
+            self.overflowed += 1
+        self._counts[key] += 1
+
+    def keep_raw(self) -> bool:
+        """
+        Whether this event should also be stored raw.
+        """
+        return self.raw_sample_rate >= 1.0 or random.random() < self.raw_sample_rate
+
+    async def flush(self) -> int:
+        if not self._counts:
+            return 0
+        counts, self._counts = self._counts, Counter()
+        ops = [
+            UpdateOne(_counter_filter(key), {"$inc": {"count": n}}, upsert=True)
+            for key, n in counts.items()
+        ]
+        try:
+            await db.get_db()[COLLECTION].bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            # some upserts landed; retrying all of them would double count
+            logger.error("%d log counter upserts failed", len(e.details.get("writeErrors", [])))
+            return 0
+        except Exception:
+            # keep the increments for the next tick rather than losing them
+            self._counts.update(counts)
+            logger.exception("Flushing %d log counters failed", len(ops))
+            return 0
+        finally:
+            self.flushes += 1
+        self.upserts += len(ops)
+        return len(ops)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval_s)
+            await self.flush()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending_keys":    len(self._counts),
+            "max_keys":        self.max_keys,
+            "overflowed":      self.overflowed,
+            "flushes":         self.flushes,
+            "upserts":         self.upserts,
+            "raw_sample_rate": self.raw_sample_rate,
+        }
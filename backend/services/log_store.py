@@ -0,0 +1,66 @@
+# services/log_store.py
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import CollectionInvalid
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# UI events live in a time-series collection: `ts` is the time field and
+# {study_id, user_id} the meta field Mongo buckets on
+TIME_FIELD = "ts"
+META_FIELD = "meta"
+
+
+def to_document(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reshape a LogEntry dict for the time-series collection. Documents that
+    already have the meta field are passed through unchanged.
+    """
+    if META_FIELD in entry:
+        return entry
+    doc = dict(entry)
+    doc[META_FIELD] = {"study_id": doc.pop("study_id"), "user_id": doc.pop("user_id")}
+    doc[TIME_FIELD] = datetime.fromtimestamp(doc["timestamp_in_ms"] / 1000, tz=timezone.utc)
+    return doc
+
+
+async def provision(db: AsyncIOMotorDatabase) -> None:
+    """
+    Create the time-series collection if needed and keep its TTL in line
+    with LOG_RETENTION_DAYS (0 keeps events forever).
+    """
+    name = settings.log_collection
+    ttl = settings.log_retention_days * 24 * 3600
+    cursor = await db.list_collections(filter={"name": name})
+    infos = await cursor.to_list(length=1)
+
+    if not infos:
+        opts: Dict[str, Any] = {
+            "timeseries": {
+                "timeField":   TIME_FIELD,
+                "metaField":   META_FIELD,
+                "granularity": "seconds",
+            },
+        }
+        if ttl:
+            opts["expireAfterSeconds"] = ttl
+        try:
+            await db.create_collection(name, **opts)
+            logger.info("Created time-series collection %s", name)
+        except CollectionInvalid:
+            pass  # another worker won the race
+    elif infos[0].get("type") != "timeseries":
+        logger.warning(
+            "Collection %s is not a time-series collection; "
+            "run `python -m tools.migrate_logs` to move its events", name
+        )
+        return
+    else:
+        await db.command("collMod", name, expireAfterSeconds=ttl or "off")
+
+    await db[name].create_index([(f"{META_FIELD}.study_id", 1), (TIME_FIELD, -1)])
@@ -0,0 +1,152 @@
+# services/media.py
+import json
+from typing import Any, Dict, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import msgpack
+except ImportError:  # optional: no MessagePack bodies
+    msgpack = None
+try:
+    import cbor2
+except ImportError:  # optional: no CBOR bodies
+    cbor2 = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+CBOR = "application/cbor"
+
+_ALIASES = {
+    "application/x-msgpack":   MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+}
+
+# what we can produce, JSON first so it wins ties and wildcards
+SUPPORTED: List[str] = [JSON] + [
+    media for media, lib in ((MSGPACK, msgpack), (CBOR, cbor2)) if lib is not None
+]
+BINARY = [m for m in SUPPORTED if m != JSON]
+
+
+def media_type(content_type: Optional[str]) -> str:
+    """
+    Normalized media type of a Content-Type or Accept entry, without parameters.
+    """
+    name = (content_type or "").split(";", 1)[0].strip().lower()
+    return _ALIASES.get(name, name)
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """
+    Pick the representation for a response. Anything we can't produce
+    (or no Accept header at all) gets JSON rather than a 406.
+    """
+    best, best_q = JSON, 0.0
+    for part in (accept or "").split(","):
+        name, _, params = part.partition(";")
+        name = media_type(name)
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name in BINARY and q > best_q:
+            best, best_q = name, q
+        elif name in (JSON, "application/*", "*/*") and q >= best_q and q > 0:
+            best, best_q = JSON, q
+    return best
+
+
+def encode(obj: Any, media: str) -> bytes:
+    if media == MSGPACK:
+        return msgpack.packb(obj, use_bin_type=True)
+    if media == CBOR:
+        return cbor2.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def decode(body: bytes, media: str) -> Any:
+    """
+    Raises ValueError if the body isn't valid in the given media type.
+    """
+    try:
+        if media == MSGPACK:
+            return msgpack.unpackb(body, raw=False)
+        if media == CBOR:
+            return cbor2.loads(body)
+        return json.loads(body)
+    except ValueError:
+        raise
+    except Exception as e:  # msgpack and cbor2 have their own exception types
+        raise ValueError(str(e)) from e
+
+
+class BinaryBodyMiddleware:
+    """
+    Turn MessagePack and CBOR request bodies into JSON before routing, so
+    every endpoint that takes a JSON body takes these too. Bodies that don't
+    decode, or hold values JSON can't represent, get a 400.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        media = media_type(Headers(scope=scope).get("content-type"))
+        if media not in BINARY:
+            await self.app(scope, receive, send)
+            return
+
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        try:
+            body = json.dumps(decode(b"".join(chunks), media)).encode()
+        except (ValueError, TypeError) as e:
+            await _bad_request(send, f"Invalid {media} body: {e}")
+            return
+
+        headers = MutableHeaders(scope=scope)
+        headers["content-type"] = JSON
+        headers["content-length"] = str(len(body))
+        sent = False
+
+        async def replay() -> Message:
+            nonlocal sent
+            if sent:
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await self.app(scope, replay, send)
+
+
+async def _bad_request(send: Send, detail: str) -> None:
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 400,
+        "headers": [(b"content-type", JSON.encode()), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def body_doc(schema: Dict[str, Any], form: bool = False) -> Dict[str, Any]:
+    """
+    openapi_extra for an endpoint that parses its own body in any of our media types.
+    """
+    types = (["application/x-www-form-urlencoded"] if form else []) + SUPPORTED
+    return {"requestBody": {"required": True, "content": {t: {"schema": schema} for t in types}}}
@@ -0,0 +1,72 @@
+# services/snapshots.py
+import json
+import logging
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+from config import settings
+from models.study import StudyOut
+from services.compression import SUPPORTED, compress
+
+logger = logging.getLogger(__name__)
+
+# ids end up as file names under SNAPSHOT_DIR
+_SAFE_ID = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]*$")
+
+
+def render(doc: Dict[str, Any]) -> bytes:
+    """
+    The exact body GET /studies/{id} would return for this document.
+    """
+    out = StudyOut.model_validate(doc).model_dump(mode="json", by_alias=True, exclude_none=True)
+    return json.dumps(out, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def write_variants(directory: Path, name: str, body: bytes) -> None:
+    """
+    Write name.json plus precompressed .gz/.br siblings (.br only if brotli
+    is installed). Compressed files go first so a reader never finds a
+    .json newer than its encodings.
+    """
+    for enc in SUPPORTED:
+        ext = "br" if enc == "br" else "gz"
+        _write_atomic(directory / f"{name}.json.{ext}", compress(body, enc, best=True))
+    _write_atomic(directory / f"{name}.json", body)
+
+
+def publish(doc: Dict[str, Any], directory: Optional[str] = None) -> None:
+    """
+    Snapshot a freshly stored study version: under its permalink (_id) and
+    as the latest version of its study_id. No-op unless SNAPSHOT_DIR is set.
+    """
+    directory = directory or settings.snapshot_dir
+    if not directory:
+        return
+    root = Path(directory)
+    root.mkdir(parents=True, exist_ok=True)
+    try:
+        body = render(doc)
+    except Exception:
+        logger.exception("Could not render snapshot for study %s", doc.get("_id"))
+        return
+    names: Iterable[str] = (str(doc["_id"]), doc["properties"]["study_id"])
+    for name in names:
+        if not _SAFE_ID.match(name):
+            logger.warning("Not snapshotting study id %r: unsafe as a file name", name)
+            continue
+        write_variants(root, name, body)
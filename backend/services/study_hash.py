@@ -0,0 +1,18 @@
+# services/study_hash.py
+import hashlib
+import json
+from typing import Any, Dict
+
+# set by the server per stored version, not part of the designer's content;
+# the compiled views (services/study_views.py) derive from it
+_VOLATILE = ("_id", "_type", "timestamp", "content_hash", "unlock_graph", "branching")
+
+
+def canonical_hash(doc: Dict[str, Any]) -> str:
+    """
+    SHA-256 over a validated, by-alias study dict with sorted keys and no
+    whitespace, so key order and formatting of the upload don't matter.
+    """
+    body = {k: v for k, v in doc.items() if k not in _VOLATILE}
+    raw = json.dumps(body, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
@@ -0,0 +1,86 @@
+# services/study_lookup.py
+from typing import Any, Dict, Optional, Tuple
+
+from bson import ObjectId
+from fastapi import HTTPException, status
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from config import settings
+from services.cache import TTLCache
+from services.cache_bus import bus
+
+# study_id → REDCap URL; evicted across workers by the cache bus
+_url_cache: TTLCache[str] = TTLCache(
+    maxsize=settings.study_cache_size, ttl_s=settings.study_cache_ttl_s
+)
+
+
+def _evict_url(study_id: Optional[str]) -> None:
+    if study_id is None:
+        _url_cache.clear()
+    else:
+        _url_cache.pop(study_id)
+
+
+bus.register("studies", _evict_url)
+
+
+def study_filter(study_id: str) -> Dict[str, Any]:
+    # a permalink (_id) or a study_id
+    filters = []
+    if ObjectId.is_valid(study_id):
+        filters.append({"_id": ObjectId(study_id)})
+    filters.append({"properties.study_id": study_id})
+    return {"$or": filters}
+
+
+async def resolve_study_id(db: AsyncIOMotorDatabase, study_id: str) -> str:
+    """
+    The study_id responses are stored under, for a permalink (_id) or a
+    study_id; anything that isn't a stored version's _id is taken as is.
+    """
+    if not ObjectId.is_valid(study_id):
+        return study_id
+    doc = await db["studies"].find_one({"_id": ObjectId(study_id)}, {"properties.study_id": 1})
+    return doc["properties"]["study_id"] if doc else study_id
+
+
+async def latest_module(
+    db: AsyncIOMotorDatabase,
+    study_id: str,
+    module_id: str,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    The latest version of a study, by permalink or study_id, with only its
+    timestamp and the one module; 404 if either is missing.
+    """
+    doc = await db["studies"].find_one(
+        study_filter(study_id),
+        {"timestamp": 1, "modules": {"$elemMatch": {"id": module_id}}},
+        sort=[("timestamp", -1)],
+    )
+    if not doc or not doc.get("modules"):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Module '{module_id}' not found in study '{study_id}'"
+        )
+    return doc, doc["modules"][0]
+
+
+async def redcap_url(db: AsyncIOMotorDatabase, study_id: str) -> str:
+    """
+    Look for a study-specific REDCap URL in Mongo; return it if found,
+    otherwise fall back to the global REDCAP_API_URL.
+    """
+    cached = _url_cache.get(study_id)
+    if cached is not None:
+        return cached
+    url = settings.redcap_url
+    doc = await db["studies"].find_one(
+        {"properties.study_id": study_id},
+        {"properties.redcap_server_api_url": 1}
+    )
+    if doc:
+        url = doc.get("properties", {}).get("redcap_server_api_url") or url
+    _url_cache.put(study_id, url)
+    return url
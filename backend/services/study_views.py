@@ -0,0 +1,18 @@
+# services/study_views.py
+from typing import Any, Callable, Dict
+
+from services import branching, unlock_graph
+
+# views compiled when a version is saved and stored with it, by field
+COMPILED: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    "unlock_graph": unlock_graph.compile_study,
+    "branching":    branching.compile_study,
+}
+
+
+def compile_views(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Every COMPILED view of a study document, to store alongside it so
+    reads don't compile again.
+    """
+    return {field: build(doc) for field, build in COMPILED.items()}
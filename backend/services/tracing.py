@@ -0,0 +1,287 @@
+# services/tracing.py
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import http_client
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# attributes a child span copies from its parent, so e.g. a slow REDCap
+# POST names its study even when exported without its parents
+_INHERITED = ("study_id",)
+
+
+@dataclass
+class Span:
+    trace_id:  str
+    span_id:   str
+    parent_id: Optional[str]
+    name:      str
+    sampled:   bool
+    attrs:     Dict[str, Any] = field(default_factory=dict)
+    start_us:  int = 0
+    duration_us: int = 0
+    error:     Optional[str] = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("span", default=None)
+
+
+def _parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """
+    (trace id, parent span id, sampled) of a W3C traceparent header.
+    """
+    parts = (value or "").strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16), int(parts[3], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2], bool(int(parts[3], 16) & 1)
+
+
+class Tracer:
+    """
+    Span-based tracing without an SDK. Spans nest through a context var, so
+    work awaited or spawned with asyncio.create_task() inside a span joins
+    its trace; queued work carries `traceparent()` along and resumes the
+    trace with span(parent=...).
+
+    Whether a trace is kept is decided at its root with `sample_rate`;
+    spans lasting at least `slow_ms` are kept regardless. Kept spans are
+    buffered and written every `flush_interval_s` as Zipkin v2 JSON, one
+    span per line to `path` or in batches to a collector at `url`.
+    """
+
+    def __init__(
+        self,
+        export:           str,
+        sample_rate:      float,
+        slow_ms:          float,
+        path:             str,
+        url:              Optional[str],
+        service:          str,
+        capacity:         int,
+        flush_interval_s: float,
+    ) -> None:
+        self.export = export
+        self.sample_rate = sample_rate
+        self.slow_us = int(slow_ms * 1000)
+        self.path = path
+        self.url = url
+        self.service = service
+        self.capacity = capacity
+        self.flush_interval_s = flush_interval_s
+        self._spans: Deque[Dict[str, Any]] = deque()
+        self._task: Optional[asyncio.Task] = None
+        self._random = random.Random()
+        self.started = 0
+        self.kept = 0
+        self.dropped = 0
+        self.exported = 0
+        self.failed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.export != "none"
+
+    # ─── Spans ───────────────────────────────────────────────────────
+    @contextmanager
+    def span(self, name: str, parent: Optional[str] = None, **attrs: Any) -> Iterator[Optional[Span]]:
+        """
+        Time the block as a child of the current span, or of `parent` (a
+        traceparent) if given, or as a new root. Yields None when tracing
+        is off, so callers only guard their own attribute work.
+        """
+        if not self.enabled:
+            yield None
+            return
+        outer = _current.get()
+        remote = _parse_traceparent(parent) if parent else None
+        if remote is not None:
+            trace_id, parent_id, sampled = remote
+        elif outer is not None:
+            trace_id, parent_id, sampled = outer.trace_id, outer.span_id, outer.sampled
+            for key in _INHERITED:
+                if key in outer.attrs:
+                    attrs.setdefault(key, outer.attrs[key])
+        else:
+            trace_id, parent_id = os.urandom(16).hex(), None
+            sampled = self._random.random() < self.sample_rate
+        span = Span(trace_id, os.urandom(8).hex(), parent_id, name, sampled, attrs)
+        self.started += 1
+        token = _current.set(span)
+        span.start_us = int(time.time() * 1_000_000)
+        t0 = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration_us = int((time.perf_counter() - t0) * 1_000_000)
+            _current.reset(token)
+            if span.sampled or (self.slow_us and span.duration_us >= self.slow_us):
+                self._keep(span)
+
+    def set(self, **attrs: Any) -> None:
+        """
+        Add attributes to the current span, if any.
+        """
+        span = _current.get()
+        if span is not None:
+            span.attrs.update(attrs)
+
+    def traceparent(self) -> Optional[str]:
+        span = _current.get()
+        return span.traceparent if span is not None else None
+
+    def trace_id(self) -> Optional[str]:
+        span = _current.get()
+        return span.trace_id if span is not None else None
+
+    # ─── Export ──────────────────────────────────────────────────────
+    def _keep(self, span: Span) -> None:
+        if len(self._spans) >= self.capacity:
+            self.dropped += 1
+            return
+        self.kept += 1
+        tags = {k: str(v) for k, v in span.attrs.items() if v is not None}
+        if span.error:
+            tags["error"] = span.error
+        zipkin: Dict[str, Any] = {
+            "traceId":       span.trace_id,
+            "id":            span.span_id,
+            "name":          span.name,
+            "timestamp":     span.start_us,
+            "duration":      max(span.duration_us, 1),
+            "localEndpoint": {"serviceName": self.service},
+            "tags":          tags,
+        }
+        if span.parent_id:
+            zipkin["parentId"] = span.parent_id
+        self._spans.append(zipkin)
+
+    def _write(self, lines: List[str]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(lines))
+
+    async def flush(self) -> int:
+        batch = [self._spans.popleft() for _ in range(len(self._spans))]
+        if not batch:
+            return 0
+        try:
+            if self.export == "zipkin" and self.url:
+                r = await http_client.get_http_client().post(self.url, json=batch, timeout=10.0)
+                r.raise_for_status()
+            else:
+                await asyncio.to_thread(self._write, [json.dumps(s) + "\n" for s in batch])
+        except asyncio.CancelledError:
+            self._spans.extendleft(reversed(batch))
+            raise
+        except Exception:
+            self.failed += len(batch)
+            logger.exception("Exporting %d spans failed", len(batch))
+            return 0
+        self.exported += len(batch)
+        return len(batch)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval_s)
+            await self.flush()
+
+    def start(self) -> None:
+        if self.enabled:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "export":      self.export,
+            "sample_rate": self.sample_rate,
+            "started":     self.started,
+            "kept":        self.kept,
+            "buffered":    len(self._spans),
+            "dropped":     self.dropped,
+            "exported":    self.exported,
+            "failed":      self.failed,
+        }
+
+
+tracer = Tracer(
+    export           = settings.trace_export,
+    sample_rate      = settings.trace_sample_rate,
+    slow_ms          = settings.trace_slow_ms,
+    path             = settings.trace_file,
+    url              = settings.trace_collector_url,
+    service          = settings.trace_service_name,
+    capacity         = settings.trace_buffer_size,
+    flush_interval_s = settings.trace_flush_interval_s,
+)
+
+
+class TraceLogFilter(logging.Filter):
+    """
+    Put the current trace id on every log record as `trace_id`.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = tracer.trace_id() or "-"
+        return True
+
+
+class TracingMiddleware:
+    """
+    One root span per HTTP request, continuing the caller's trace if it
+    sent a traceparent header. The trace id is returned in X-Trace-Id.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+        parent = Headers(scope=scope).get("traceparent")
+        with tracer.span("http", parent=parent, method=scope["method"], path=scope["path"]) as span:
+
+            async def send_with_trace(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    span.attrs["status"] = message["status"]
+                    MutableHeaders(scope=message)["X-Trace-Id"] = span.trace_id
+                await send(message)
+
+            await self.app(scope, receive, send_with_trace)
+            route = scope.get("route")
+            if route is not None:
+                # the route template groups requests, the path is kept as a tag
+                span.name = f"{scope['method']} {route.path}"
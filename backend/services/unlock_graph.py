@@ -0,0 +1,96 @@
+# services/unlock_graph.py
+from collections import deque
+from typing import Any, Dict, List
+
+# a module's condition that puts it in every condition
+ALL_CONDITIONS = "*"
+
+
+def compile_graph(modules: List[Dict[str, Any]], conditions: List[str]) -> Dict[str, Any]:
+    """
+    The modules' `unlock_after` dependencies as a DAG:
+
+    - `order`: module ids in topological order, ties kept in study order
+    - `requires`: id -> ids that have to be done before it unlocks
+    - `unlocks`: id -> ids that list it in their `unlock_after`
+    - `conditions`: condition -> ids of its modules, in `order`
+    - `errors`: duplicate ids, unknown `unlock_after` ids and cycles
+
+    Works on plain dicts so stored versions can be compiled without
+    validating them again. With errors, modules on a cycle are left out
+    of `order`.
+    """
+    errors: List[str] = []
+    ids: List[str] = []
+    for m in modules:
+        if m["id"] in ids:
+            errors.append(f"Duplicate module id '{m['id']}'")
+        else:
+            ids.append(m["id"])
+
+    requires: Dict[str, List[str]] = {i: [] for i in ids}
+    unlocks: Dict[str, List[str]] = {i: [] for i in ids}
+    for m in modules:
+        for dep in dict.fromkeys(m.get("unlock_after") or []):
+            if dep not in requires:
+                errors.append(f"Module '{m['id']}' unlocks after unknown module '{dep}'")
+            elif dep not in requires[m["id"]]:
+                requires[m["id"]].append(dep)
+                unlocks[dep].append(m["id"])
+
+    # Kahn's algorithm; the queue starts in study order so the result is stable
+    waiting = {i: len(requires[i]) for i in ids}
+    ready = deque(i for i in ids if not waiting[i])
+    order: List[str] = []
+    while ready:
+        current = ready.popleft()
+        order.append(current)
+        for nxt in unlocks[current]:
+            waiting[nxt] -= 1
+            if not waiting[nxt]:
+                ready.append(nxt)
+    if len(order) < len(ids):
+        errors.extend(_cycles(requires, set(ids) - set(order)))
+
+    condition_of = {m["id"]: m.get("condition") or ALL_CONDITIONS for m in modules}
+    return {
+        "order": order,
+        "requires": requires,
+        "unlocks": unlocks,
+        "conditions": {
+            c: [i for i in order if condition_of[i] in (ALL_CONDITIONS, c)]
+            for c in (conditions or [ALL_CONDITIONS])
+        },
+        "errors": errors,
+    }
+
+
+def compile_study(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    compile_graph() of a stored study document.
+    """
+    conditions = (doc.get("properties") or {}).get("conditions") or []
+    return compile_graph(doc.get("modules") or [], conditions)
+
+
+def _cycles(requires: Dict[str, List[str]], stuck: set) -> List[str]:
+    """
+    One message per cycle among the modules Kahn's algorithm couldn't place.
+    Modules that only wait on a cycle are not on one and aren't reported.
+    """
+    found: List[str] = []
+    seen: set = set()
+    for start in sorted(stuck):
+        if start in seen:
+            continue
+        path: List[str] = []
+        node = start
+        # every stuck module waits on at least one stuck module, so this ends in a loop
+        while node not in path and node not in seen:
+            path.append(node)
+            node = next(d for d in requires[node] if d in stuck)
+        seen.update(path)
+        if node in path:
+            loop = path[path.index(node):] + [node]
+            found.append("Unlock cycle: " + " -> ".join(f"'{i}'" for i in reversed(loop)))
+    return found
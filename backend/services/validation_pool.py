@@ -0,0 +1,158 @@
+# services/validation_pool.py
+import asyncio
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+
+from config import settings
+from models.study import StudyCreate
+from services.study_views import compile_views
+
+logger = logging.getLogger(__name__)
+
+
+class ValidatedStudy(NamedTuple):
+    study: StudyCreate
+    # by-alias, None-free dict ready to be stored in `studies`
+    doc:   Dict[str, Any]
+    # its compiled unlock graph and branching, stored alongside it
+    views: Dict[str, Any]
+
+
+def _validate_study(body: bytes) -> Tuple[Optional[ValidatedStudy], Optional[List[Dict[str, Any]]]]:
+    """
+    Runs in the pool (or inline for small bodies). Errors come back as plain
+    dicts: they have to cross the process boundary.
+
+    Besides the schema, the compiled views must be free of errors: an unlock
+    cycle or unknown module id would leave modules locked forever, and the
+    app can't evaluate branching on unknown questions or answers.
+    """
+    try:
+        study = StudyCreate.model_validate_json(body)
+    except ValidationError as e:
+        return None, json.loads(e.json(include_url=False))
+    doc = jsonable_encoder(study, by_alias=True, exclude_none=True)
+    views = compile_views(doc)
+    errors = [
+        {"type": "value_error", "loc": ["modules"], "msg": msg, "input": None}
+        for view in views.values()
+        for msg in view["errors"]
+    ]
+    if errors:
+        return None, errors
+    return ValidatedStudy(study, doc, views), None
+
+
+class StudyValidator:
+    """
+    Validates and serializes study payloads. Bodies of at least
+    `offload_bytes` go to a process pool so a big designer save doesn't stall
+    the event loop; at most `max_pending` may be queued there, each for up
+    to `timeout_s`.
+    """
+
+    def __init__(
+        self,
+        offload_bytes: int,
+        max_workers:   int,
+        max_pending:   int,
+        timeout_s:     float,
+    ) -> None:
+        self.offload_bytes = offload_bytes
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout_s = timeout_s
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self.inline = 0
+        self.offloaded = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                # don't fork a process that has an event loop and open sockets
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    async def validate(self, body: bytes) -> ValidatedStudy:
+        if len(body) < self.offload_bytes:
+            self.inline += 1
+            result, errors = _validate_study(body)
+        else:
+            result, errors = await self._offload(body)
+        if errors is not None:
+            raise RequestValidationError(
+                [{**err, "loc": ("body", *err.get("loc", ()))} for err in errors]
+            )
+        return result
+
+    async def _offload(self, body: bytes):
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many large studies are being validated, retry shortly",
+                headers={"Retry-After": "5"},
+            )
+        loop = asyncio.get_running_loop()
+        job = loop.run_in_executor(self._get_pool(), _validate_study, body)
+        # a started job can't be cancelled, so it counts against max_pending
+        # until its worker is done with it, timed out or not
+        self._pending += 1
+        self.offloaded += 1
+        job.add_done_callback(self._job_done)
+        try:
+            return await asyncio.wait_for(asyncio.shield(job), timeout=self.timeout_s)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Study validation timed out",
+            )
+
+    def _job_done(self, job: asyncio.Future) -> None:
+        self._pending -= 1
+        if not job.cancelled():
+            # nobody awaits a timed-out job; don't log its error as unretrieved
+            job.exception()
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending":   self._pending,
+            "inline":    self.inline,
+            "offloaded": self.offloaded,
+            "rejected":  self.rejected,
+            "timeouts":  self.timeouts,
+        }
+
+
+validator = StudyValidator(
+    offload_bytes = settings.study_validation_offload_bytes,
+    max_workers   = settings.study_validation_workers,
+    max_pending   = settings.study_validation_max_pending,
+    timeout_s     = settings.study_validation_timeout_s,
+)
+
+
+async def validated_study(request: Request) -> ValidatedStudy:
+    """
+    Dependency replacing a `StudyCreate` body parameter.
+    """
+    return await validator.validate(await request.body())
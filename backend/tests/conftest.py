@@ -6,6 +6,12 @@ from main import app
 from config import settings
 from db import get_db as real_get_db
 
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "mongo: needs a real mongod, skipped unless MONGO_DB names a dev or test database"
+    )
+
+
 # Async wrapper for a synchronous PyMongo cursor to call .to_list() in async code
 class AsyncCursorWrapper:
     def __init__(self, sync_cursor):
@@ -90,4 +96,35 @@ def client(test_db):
         yield c
 
     # Remove override so other tests aren’t affected
-    app.dependency_overrides.clear()
\ No newline at end of file
+    app.dependency_overrides.clear()
+
+
+def _clear_caches():
+    from routers import redcap, responses, studies
+    from services import study_lookup
+    for cache in (
+        studies._latest, studies._assets, studies._graphs, studies._branching,
+        study_lookup._url_cache, redcap._key_cache, redcap._codebook_cache,
+        responses._series,
+    ):
+        cache.clear()
+
+
+@pytest.fixture
+def memory_db():
+    # An in-memory database behind get_db, for tests that don't need a real
+    # MongoDB; per-worker caches are emptied so nothing leaks between tests
+    from memory_mongo import MemoryDatabase
+
+    database = MemoryDatabase("test")
+    _clear_caches()
+    app.dependency_overrides[real_get_db] = lambda: database
+    yield database
+    app.dependency_overrides.clear()
+    _clear_caches()
+
+
+@pytest.fixture
+def memory_client(memory_db):
+    # No context manager: the lifespan would start the background tasks
+    return TestClient(app)
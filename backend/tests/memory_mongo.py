@@ -0,0 +1,425 @@
+"""
+A small in-memory stand-in for the Motor client, good enough to run the
+backend's ingestion paths without a MongoDB server (see tools.loadgen).
+
+    db._client = MemoryClient()
+
+Covers the calls the routers and services make: equality filters with
+$or/$and and the comparison operators, $set/$setOnInsert/$inc/$unset
+updates with upserts, bulk_write, sorted find/find_one, unique _id,
+projections with $elemMatch, field paths or a $filter expression, and
+aggregate() pipelines of $match, $sort, $project and $limit.
+Indexes are accepted and ignored (so no unique keys besides _id and no
+TTL expiry), change streams report "not supported" like a standalone
+mongod so the cache bus falls back to polling. tests/test_memory_mongo.py
+runs the same operations here and, when one is configured, on a real
+mongod, so the two can't drift apart unnoticed.
+"""
+import copy
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from bson import ObjectId
+from pymongo import InsertOne, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+_MISSING = object()
+
+Sort = Union[str, Sequence[Tuple[str, int]], None]
+
+
+def _get(doc: Dict[str, Any], path: str) -> Any:
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return _MISSING
+        doc = doc[part]
+    return doc
+
+
+def _set(doc: Dict[str, Any], path: str, value: Any) -> None:
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+
+def _unset(doc: Dict[str, Any], path: str) -> None:
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.get(part, {})
+    doc.pop(last, None)
+
+
+def _equals(value: Any, arg: Any) -> bool:
+    # an array field matches its elements as well as the whole array
+    return value == arg or (isinstance(value, list) and arg in value)
+
+
+def _compare(value: Any, op: str, arg: Any) -> bool:
+    if op == "$eq":
+        return _equals(value, arg)
+    if op == "$ne":
+        return not _equals(value, arg)
+    if op == "$in":
+        return any(_equals(value, a) for a in arg)
+    if op == "$nin":
+        return not any(_equals(value, a) for a in arg)
+    if op == "$exists":
+        return (value is not _MISSING) == bool(arg)
+    if value is _MISSING or value is None:
+        return False
+    try:
+        if op == "$gt":
+            return value > arg
+        if op == "$gte":
+            return value >= arg
+        if op == "$lt":
+            return value < arg
+        if op == "$lte":
+            return value <= arg
+    except TypeError:
+        return False
+    raise OperationFailure(f"unsupported query operator {op}")
+
+
+def matches(doc: Dict[str, Any], query: Optional[Dict[str, Any]]) -> bool:
+    for key, cond in (query or {}).items():
+        if key == "$or":
+            if not any(matches(doc, q) for q in cond):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, q) for q in cond):
+                return False
+        elif isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond):
+            value = _get(doc, key)
+            value = None if value is _MISSING and "$exists" not in cond else value
+            if not all(_compare(value, op, arg) for op, arg in cond.items()):
+                return False
+        else:
+            value = _get(doc, key)
+            if value is _MISSING:
+                value = None
+            if not _equals(value, cond):
+                return False
+    return True
+
+
+def _eval(expr: Any, doc: Dict[str, Any], this: Any = None) -> Any:
+    """
+    The few aggregation expressions projections here use: field paths,
+    $$this, $filter, $in and $eq.
+    """
+    if isinstance(expr, str) and expr.startswith("$$this"):
+        value = this if expr == "$$this" else _get(this, expr[len("$$this."):])
+        return None if value is _MISSING else value
+    if isinstance(expr, str) and expr.startswith("$"):
+        value = _get(doc, expr[1:])
+        return None if value is _MISSING else value
+    if isinstance(expr, dict) and len(expr) == 1:
+        op, arg = next(iter(expr.items()))
+        if op == "$filter":
+            items = _eval(arg["input"], doc, this) or []
+            return [item for item in items if _eval(arg["cond"], doc, item)]
+        if op in ("$in", "$eq"):
+            a, b = (_eval(x, doc, this) for x in arg)
+            return a in b if op == "$in" else a == b
+        if op.startswith("$"):
+            raise OperationFailure(f"unsupported expression {op}")
+    return expr
+
+
+def _project(doc: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    include = [k for k, v in projection.items() if v and k != "_id"]
+    if include:
+        out: Dict[str, Any] = {}
+        for path in include:
+            spec = projection[path]
+            if isinstance(spec, dict) and "$elemMatch" in spec:
+                items = _get(doc, path)
+                first = [i for i in (items if isinstance(items, list) else []) if matches(i, spec["$elemMatch"])][:1]
+                if first:
+                    _set(out, path, first)
+            elif isinstance(spec, dict):
+                _set(out, path, _eval(spec, doc))
+            elif isinstance(spec, str) and spec.startswith("$"):
+                # a missing path leaves the field out
+                value = _get(doc, spec[1:])
+                if value is not _MISSING:
+                    _set(out, path, value)
+            else:
+                value = _get(doc, path)
+                if value is not _MISSING:
+                    _set(out, path, value)
+        if projection.get("_id", 1) and "_id" in doc:
+            out["_id"] = doc["_id"]
+        return out
+    for path, v in projection.items():
+        if not v:
+            _unset(doc, path)
+    return doc
+
+
+def _sort_key(field: str):
+    def key(doc: Dict[str, Any]):
+        value = _get(doc, field)
+        # missing and null sort first, like in MongoDB
+        return (0, 0) if value is _MISSING or value is None else (1, value)
+    return key
+
+
+def _sorted(docs: Iterable[Dict[str, Any]], sort: Sort) -> List[Dict[str, Any]]:
+    docs = list(docs)
+    if isinstance(sort, str):
+        sort = [(sort, 1)]
+    for field, direction in reversed(list(sort or [])):
+        docs.sort(key=_sort_key(field), reverse=direction < 0)
+    return docs
+
+
+class MemoryCursor:
+    def __init__(self, docs: List[Dict[str, Any]], projection: Optional[Dict[str, Any]]) -> None:
+        self._docs = docs
+        self._projection = projection
+        self._limit = 0
+
+    def sort(self, key: Union[str, Sequence[Tuple[str, int]]], direction: Optional[int] = None) -> "MemoryCursor":
+        self._docs = _sorted(self._docs, [(key, direction or 1)] if isinstance(key, str) else key)
+        return self
+
+    def limit(self, n: int) -> "MemoryCursor":
+        self._limit = n
+        return self
+
+    def _results(self) -> List[Dict[str, Any]]:
+        docs = self._docs[: self._limit] if self._limit else self._docs
+        return [_project(d, self._projection) for d in docs]
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        docs = self._results()
+        return docs[:length] if length else docs
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for doc in self._results():
+            yield doc
+
+
+class MemoryCollection:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._docs: Dict[Any, Dict[str, Any]] = {}
+
+    def _find(self, query: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        query = query or {}
+        _id = query.get("_id", _MISSING)
+        if len(query) == 1 and _id is not _MISSING and not isinstance(_id, dict):
+            doc = self._docs.get(_id)
+            return [doc] if doc is not None else []
+        return [d for d in self._docs.values() if matches(d, query)]
+
+    def _insert(self, doc: Dict[str, Any]) -> Any:
+        doc.setdefault("_id", ObjectId())
+        if doc["_id"] in self._docs:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} dup key: {doc['_id']!r}")
+        self._docs[doc["_id"]] = copy.deepcopy(doc)
+        return doc["_id"]
+
+    def _update(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool, many: bool = False):
+        docs = self._find(query)
+        if not many:
+            docs = docs[:1]
+        upserted_id = None
+        if not docs and upsert:
+            seed: Dict[str, Any] = {}
+            for key, cond in query.items():
+                if not key.startswith("$") and not isinstance(cond, dict):
+                    _set(seed, key, cond)
+            for path, value in update.get("$setOnInsert", {}).items():
+                _set(seed, path, copy.deepcopy(value))
+            upserted_id = self._insert(seed)
+            docs = [self._docs[upserted_id]]
+        modified = 0
+        for doc in docs:
+            before = copy.deepcopy(doc)
+            for path, value in update.get("$set", {}).items():
+                _set(doc, path, copy.deepcopy(value))
+            for path, value in update.get("$inc", {}).items():
+                current = _get(doc, path)
+                _set(doc, path, (0 if current is _MISSING else current) + value)
+            for path in update.get("$unset", {}):
+                _unset(doc, path)
+            modified += doc != before
+        if upserted_id is not None:
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=upserted_id)
+        # like mongod, an update that leaves a document as it was doesn't count
+        return SimpleNamespace(matched_count=len(docs), modified_count=modified, upserted_id=None)
+
+    # ─── Motor API ───────────────────────────────────────────────────
+
+    async def create_index(self, keys: Any, **kwargs: Any) -> str:
+        return str(keys)
+
+    async def insert_one(self, doc: Dict[str, Any]):
+        return SimpleNamespace(inserted_id=self._insert(doc))
+
+    async def insert_many(self, docs: List[Dict[str, Any]], ordered: bool = True):
+        ids, errors = [], []
+        for i, doc in enumerate(docs):
+            try:
+                ids.append(self._insert(doc))
+            except DuplicateKeyError as e:
+                errors.append({"index": i, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(ids)})
+        return SimpleNamespace(inserted_ids=ids)
+
+    async def find_one(self, query=None, projection=None, sort: Sort = None):
+        docs = _sorted(self._find(query), sort)
+        return _project(docs[0], projection) if docs else None
+
+    def find(self, query=None, projection=None, sort: Sort = None, batch_size: Optional[int] = None) -> MemoryCursor:
+        return MemoryCursor(_sorted(self._find(query), sort), projection)
+
+    async def find_one_and_delete(self, query, sort: Sort = None):
+        docs = _sorted(self._find(query), sort)
+        if not docs:
+            return None
+        return self._docs.pop(docs[0]["_id"])
+
+    async def delete_one(self, query):
+        docs = self._find(query)[:1]
+        for doc in docs:
+            del self._docs[doc["_id"]]
+        return SimpleNamespace(deleted_count=len(docs))
+
+    async def delete_many(self, query):
+        docs = self._find(query)
+        for doc in docs:
+            del self._docs[doc["_id"]]
+        return SimpleNamespace(deleted_count=len(docs))
+
+    async def replace_one(self, query, doc, upsert: bool = False):
+        found = self._find(query)[:1]
+        if found:
+            doc = dict(doc, _id=found[0]["_id"])
+            self._docs[doc["_id"]] = copy.deepcopy(doc)
+            return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=self._insert(dict(doc)))
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def update_one(self, query, update, upsert: bool = False):
+        return self._update(query, update, upsert)
+
+    async def update_many(self, query, update, upsert: bool = False):
+        return self._update(query, update, upsert, many=True)
+
+    async def bulk_write(self, ops: List[Any], ordered: bool = True):
+        for op in ops:
+            if isinstance(op, UpdateOne):
+                self._update(op._filter, op._doc, op._upsert)
+            elif isinstance(op, ReplaceOne):
+                await self.replace_one(op._filter, op._doc, op._upsert)
+            elif isinstance(op, InsertOne):
+                self._insert(op._doc)
+            else:
+                raise OperationFailure(f"unsupported bulk operation {type(op).__name__}")
+        return SimpleNamespace(acknowledged=True)
+
+    def aggregate(self, pipeline: List[Dict[str, Any]]) -> MemoryCursor:
+        docs = [copy.deepcopy(d) for d in self._docs.values()]
+        for stage in pipeline:
+            (op, arg), = stage.items()
+            if op == "$match":
+                docs = [d for d in docs if matches(d, arg)]
+            elif op == "$sort":
+                docs = _sorted(docs, list(arg.items()))
+            elif op == "$project":
+                docs = [_project(d, arg) for d in docs]
+            elif op == "$limit":
+                docs = docs[:arg]
+            else:
+                raise OperationFailure(f"unsupported pipeline stage {op}")
+        return MemoryCursor(docs, None)
+
+    async def count_documents(self, query) -> int:
+        return len(self._find(query))
+
+    async def estimated_document_count(self) -> int:
+        return len(self._docs)
+
+    async def drop(self) -> None:
+        self._docs.clear()
+
+    async def distinct(self, key: str, query=None) -> List[Any]:
+        values: List[Any] = []
+        for doc in self._find(query):
+            value = _get(doc, key)
+            if value is not _MISSING and value not in values:
+                values.append(value)
+        return values
+
+
+class _NoChangeStream:
+    async def __aenter__(self):
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", code=40573)
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class MemoryDatabase:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+        self._options: Dict[str, Dict[str, Any]] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name)
+        return self._collections[name]
+
+    async def list_collection_names(self) -> List[str]:
+        return list(self._collections)
+
+    async def list_collections(self, filter: Optional[Dict[str, Any]] = None) -> MemoryCursor:
+        infos = [
+            {
+                "name":    name,
+                "type":    "timeseries" if "timeseries" in self._options.get(name, {}) else "collection",
+                "options": self._options.get(name, {}),
+            }
+            for name in self._collections
+        ]
+        return MemoryCursor([i for i in infos if matches(i, filter)], None)
+
+    async def create_collection(self, name: str, **options: Any) -> MemoryCollection:
+        self._options[name] = options
+        return self[name]
+
+    async def command(self, *args: Any, **kwargs: Any) -> Dict[str, Any]:
+        return {"ok": 1.0}
+
+    def watch(self, *args: Any, **kwargs: Any) -> _NoChangeStream:
+        return _NoChangeStream()
+
+
+class MemoryClient:
+    def __init__(self) -> None:
+        self._databases: Dict[str, MemoryDatabase] = {}
+        self.admin = self["admin"]
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(name)
+        return self._databases[name]
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,120 @@
+import asyncio
+import json
+from pathlib import Path
+
+import httpx
+
+import http_client
+from config import settings
+from routers import redcap
+from services.branching import compile_branching, encode_answer, redcap_fields
+from tools.fake_redcap import FakeRedcap
+
+EXAMPLE = Path(__file__).parent.parent / "studies" / "example_new.json"
+
+
+def _q(id, type, hide_id="none", hide_value="", hide_if=False, **kw):
+    return {"id": id, "type": type, "text": id, "hide_id": hide_id,
+            "hide_value": hide_value, "hide_if": hide_if, **kw}
+
+
+def _survey(*questions):
+    return [{"id": "m", "params": {"sections": [{"questions": list(questions)}]}}]
+
+
+def test_example_dependency_index():
+    doc = json.loads(EXAMPLE.read_text())
+    compiled = compile_branching(doc["modules"])
+    assert compiled["errors"] == []
+    survey = compiled["surveys"]["wear_log"]
+    assert survey["dependents"]["off_or_on"] == [
+        "in_motion", "onwrist_covered", "onwrist_skincontact", "other_specify"
+    ]
+    assert survey["rules"]["in_motion"] == {"source": "off_or_on", "op": "=", "value": "Off-wrist"}
+
+
+def test_redcap_fields_and_logic():
+    fields = redcap_fields(_survey(
+        _q("pick", "multi", options=["A", "B"], radio=False),
+        _q("level", "slider", min=0, max=10, hint_left="low", hint_right="high"),
+        _q("ok", "yesno", yes_text="Sure", no_text="Nope"),
+        _q("a", "text", hide_id="pick", hide_value="B"),
+        _q("b", "text", hide_id="level", hide_value=">5", hide_if=True),
+        _q("c", "text", hide_id="ok", hide_value="Yes"),
+    ))
+    assert fields["field_pick"]["field_type"] == "checkbox"
+    assert fields["field_pick"]["select_choices_or_calculations"] == "1, A | 2, B"
+    assert fields["field_level"]["text_validation_max"] == "10"
+    assert fields["field_ok"]["select_choices_or_calculations"] == "1, Sure | 0, Nope"
+    assert fields["field_a"]["branching_logic"] == "[field_pick(2)] = '1'"
+    # hide_if: shown below the bound
+    assert fields["field_b"]["branching_logic"] == "[field_level] < 5"
+    assert fields["field_c"]["branching_logic"] == "[field_ok] = '1'"
+
+
+def test_invalid_rules_are_reported():
+    errors = compile_branching(_survey(
+        _q("pick", "multi", options=["A"], radio=True),
+        _q("a", "text", hide_id="nope", hide_value="A"),
+        _q("b", "text", hide_id="pick", hide_value="Z"),
+        _q("c", "yesno", hide_id="d", hide_value="Yes"),
+        _q("d", "yesno", hide_id="c", hide_value="No"),
+    ))["errors"]
+    assert len(errors) == 3
+    assert "unknown question 'nope'" in errors[0]
+    assert "'Z', which is not one of ['A']" in errors[1]
+    assert "Branching cycle" in errors[2]
+
+
+def test_answers_are_coded():
+    book = {
+        "field_pick": {"choices": [["A", "1"], ["B", "2"]], "checkbox": True},
+        "field_ok":   {"choices": [["Sure", "1"], ["Nope", "0"], ["Yes", "1"], ["No", "0"]], "checkbox": False},
+    }
+    assert encode_answer("field_pick", ["B"], book) == {"field_pick___1": "0", "field_pick___2": "1"}
+    assert encode_answer("field_ok", "Nope", book) == {"field_ok": "0"}
+    assert encode_answer("field_ok", True, book) == {"field_ok": "1"}
+    assert encode_answer("field_free", "text", book) == {"field_free": "text"}
+
+
+def test_unknown_checkbox_answers_pass_through(caplog):
+    book = {"field_pick": {"choices": [["A", "1"], ["B", "2"]], "checkbox": True}}
+    assert encode_answer("field_pick", [], book) == {"field_pick___1": "0", "field_pick___2": "0"}
+    # not recorded as "nothing picked"
+    assert encode_answer("field_pick", ["B", "Z"], book) == {"field_pick": ["B", "Z"]}
+    assert encode_answer("field_pick", "B", book) == {"field_pick": "B"}
+    assert encode_answer("field_pick", [["A"], "B"], book) == {"field_pick": [["A"], "B"]}
+    assert "field_pick" in caplog.text
+
+
+def test_unhashable_answers_to_coded_fields_pass_through(caplog):
+    book = {"field_ok": {"choices": [["Sure", "1"], ["Nope", "0"]], "checkbox": False}}
+    assert encode_answer("field_ok", ["Sure"], book) == {"field_ok": ["Sure"]}
+    assert encode_answer("field_ok", {"a": 1}, book) == {"field_ok": {"a": 1}}
+    assert "field_ok" in caplog.text
+
+
+def test_project_gets_branching_and_coded_records(monkeypatch, memory_db, memory_client):
+    fake = FakeRedcap()
+    monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(transport=fake.transport()))
+    monkeypatch.setattr(settings, "redcap_super_api_token", "t")
+    doc = json.loads(EXAMPLE.read_text())
+    r = memory_client.post("/api/v2/redcap/project/alice", json=doc)
+    assert r.status_code == 201
+
+    project = next(iter(fake.projects.values()))
+    meta = {row["field_name"]: row for row in project.metadata}
+    assert meta["field_in_motion"]["branching_logic"] == "[field_off_or_on] = '1'"
+    assert meta["field_off_or_on"]["field_type"] == "radio"
+
+    sid = doc["properties"]["study_id"]
+    book = asyncio.run(redcap._get_codebook(memory_db, sid))
+    rsp = redcap.ResponseEntry(
+        data_type="survey_response", user_id="u1", study_id=sid, module_index=1,
+        platform="ios", module_id="wear_log", module_name="Wear log",
+        responses=json.dumps({"off_or_on": "On-wrist", "in_motion": "Yes"}), entries=None,
+        response_time="2026-01-01T08:05:00Z", response_time_in_ms=1000,
+        alert_time="2026-01-01T08:00:00Z",
+    )
+    record = redcap._redcap_record(rsp, book)
+    assert (record["field_off_or_on"], record["field_in_motion"]) == ("2", "1")
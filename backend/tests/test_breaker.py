@@ -0,0 +1,116 @@
+import asyncio
+
+import httpx
+import pytest
+
+import http_client
+from routers import redcap
+from services.breaker import CLOSED, HALF_OPEN, OPEN, BreakerRegistry, CircuitBreaker
+from services.delivery import RedcapDelivery
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(clock):
+    return CircuitBreaker(
+        "https://redcap.example/api/",
+        window=10,
+        min_calls=4,
+        failure_threshold=0.5,
+        open_for_s=30,
+        clock=clock,
+    )
+
+
+def test_opens_on_failure_rate_and_fails_fast():
+    clock = FakeClock()
+    b = make_breaker(clock)
+    b.record_success()
+    b.record_failure()
+    b.record_failure()
+    assert b.state == CLOSED  # below min_calls
+    b.record_failure()
+    assert b.state == OPEN
+    assert not b.allow()
+    assert b.stats()["rejected"] == 1
+
+def test_half_open_probe_closes_or_reopens():
+    clock = FakeClock()
+    b = make_breaker(clock)
+    for _ in range(4):
+        b.record_failure()
+
+    clock.now = 31
+    assert b.allow()               # the single probe
+    assert b.state == HALF_OPEN
+    assert not b.allow()           # everyone else still fails fast
+    b.record_failure()
+    assert b.state == OPEN
+
+    clock.now = 62
+    assert b.allow()
+    b.record_success()
+    assert b.state == CLOSED
+    assert b.allow()
+
+def test_open_circuit_parks_deliveries_without_calling_handler():
+    calls = []
+    registry = BreakerRegistry(window=10, min_calls=1, failure_threshold=0.5, open_for_s=60)
+    registry.get("down").record_failure()
+
+    async def handler(url, payload):
+        calls.append(url)
+
+    async def run():
+        d = RedcapDelivery(
+            handler=handler,
+            max_pending=10,
+            max_pending_per_server=10,
+            initial_concurrency=2,
+            max_concurrency=4,
+            drain_interval_s=60,
+            breakers=registry,
+        )
+        parked = []
+
+        async def spill(url, payload, trace=None, attempts=0):
+            parked.append(url)
+
+        d.spill = spill
+        for url in ("down", "up"):
+            assert d.reserve(url)
+            d.submit(url, {})
+        await asyncio.sleep(0.01)
+        return parked
+
+    parked = asyncio.run(run())
+    assert parked == ["down"]
+    assert calls == ["up"]
+
+
+def test_probe_failing_outside_transport_settles_the_breaker(monkeypatch):
+    clock = FakeClock()
+    registry = BreakerRegistry(window=10, min_calls=1, failure_threshold=0.5, open_for_s=30, clock=clock)
+    registry.get("https://redcap.example/api/").record_failure()
+    monkeypatch.setattr(redcap, "breakers", registry)
+
+    def undecodable(request):
+        raise httpx.DecodingError("bad gzip", request=request)
+
+    monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(undecodable)))
+    clock.now = 31
+    with pytest.raises(httpx.DecodingError):
+        asyncio.run(redcap._redcap_post("https://redcap.example/api/", {"content": "record"}, timeout=1))
+
+    # the probe failed, so the circuit re-opened and probes again later
+    breaker = registry.get("https://redcap.example/api/")
+    assert breaker.state == OPEN
+    clock.now = 62
+    assert not breaker.is_open()
+    assert breaker.allow()
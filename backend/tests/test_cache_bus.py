@@ -0,0 +1,57 @@
+import asyncio
+
+import db
+from services.cache import TTLCache
+from services.cache_bus import InvalidationBus
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def sort(self, field, direction):
+        self._docs = sorted(self._docs, key=lambda d: d[field])
+        return self
+
+    async def to_list(self, length):
+        return self._docs[:length]
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, filter, projection=None):
+        (field, cond), = filter.items()
+        return FakeCursor([d for d in self.docs if d.get(field, 0) > cond["$gt"]])
+
+
+def test_publish_evicts_one_entry_or_everything():
+    cache = TTLCache(maxsize=10, ttl_s=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    bus = InvalidationBus(poll_interval_s=1)
+    bus.register("studies", lambda sid: cache.clear() if sid is None else cache.pop(sid))
+
+    bus.publish("studies", "a")
+    assert cache.get("a") is None and cache.get("b") == 2
+    bus.publish("studies", None)
+    assert len(cache) == 0
+
+def test_polling_picks_up_writes_from_other_workers(monkeypatch):
+    studies = FakeCollection([
+        {"timestamp": 900, "properties": {"study_id": "old"}},
+        {"timestamp": 10_500, "properties": {"study_id": "new"}},
+    ])
+    keys = FakeCollection([{"updated_at": 11_000, "study_id": "s-key"}])
+    monkeypatch.setattr(db, "get_db", lambda: {"studies": studies, "keys": keys})
+
+    seen = []
+    bus = InvalidationBus(poll_interval_s=1, poll_overlap_s=0)
+    bus.register("studies", lambda sid: seen.append(("studies", sid)))
+    bus.register("keys", lambda sid: seen.append(("keys", sid)))
+
+    marks = {"studies": 10_000, "keys": 10_000}
+    asyncio.run(bus.poll_once(marks))
+    assert seen == [("studies", "new"), ("keys", "s-key")]
+    assert marks == {"studies": 10_500, "keys": 11_000}
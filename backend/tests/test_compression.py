@@ -0,0 +1,95 @@
+import asyncio
+import gzip
+
+from fastapi import FastAPI, Response
+from fastapi.testclient import TestClient
+
+from services import compression
+from services.compression import CompressionMiddleware, PrecompressedBody, negotiate
+
+
+def test_negotiate_honours_q_values():
+    assert negotiate(None) is None
+    assert negotiate("identity") is None
+    assert negotiate("gzip") == "gzip"
+    assert negotiate("br;q=0, gzip;q=0.5") == "gzip"
+    assert negotiate("gzip;q=0") is None
+    expected = "br" if compression.brotli is not None else "gzip"
+    assert negotiate("gzip, deflate, br") == expected
+    assert negotiate("*") == expected
+
+
+def test_precompressed_body_encodes_once():
+    entry = PrecompressedBody(b'{"a": 1}' * 100)
+    first = asyncio.run(entry.get("gzip"))
+    assert gzip.decompress(first) == entry.body
+    assert asyncio.run(entry.get("gzip")) is first
+    assert asyncio.run(entry.get(None)) is entry.body
+
+
+def test_uncached_bodies_use_the_fast_level(monkeypatch):
+    levels = []
+    monkeypatch.setattr(compression, "compress", lambda body, enc, best=False: levels.append(best) or body)
+    asyncio.run(PrecompressedBody(b"{}", best=False).get("gzip"))
+    asyncio.run(PrecompressedBody(b"{}").get("gzip"))
+    assert levels == [False, True]
+
+
+def _app(thread_size=64 * 1024):
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, min_size=100, thread_size=thread_size)
+
+    @app.get("/big")
+    async def big():
+        return {"data": "x" * 500}
+
+    @app.get("/small")
+    async def small():
+        return {"data": "x"}
+
+    @app.get("/encoded")
+    async def encoded():
+        return Response(gzip.compress(b"{}"), media_type="application/json",
+                        headers={"Content-Encoding": "gzip"})
+
+    return TestClient(app)
+
+
+def test_middleware_compresses_large_json_only():
+    client = _app()
+    # httpx decodes transparently, so check headers and the decoded body
+    r = client.get("/big", headers={"Accept-Encoding": "gzip"})
+    assert r.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in r.headers["vary"]
+    assert r.json() == {"data": "x" * 500}
+
+    r = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in r.headers
+
+    r = client.get("/big", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in r.headers
+
+    # already encoded responses are not compressed twice
+    r = client.get("/encoded", headers={"Accept-Encoding": "gzip"})
+    assert r.headers["content-encoding"] == "gzip"
+    assert r.json() == {}
+
+
+def test_middleware_compresses_large_bodies_in_a_thread(monkeypatch):
+    offloaded = []
+    to_thread = asyncio.to_thread
+
+    async def recording_to_thread(func, *args):
+        offloaded.append(len(args[0]))
+        return await to_thread(func, *args)
+
+    monkeypatch.setattr(compression.asyncio, "to_thread", recording_to_thread)
+    client = _app(thread_size=400)
+    assert client.get("/big", headers={"Accept-Encoding": "gzip"}).json() == {"data": "x" * 500}
+    assert client.get("/encoded", headers={"Accept-Encoding": "gzip"}).status_code == 200
+    assert len(offloaded) == 1 and offloaded[0] > 400
+
+    # below the threshold it stays inline
+    offloaded.clear()
+    assert _app().get("/big", headers={"Accept-Encoding": "gzip"}).headers["content-encoding"] == "gzip"
+    assert offloaded == []
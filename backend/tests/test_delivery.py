@@ -0,0 +1,122 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import db
+from services.delivery import OUTBOX, AIMDLimit, RedcapDelivery
+from memory_mongo import MemoryDatabase
+
+
+def make_delivery(handler, **overrides):
+    opts = dict(
+        max_pending=10,
+        max_pending_per_server=6,
+        initial_concurrency=2,
+        max_concurrency=8,
+        drain_interval_s=60,
+    )
+    opts.update(overrides)
+    return RedcapDelivery(handler=handler, **opts)
+
+
+def test_aimd_limit_grows_slowly_and_halves():
+    limit = AIMDLimit(initial=4, minimum=1, maximum=8)
+    # roughly one extra slot per `limit` successes
+    for _ in range(5):
+        limit.on_success()
+    assert limit.limit == 5
+    limit.on_congestion()
+    assert limit.limit == 2
+    for _ in range(10):
+        limit.on_congestion()
+    assert limit.limit == 1
+
+def test_slow_server_cannot_starve_others():
+    delivered = []
+    stuck = asyncio.Event()
+
+    async def handler(url, payload):
+        if url == "slow":
+            await stuck.wait()
+        delivered.append((url, payload["n"]))
+
+    async def run():
+        d = make_delivery(handler)
+        # fill the slow server up to its own cap
+        for n in range(6):
+            assert d.reserve("slow")
+            d.submit("slow", {"n": n})
+        assert not d.reserve("slow")
+
+        # the global cap still has room for the healthy server
+        assert d.reserve("fast")
+        d.submit("fast", {"n": 99})
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert ("fast", 99) in delivered
+        assert d.stats()["servers"]["slow"]["in_flight"] == 2
+
+        stuck.set()
+        await asyncio.sleep(0.01)
+        assert d.pending == 0
+        return d
+
+    d = asyncio.run(run())
+    assert d.rejected == 1
+    assert d.stats()["servers"]["slow"]["delivered"] == 6
+
+def test_server_errors_shrink_the_limit():
+    async def handler(url, payload):
+        raise ConnectionError(url)
+
+    async def run():
+        d = make_delivery(handler, initial_concurrency=4)
+
+        async def spill(url, payload, trace=None, attempts=0):
+            pass
+
+        d.spill = spill
+        assert d.reserve("down")
+        d.submit("down", {})
+        await asyncio.sleep(0.01)
+        return d.stats()["servers"]["down"]
+
+    stats = asyncio.run(run())
+    assert stats["failed"] == 1
+    assert stats["limit"] == 2
+
+
+def test_failed_deliveries_are_retried_from_the_outbox(monkeypatch):
+    database = MemoryDatabase("test")
+    monkeypatch.setattr(db, "get_db", lambda: database)
+    calls = []
+
+    async def handler(url, payload):
+        calls.append(payload["n"])
+        raise ConnectionError(url)
+
+    async def redrive(d):
+        # make the parked delivery due, then drain it like the background loop
+        await database[OUTBOX].update_many({}, {"$set": {"retry_at": datetime.now(timezone.utc)}})
+        moved = await d.drain_once()
+        await asyncio.sleep(0.01)
+        return moved
+
+    async def run():
+        d = make_delivery(handler, max_attempts=2)
+        assert d.reserve("down")
+        d.submit("down", {"n": 1})
+        await asyncio.sleep(0.01)
+        parked = await database[OUTBOX].find_one({})
+        # not due before its backoff
+        assert await d.drain_once() == 0
+
+        assert await redrive(d) == 1
+        return d, parked
+
+    d, parked = asyncio.run(run())
+    assert parked["attempts"] == 1 and parked["payload"] == {"n": 1}
+    assert parked["retry_at"] - parked["created_at"] == timedelta(seconds=60)
+    # the second failure was the last attempt: logged, not parked again
+    assert calls == [1, 1]
+    assert asyncio.run(database[OUTBOX].count_documents({})) == 0
+    assert (d.retried, d.given_up) == (1, 1)
@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import http_client
+from routers import redcap
+from services.breaker import CircuitOpenError
+from tools.fake_redcap import FakeRedcap
+
+URL = "http://fake-redcap/api/"
+
+
+def _post(client, **form):
+    return client.post(URL, data=form)
+
+
+def test_project_setup_and_repeating_records():
+    fake = FakeRedcap(super_token="super")
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=fake.transport()) as client:
+            r = await _post(client, token="wrong", content="project", data="[]")
+            assert r.status_code == 403
+            r = await _post(client, token="super", content="project", format="json",
+                            data=json.dumps([{"project_title": "S"}]))
+            token = r.text
+            r = await _post(client, token=token, content="metadata", data=json.dumps(
+                [{"field_name": "field_record_id", "form_name": "module_m1"}]))
+            assert r.json() == 1
+            for value in ("a", "b"):
+                r = await _post(client, token=token, content="record", data=json.dumps([{
+                    "field_record_id": "u1",
+                    "redcap_repeat_instrument": "module_m1",
+                    "redcap_repeat_instance": "new",
+                    "field_q": value,
+                }]))
+                assert r.json() == {"count": 1}
+            r = await _post(client, token=token, content="record", format="json")
+            return r.json()
+
+    records = asyncio.run(scenario())
+    assert [(r["redcap_repeat_instance"], r["field_q"]) for r in records] == [(1, "a"), (2, "b")]
+    assert fake.stats()["requests"]["record:import"] == 2
+
+
+def test_rate_limit_answers_429():
+    fake = FakeRedcap(super_token="super", rate_limit=0.01, burst=1)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=fake.transport()) as client:
+            return [
+                (await _post(client, token="super", content="project", data="[]")).status_code
+                for _ in range(2)
+            ]
+
+    assert asyncio.run(scenario()) == [400, 429]
+
+
+def test_injected_errors_open_the_breaker(monkeypatch):
+    fake = FakeRedcap(error_rate=1.0)
+    monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(transport=fake.transport()))
+    url = "http://fake-redcap-breaker/api/"
+
+    async def scenario():
+        statuses = []
+        for _ in range(redcap.breakers.get(url).min_calls):
+            statuses.append((await redcap._redcap_post(url, {"content": "record"}, 1.0)).status_code)
+        with pytest.raises(CircuitOpenError):
+            await redcap._redcap_post(url, {"content": "record"}, 1.0)
+        return statuses
+
+    assert set(asyncio.run(scenario())) == {500}
@@ -1,4 +1,95 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+
+import main
+from main import app
+from services.health import HealthProber
+
+
 def test_health_check(client):
     r = client.get("/health")
     assert r.status_code == 200
-    assert r.json() == {"status": "ok", "mongo": "reachable"}
\ No newline at end of file
+    body = r.json()
+    assert body["status"] in ("ok", "degraded")
+    assert body["mongo"] == "reachable"
+    assert body["dependencies"]["mongo"]["ok"] is True
+
+
+def test_live_does_not_wait_for_dependencies(monkeypatch):
+    # /live must answer even while Mongo hasn't answered the first ping
+    async def unreachable():
+        await asyncio.sleep(3600)
+
+    monkeypatch.setattr(main.db, "ping", unreachable)
+    with TestClient(app) as c:
+        r = c.get("/live")
+        assert r.status_code == 200
+        assert r.json() == {"status": "alive"}
+
+        r = c.get("/ready")
+        assert r.status_code == 503
+        assert r.json()["status"] == "starting"
+
+
+def test_ready_once_warm_up_is_done(monkeypatch):
+    async def ok(*args):
+        return None
+
+    monkeypatch.setattr(main.db, "ping", ok)
+    monkeypatch.setattr(main.db, "ensure_indexes", ok)
+    monkeypatch.setattr(main.log_store, "provision", ok)
+    monkeypatch.setattr(main.http_client, "warm_up", ok)
+    with TestClient(app) as c:
+        deadline = time.monotonic() + 5
+        r = c.get("/ready")
+        while r.status_code != 200 and time.monotonic() < deadline:
+            time.sleep(0.01)
+            r = c.get("/ready")
+        assert r.status_code == 200
+        assert r.json()["status"] == "ready"
+        assert set(r.json()["startup_ms"]) >= {"mongo", "indexes", "total"}
+
+
+def test_prober_degrades_when_redcap_is_down():
+    prober = HealthProber(interval_s=60, timeout_s=1)
+
+    async def ok():
+        return None
+
+    async def down(url):
+        raise ConnectionError(url)
+
+    prober._ping_mongo = ok
+    prober._head_redcap = down
+    asyncio.run(prober.probe_once())
+
+    snap = prober.snapshot()
+    assert snap["status"] == "degraded"
+    assert snap["mongo"] == "reachable"
+    redcap = [v for k, v in snap["dependencies"].items() if k.startswith("redcap:")]
+    assert redcap and not redcap[0]["ok"] and redcap[0]["last_ok_at"] is None
+
+
+def test_prober_forgets_servers_no_longer_configured():
+    prober = HealthProber(interval_s=60, timeout_s=1)
+
+    async def ok():
+        return None
+
+    async def head(url):
+        if url == "https://gone.example/api/":
+            raise ConnectionError(url)
+
+    prober._ping_mongo = ok
+    prober._head_redcap = head
+    prober._redcap_urls = ["https://redcap.example/api/", "https://gone.example/api/"]
+    asyncio.run(prober.probe_once())
+    assert prober.snapshot()["status"] == "degraded"
+
+    prober._redcap_urls = ["https://redcap.example/api/"]
+    asyncio.run(prober.probe_once())
+    snap = prober.snapshot()
+    assert snap["status"] == "ok"
+    assert set(snap["dependencies"]) == {"mongo", "redcap:https://redcap.example/api/"}
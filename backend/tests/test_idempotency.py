@@ -0,0 +1,181 @@
+import asyncio
+import json
+
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from config import settings
+from main import app
+from routers import redcap
+from services import idempotency, ingest
+from memory_mongo import MemoryDatabase
+
+
+def test_derived_key_is_stable_per_prompt():
+    a = idempotency.derive_key("s1", "u1", "m1", "2025-05-22T12:00:01Z")
+    b = idempotency.derive_key("s1", "u1", "m1", "2025-05-22T12:00:01Z")
+    c = idempotency.derive_key("s1", "u1", "m1", "2025-05-23T12:00:01Z")
+    assert a == b != c
+
+def test_second_claim_returns_original_result():
+    db = MemoryDatabase("test")
+
+    async def run():
+        first = await idempotency.claim(db, "k-claim", "s1")
+        await idempotency.complete(db, "k-claim", {"accepted": True})
+        # drop the in-memory entry so the unique _id is what catches the retry
+        idempotency._recent.clear()
+        second = await idempotency.claim(db, "k-claim", "s1")
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first is None
+    assert second == {"accepted": True}
+
+def test_released_key_can_be_claimed_again():
+    db = MemoryDatabase("test")
+
+    async def run():
+        await idempotency.claim(db, "k-release", "s1")
+        await idempotency.release(db, "k-release")
+        return await idempotency.claim(db, "k-release", "s1")
+
+    assert asyncio.run(run()) is None
+
+
+def test_pending_claim_is_not_replayed():
+    db = MemoryDatabase("test")
+    asyncio.run(idempotency.claim(db, "k-pending", "s1"))
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(idempotency.claim(db, "k-pending", "s1"))
+    assert e.value.status_code == 409
+    assert e.value.headers["Retry-After"] == str(settings.idempotency_retry_after_s)
+
+    # the worker holding it died: after the timeout the key is taken over
+    old = datetime.now(timezone.utc) - timedelta(seconds=settings.idempotency_pending_timeout_s + 1)
+    asyncio.run(db[idempotency.COLLECTION].update_one({"_id": "k-pending"}, {"$set": {"created_at": old}}))
+    assert asyncio.run(idempotency.claim(db, "k-pending", "s1")) is None
+
+
+RESPONSE = {
+    "data_type": "survey", "user_id": "u1", "study_id": "s1", "module_index": "0",
+    "platform": "ios", "module_id": "m1", "module_name": "M",
+    "responses": json.dumps({"q1": "yes"}), "response_time": "2026-01-01T08:05:00Z",
+    "response_time_in_ms": "1000", "alert_time": "2026-01-01T08:00:00Z",
+}
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    # deliveries are recorded instead of pushed, their reservation released
+    sent = []
+
+    def submit(url, payload):
+        redcap.delivery.cancel(url)
+        sent.append(payload)
+
+    monkeypatch.setattr(redcap.delivery, "submit", submit)
+    return sent
+
+
+@pytest.mark.parametrize("path", ["/api/v2/response", "/api/v2/redcap/response"])
+def test_failed_admission_gives_the_key_back(monkeypatch, memory_db, queued, path):
+    lookup = ingest.redcap_url
+    calls = []
+
+    async def flaky_lookup(db, study_id):
+        calls.append(study_id)
+        if len(calls) == 1:
+            raise ConnectionError("mongo went away")
+        return await lookup(db, study_id)
+
+    monkeypatch.setattr(ingest, "redcap_url", flaky_lookup)
+    client = TestClient(app, raise_server_exceptions=False)
+    pending = redcap.delivery.pending
+    headers = {"Idempotency-Key": f"k-admit-{path}"}
+
+    first = client.post(path, data=RESPONSE, headers=headers)
+    assert first.status_code == 500
+    retry = client.post(path, data=RESPONSE, headers=headers)
+    assert retry.status_code == 202
+    assert "Idempotent-Replayed" not in retry.headers
+    assert asyncio.run(memory_db["responses_backup"].count_documents({})) == 1
+    assert len(queued) == 1
+    assert redcap.delivery.pending == pending
+
+
+def test_failed_spill_keeps_the_stored_response(monkeypatch, memory_db, memory_client):
+    async def broken_spill(url, payload, trace=None, attempts=0):
+        raise ConnectionError("outbox unavailable")
+
+    monkeypatch.setattr(settings, "redcap_overflow", "spill")
+    monkeypatch.setattr(redcap.delivery, "reserve", lambda url: False)
+    monkeypatch.setattr(redcap.delivery, "spill", broken_spill)
+
+    r = memory_client.post("/api/v2/response", data=RESPONSE, headers={"Idempotency-Key": "k-spill"})
+    assert r.status_code == 202
+    assert asyncio.run(memory_db["responses"].count_documents({})) == 1
+
+
+def test_retry_after_a_partial_write_stores_one_copy(monkeypatch, memory_db, queued):
+    responses = memory_db["responses"]
+    upsert = responses.update_one
+    calls = []
+
+    async def flaky_upsert(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise ConnectionError("mongo went away")
+        return await upsert(*args, **kwargs)
+
+    monkeypatch.setattr(responses, "update_one", flaky_upsert)
+    client = TestClient(app, raise_server_exceptions=False)
+    headers = {"Idempotency-Key": "k-partial"}
+
+    # the backup is written, the responses copy isn't
+    assert client.post("/api/v2/response", data=RESPONSE, headers=headers).status_code == 500
+    retry = client.post("/api/v2/response", data=RESPONSE, headers=headers)
+    assert retry.status_code == 202
+    assert asyncio.run(memory_db["responses_backup"].count_documents({"idempotency_key": "k-partial"})) == 1
+    assert asyncio.run(responses.count_documents({"idempotency_key": "k-partial"})) == 1
+
+
+def test_concurrent_retry_waits_for_the_first_request(monkeypatch, memory_db, queued):
+    responses = memory_db["responses"]
+    upsert = responses.update_one
+
+    async def run():
+        writing, fail = asyncio.Event(), asyncio.Event()
+
+        async def slow_failing_upsert(*args, **kwargs):
+            if not fail.is_set():
+                writing.set()
+                await asyncio.sleep(0.05)
+                fail.set()
+                raise ConnectionError("mongo went away")
+            return await upsert(*args, **kwargs)
+
+        monkeypatch.setattr(responses, "update_one", slow_failing_upsert)
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        headers = {"Idempotency-Key": "k-concurrent"}
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = asyncio.create_task(client.post("/api/v2/response", data=RESPONSE, headers=headers))
+            await writing.wait()
+            # not told "accepted" while the first request may still fail
+            concurrent = await client.post("/api/v2/response", data=RESPONSE, headers=headers)
+            failed = await first
+            retry = await client.post("/api/v2/response", data=RESPONSE, headers=headers)
+        return concurrent, failed, retry
+
+    concurrent, failed, retry = asyncio.run(run())
+    assert concurrent.status_code == 409
+    assert "Retry-After" in concurrent.headers
+    assert failed.status_code == 500
+    assert retry.status_code == 202
+    assert "Idempotent-Replayed" not in retry.headers
+    assert asyncio.run(responses.count_documents({"idempotency_key": "k-concurrent"})) == 1
+    assert asyncio.run(memory_db["responses_backup"].count_documents({"idempotency_key": "k-concurrent"})) == 1
@@ -0,0 +1,57 @@
+import asyncio
+import json
+from pathlib import Path
+
+from bson import ObjectId
+
+from config import settings
+from services.study_hash import canonical_hash
+from tools import import_studies
+from tools.import_studies import check_file
+from memory_mongo import MemoryDatabase
+
+EXAMPLE = Path(__file__).parent.parent / "studies" / "example_new.json"
+
+
+def test_valid_file_is_serialized_and_hashed():
+    result = check_file(str(EXAMPLE))
+    assert result.errors == []
+    assert result.study_id == json.loads(EXAMPLE.read_text())["properties"]["study_id"]
+    assert result.doc["_type"] == "study"
+    assert result.doc["content_hash"] == canonical_hash(result.doc)
+
+def test_every_error_is_reported(tmp_path):
+    broken = json.loads(EXAMPLE.read_text())
+    del broken["properties"]["study_id"]
+    del broken["properties"]["study_name"]
+    path = tmp_path / "broken.json"
+    path.write_text(json.dumps(broken))
+
+    result = check_file(str(path))
+    assert result.doc is None
+    assert sorted(result.errors) == [
+        "properties.study_id: Field required",
+        "properties.study_name: Field required",
+    ]
+
+def test_hash_ignores_formatting_and_server_fields():
+    doc = json.loads(EXAMPLE.read_text())
+    reordered = json.loads(json.dumps(doc, sort_keys=True))
+    reordered["timestamp"] = 123
+    reordered["_id"] = "abc"
+    assert canonical_hash(doc) == canonical_hash(reordered)
+
+
+def test_imported_studies_get_their_latest_snapshot(monkeypatch, tmp_path):
+    database = MemoryDatabase("test")
+    monkeypatch.setattr(import_studies.db, "get_db", lambda: database)
+    monkeypatch.setattr(settings, "snapshot_dir", str(tmp_path))
+    doc = check_file(str(EXAMPLE)).doc
+    sid = doc["properties"]["study_id"]
+    # a stale snapshot Caddy would otherwise keep serving
+    (tmp_path / f"{sid}.json").write_text("{}")
+    for ts in (1, 2):
+        asyncio.run(database["studies"].insert_one({**doc, "_id": ObjectId(), "timestamp": ts}))
+
+    assert asyncio.run(import_studies.publish_latest([sid, "missing"])) == 1
+    assert json.loads((tmp_path / f"{sid}.json").read_text())["timestamp"] == 2
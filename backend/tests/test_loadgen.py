@@ -0,0 +1,58 @@
+import argparse
+import asyncio
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import db
+import http_client
+from models.study import Alert, StudyCreate
+from tools import loadgen
+
+START = datetime(2026, 1, 5, tzinfo=timezone.utc)
+
+
+def _alert(**kw):
+    base = dict(title="t", message="m", random=False, randomInterval=0,
+                sticky=False, stickyLabel="", timeout=False, timeoutAfter=0)
+    return Alert(**{**base, **kw})
+
+
+def test_absolute_daily_alert_with_extra_times():
+    alert = _alert(startDateTime="2025-06-16T23:00:00Z", times=["09:00:00", "21:00:00"],
+                   repeat="daily", until="2025-12-31")
+    shift = START - datetime(2025, 6, 16, tzinfo=timezone.utc)
+    times = loadgen.prompt_times(alert, START, shift, START + timedelta(days=3), random.Random(0))
+    assert len(times) == 9
+    assert times[0] == START + timedelta(hours=9)
+
+
+def test_relative_alert_stops_after_repeat_count():
+    alert = _alert(scheduleMode="relative", offsetDays=1, offsetTime="08:00",
+                   repeat="daily", interval=2, repeatCount=2, random=True, randomInterval=30)
+    enrolled = START + timedelta(hours=12)
+    times = loadgen.prompt_times(alert, enrolled, timedelta(0), START + timedelta(days=30), random.Random(0))
+    assert len(times) == 3
+    for n, at in enumerate(times):
+        assert abs(at - (START + timedelta(days=1 + 2 * n, hours=8))) <= timedelta(minutes=30)
+
+
+def test_in_process_run_delivers_every_response(monkeypatch):
+    monkeypatch.setattr(db, "_client", None)
+    monkeypatch.setattr(http_client, "_client", None)
+    doc = json.loads((Path(__file__).parent.parent / "studies" / "example_new.json").read_text())
+    doc["properties"]["study_id"] = "loadgen_test"
+    study = StudyCreate.model_validate(doc)
+    plan = loadgen.build_plan(study, 3, 1, 0, 1.0, random.Random(1))
+    args = argparse.Namespace(
+        speedup=1e6, max_in_flight=50, seed=1, drain_timeout=5.0,
+        redcap_latency_ms=0.0, redcap_error_rate=0.0, redcap_rate_limit=0.0,
+    )
+
+    summary = asyncio.run(loadgen.run_in_process(doc, plan, args))
+
+    responses = summary["endpoints"]["response"]
+    assert responses["error_rate"] == 0
+    assert summary["endpoints"]["log"]["statuses"] == {"204": summary["endpoints"]["log"]["count"]}
+    assert summary["fake_redcap"]["records"] == responses["count"]
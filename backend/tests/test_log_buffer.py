@@ -0,0 +1,55 @@
+import asyncio
+
+import db
+from services.log_buffer import LogBuffer
+
+
+class FakeCollection:
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    async def insert_many(self, docs, ordered=True):
+        assert ordered is False
+        if self.fail:
+            raise ConnectionError("mongo down")
+        self.batches.append(list(docs))
+
+
+def use_collection(monkeypatch, coll):
+    monkeypatch.setattr(db, "get_db", lambda: {"logs": coll})
+
+
+def test_flushes_in_batches_and_drains_on_stop(monkeypatch):
+    coll = FakeCollection()
+    use_collection(monkeypatch, coll)
+    buf = LogBuffer("logs", max_batch=3, flush_interval_s=60, capacity=100)
+
+    async def run():
+        buf.start()
+        buf.add_many({"n": n} for n in range(4))
+        await asyncio.sleep(0.01)      # size threshold reached → one flush
+        assert buf.stats()["buffered"] == 0
+        buf.add({"n": 4})
+        await buf.stop()               # leftovers written on shutdown
+
+    asyncio.run(run())
+    assert [len(b) for b in coll.batches] == [3, 1, 1]
+    assert buf.stats()["written"] == 5
+
+def test_overflow_is_counted_not_buffered(monkeypatch):
+    use_collection(monkeypatch, FakeCollection())
+    buf = LogBuffer("logs", max_batch=100, flush_interval_s=60, capacity=2)
+    assert buf.add_many({"n": n} for n in range(5)) == 2
+    assert buf.stats()["dropped"] == 3
+
+def test_failed_flush_keeps_events(monkeypatch):
+    coll = FakeCollection(fail=True)
+    use_collection(monkeypatch, coll)
+    buf = LogBuffer("logs", max_batch=10, flush_interval_s=60, capacity=10)
+    buf.add_many({"n": n} for n in range(3))
+    assert asyncio.run(buf.flush()) == 0
+    assert buf.stats()["buffered"] == 3
+
+    coll.fail = False
+    assert asyncio.run(buf.flush()) == 3
@@ -0,0 +1,92 @@
+import asyncio
+from datetime import datetime, timezone
+
+import db
+from routers import logs
+from services.log_counters import OVERFLOW, LogCounters
+from memory_mongo import MemoryCursor
+
+
+class FakeCollection:
+    def __init__(self):
+        self.ops = []
+
+    async def bulk_write(self, ops, ordered=True):
+        self.ops.extend(ops)
+
+
+def event(ts, page="home", event="open", platform="ios"):
+    return {
+        "study_id": "s1", "user_id": "u1", "page": page, "event": event,
+        "platform": platform, "timestamp_in_ms": ts,
+    }
+
+
+def test_events_are_rolled_up_per_minute(monkeypatch):
+    coll = FakeCollection()
+    monkeypatch.setattr(db, "get_db", lambda: {"log_counters": coll})
+    counters = LogCounters(flush_interval_s=60, raw_sample_rate=1.0)
+
+    counters.record(event(60_000))
+    counters.record(event(119_999))                  # same minute
+    counters.record(event(120_000))                  # next minute
+    counters.record(event(60_000, platform="android"))
+
+    assert asyncio.run(counters.flush()) == 3
+    incs = sorted(
+        (op._filter["minute"].minute, op._filter["platform"], op._doc["$inc"]["count"])
+        for op in coll.ops
+    )
+    assert incs == [(1, "android", 1), (1, "ios", 2), (2, "ios", 1)]
+    assert counters.stats()["pending_keys"] == 0
+
+def test_raw_sampling_rate():
+    assert LogCounters(60, raw_sample_rate=1.0).keep_raw()
+    assert not any(LogCounters(60, raw_sample_rate=0.0).keep_raw() for _ in range(100))
+
+
+def test_counters_beyond_max_keys_overflow(monkeypatch):
+    coll = FakeCollection()
+    monkeypatch.setattr(db, "get_db", lambda: {"log_counters": coll})
+    counters = LogCounters(flush_interval_s=60, raw_sample_rate=1.0, max_keys=2)
+
+    for page in ("a", "b", "c", "d"):
+        counters.record(event(60_000, page=page))
+    counters.record(event(60_000, page="a"))         # held already
+
+    assert counters.stats()["pending_keys"] == 3
+    assert counters.stats()["overflowed"] == 2
+    asyncio.run(counters.flush())
+    counts = {op._filter["page"]: op._doc["$inc"]["count"] for op in coll.ops}
+    assert counts == {"a": 2, "b": 1, OVERFLOW: 2}
+
+
+def test_counters_endpoint_groups_by_bucket(monkeypatch, memory_db, memory_client):
+    pipelines = []
+    bucket = datetime(2026, 1, 1, 8, tzinfo=timezone.utc)
+
+    def aggregate(pipeline):
+        pipelines.append(pipeline)
+        return MemoryCursor([
+            {"_id": {"bucket": bucket, "page": "home", "event": "open", "platform": "ios"}, "count": 7},
+        ], None)
+
+    monkeypatch.setattr(memory_db[logs.COUNTERS], "aggregate", aggregate)
+    r = memory_client.get(
+        "/api/v2/logs/counters/s1",
+        params={"granularity": "hour", "platform": "ios",
+                "since": "2026-01-01T00:00:00Z", "until": "2026-01-02T00:00:00Z"},
+    )
+    assert r.status_code == 200
+    body = r.json()
+    assert body["granularity"] == "hour"
+    assert body["counters"] == [
+        {"bucket": "2026-01-01T08:00:00+00:00", "page": "home", "event": "open", "platform": "ios", "count": 7},
+    ]
+
+    match, group, sort, limit = (stage for stage in pipelines[0])
+    assert match["$match"]["study_id"] == "s1" and match["$match"]["platform"] == "ios"
+    assert match["$match"]["minute"]["$gte"] == datetime(2026, 1, 1, tzinfo=timezone.utc)
+    assert group["$group"]["_id"]["bucket"] == {"$dateTrunc": {"date": "$minute", "unit": "hour"}}
+    assert group["$group"]["count"] == {"$sum": "$count"}
+    assert sort == {"$sort": {"_id.bucket": 1}}
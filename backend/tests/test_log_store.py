@@ -0,0 +1,73 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+
+from config import settings
+from services import log_store
+from tools import migrate_logs
+from memory_mongo import MemoryDatabase
+
+
+def test_log_entry_is_reshaped_for_time_series():
+    entry = {
+        "data_type":       "log",
+        "user_id":         "u1",
+        "study_id":        "s1",
+        "module_index":    0,
+        "platform":        "android",
+        "page":            "home",
+        "event":           "open",
+        "timestamp":       "2025-05-22T12:00:00Z",
+        "timestamp_in_ms": 1747915200000,
+    }
+    doc = log_store.to_document(entry)
+    assert doc["meta"] == {"study_id": "s1", "user_id": "u1"}
+    assert doc["ts"] == datetime(2025, 5, 22, 12, 0, tzinfo=timezone.utc)
+    assert "study_id" not in doc and "user_id" not in doc
+    # the caller's dict is left alone and converted docs pass through
+    assert entry["study_id"] == "s1"
+    assert log_store.to_document(doc) is doc
+
+
+def _events(n):
+    return [
+        {"_id": ObjectId(), "data_type": "log", "user_id": "u1", "study_id": "s1", "module_index": 0,
+         "platform": "ios", "page": "home", "event": "open", "timestamp": "",
+         "timestamp_in_ms": 1747915200000 + i}
+        for i in range(n)
+    ]
+
+
+@pytest.fixture
+def logs_db(monkeypatch):
+    database = MemoryDatabase("test")
+    monkeypatch.setattr(migrate_logs.db, "get_db", lambda: database)
+    return database
+
+
+def _count(collection):
+    return asyncio.run(collection.count_documents({}))
+
+
+def test_source_is_only_dropped_after_a_complete_copy(logs_db):
+    events = _events(3)
+    asyncio.run(logs_db["logs"].insert_many([dict(e) for e in events]))
+    target = logs_db[settings.log_collection]
+
+    # resuming copies only part of the source
+    with pytest.raises(SystemExit, match="has 3 events but .* has 2"):
+        asyncio.run(migrate_logs.migrate("logs", 2, False, True, resume_after=str(events[0]["_id"])))
+    assert _count(logs_db["logs"]) == 3
+
+    # a batch with write errors
+    asyncio.run(target.delete_many({"_id": events[1]["_id"]}))
+    with pytest.raises(SystemExit, match="1 events failed to copy"):
+        asyncio.run(migrate_logs.migrate("logs", 2, False, True))
+    assert _count(logs_db["logs"]) == 3
+
+    asyncio.run(target.delete_many({}))
+    assert asyncio.run(migrate_logs.migrate("logs", 2, False, True)) == 3
+    assert _count(logs_db["logs"]) == 0
+    assert _count(target) == 3
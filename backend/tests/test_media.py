@@ -0,0 +1,76 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+from bson import ObjectId
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from routers.redcap import ResponseEntry, response_entry
+from services import media
+from services.media import BinaryBodyMiddleware
+
+msgpack = pytest.importorskip("msgpack")
+
+RESPONSE = {
+    "data_type": "survey_response", "user_id": "u1", "study_id": "s1",
+    "module_index": 0, "platform": "android", "module_id": "m1", "module_name": "M",
+    "responses": {"q1": 3}, "entries": [250, 310],
+    "response_time": "2026-01-01T08:05:00Z", "response_time_in_ms": 1767254700000,
+    "alert_time": "2026-01-01T08:00:00Z",
+}
+
+
+def test_negotiate_prefers_json_unless_binary_is_asked_for():
+    assert media.negotiate(None) == media.JSON
+    assert media.negotiate("*/*") == media.JSON
+    assert media.negotiate("application/x-msgpack") == media.MSGPACK
+    assert media.negotiate("application/json;q=0.5, application/msgpack") == media.MSGPACK
+    assert media.negotiate("application/msgpack;q=0.2, application/json") == media.JSON
+    assert media.negotiate("text/html") == media.JSON
+
+
+@pytest.fixture
+def echo():
+    api = FastAPI()
+    api.add_middleware(BinaryBodyMiddleware)
+
+    @api.post("/response")
+    async def post(rsp: ResponseEntry = Depends(response_entry)):
+        return rsp.model_dump()
+
+    return TestClient(api)
+
+
+def test_response_bodies_in_every_format_agree(echo):
+    form = {**RESPONSE, "responses": json.dumps(RESPONSE["responses"]),
+            "entries": json.dumps(RESPONSE["entries"])}
+    from_form = echo.post("/response", data=form).json()
+    from_json = echo.post("/response", json=RESPONSE).json()
+    from_msgpack = echo.post("/response", content=msgpack.packb(RESPONSE),
+                             headers={"Content-Type": "application/msgpack"}).json()
+    assert from_form == from_json == from_msgpack
+    assert from_msgpack["entries"] == [250, 310]
+    assert json.loads(from_msgpack["responses"]) == {"q1": 3}
+
+
+def test_bad_bodies_are_client_errors(echo):
+    r = echo.post("/response", content=b"\xc1", headers={"Content-Type": "application/msgpack"})
+    assert r.status_code == 400
+    r = echo.post("/response", json={**RESPONSE, "module_index": "x"})
+    assert r.status_code == 422
+    assert r.json()["detail"][0]["loc"] == ["body", "module_index"]
+
+
+def test_latest_study_in_msgpack(memory_db, memory_client):
+    doc = json.loads((Path(__file__).parent.parent / "studies" / "example_new.json").read_text())
+    doc.update(_id=ObjectId(), timestamp=1)
+    asyncio.run(memory_db["studies"].insert_one(doc))
+    url = f"/api/v2/studies/{doc['properties']['study_id']}"
+    as_json = memory_client.get(url)
+    as_msgpack = memory_client.get(url, headers={"Accept": "application/msgpack"})
+    assert as_msgpack.headers["content-type"] == "application/msgpack"
+    assert "Accept" in as_msgpack.headers["vary"]
+    assert msgpack.unpackb(as_msgpack.content) == as_json.json()
+    assert len(as_msgpack.content) < len(as_json.content)
@@ -0,0 +1,238 @@
+"""
+The in-memory Mongo stand-in against the real thing. Every scenario runs on
+MemoryDatabase and, when MONGO_DB names a dev or test database, on that
+mongod too, with the same expected results; the queries are the shapes
+the routers and services send.
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from config import settings
+from routers import logs
+from memory_mongo import MemoryDatabase
+
+# scratch collection on the real server, dropped before and after each test
+COLLECTION = "memory_mongo_parity"
+
+
+def run(backend, scenario):
+    async def main():
+        if backend == "memory":
+            return await scenario(MemoryDatabase("test")[COLLECTION])
+        db_name = settings.mongo_db or ""
+        if not any(sub in db_name.lower() for sub in ("dev", "test")):
+            pytest.skip(f"Refusing to run DB tests against '{db_name}'")
+        client = AsyncIOMotorClient(settings.mongo_url, serverSelectionTimeoutMS=2000)
+        try:
+            await client.admin.command("ping")
+        except PyMongoError as e:
+            client.close()
+            pytest.skip(f"No mongod at {settings.mongo_url}: {e}")
+        coll = client[db_name][COLLECTION]
+        await coll.drop()
+        try:
+            return await scenario(coll)
+        finally:
+            await coll.drop()
+            client.close()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture(params=["memory", pytest.param("mongo", marks=pytest.mark.mongo)])
+def backend(request):
+    return request.param
+
+
+OUTBOX_DOCS = [
+    {"_id": 1, "url": "a", "retry_at": None, "created_at": 3},
+    {"_id": 2, "url": "b", "created_at": 1},
+    {"_id": 3, "url": "c", "retry_at": 100, "created_at": 2},
+    {"_id": 4, "url": "a", "retry_at": 5, "created_at": 4},
+    {"_id": 5, "url": "d", "retry_at": 5, "created_at": 0, "tags": ["x", "y"]},
+]
+
+
+def test_filters(backend):
+    queries = [
+        {"retry_at": None},
+        {"retry_at": {"$exists": False}},
+        {"retry_at": {"$gt": 1}},
+        {"$or": [{"retry_at": None}, {"retry_at": {"$lte": 10}}]},
+        {"$and": [{"url": "a"}, {"created_at": {"$gte": 4}}]},
+        {"url": {"$nin": ["a"]}},
+        {"url": {"$in": ["a", "b"]}, "created_at": {"$lt": 3}},
+        {"tags": "x"},
+        {"tags": {"$in": ["y", "z"]}},
+        {"tags": {"$nin": ["x"]}},
+        {"tags": {"$ne": "x"}},
+    ]
+
+    async def scenario(coll):
+        await coll.insert_many([dict(d) for d in OUTBOX_DOCS])
+        found = []
+        for query in queries:
+            docs = await coll.find(query, {"_id": 1}).sort("_id", 1).to_list(length=None)
+            found.append([d["_id"] for d in docs])
+        return found, await coll.count_documents({"url": "a"})
+
+    found, count = run(backend, scenario)
+    assert found == [
+        [1, 2],
+        [2],
+        [3, 4, 5],
+        [1, 2, 4, 5],
+        [4],
+        [2, 3, 5],
+        [2],
+        [5],
+        [5],
+        [1, 2, 3, 4],
+        [1, 2, 3, 4],
+    ]
+    assert count == 2
+
+
+def test_sort_puts_missing_and_null_first(backend):
+    async def scenario(coll):
+        await coll.insert_many([dict(d) for d in OUTBOX_DOCS])
+        asc = await coll.find({}, {"_id": 1}).sort([("retry_at", 1), ("_id", 1)]).to_list(length=None)
+        desc = await coll.find({}, {"_id": 1}).sort([("retry_at", -1), ("_id", -1)]).to_list(length=None)
+        return [d["_id"] for d in asc], [d["_id"] for d in desc]
+
+    assert run(backend, scenario) == ([1, 2, 4, 5, 3], [3, 5, 4, 2, 1])
+
+
+def test_outbox_drain_query(backend):
+    # what RedcapDelivery.drain_once sends, with server "b" full
+    due = [{"retry_at": None}, {"retry_at": {"$lte": 10}}]
+
+    async def scenario(coll):
+        await coll.insert_many([dict(d) for d in OUTBOX_DOCS])
+        taken = []
+        while True:
+            doc = await coll.find_one_and_delete({"url": {"$nin": ["b"]}, "$or": due}, sort=[("created_at", 1)])
+            if doc is None:
+                break
+            taken.append(doc["_id"])
+        return taken, sorted(await coll.distinct("url"))
+
+    assert run(backend, scenario) == ([5, 1, 4], ["b", "c"])
+
+
+STUDY = {
+    "_id":        "s1",
+    "timestamp":  2,
+    "modules":    [{"id": "m1", "n": 1}, {"id": "m2", "n": 2}, {"id": "m2", "n": 3}],
+    "properties": {"study_id": "x", "other": 1},
+}
+
+
+def test_projections(backend):
+    projections = [
+        # services.study_lookup.latest_module
+        {"timestamp": 1, "modules": {"$elemMatch": {"id": "m2"}}},
+        {"modules": {"$elemMatch": {"id": "nope"}}},
+        {"_id": 0, "properties.study_id": 1},
+        # routers.studies, picking several modules
+        {"_id": 0, "modules": {"$filter": {"input": "$modules", "cond": {"$in": ["$$this.id", ["m1"]]}}}},
+        {"modules": 0, "properties.other": 0},
+    ]
+
+    async def scenario(coll):
+        await coll.insert_one(dict(STUDY))
+        found = [await coll.find_one({"_id": "s1"}, p) for p in projections]
+        # routers.responses._extend picks a variable out in a pipeline
+        found += await coll.aggregate([
+            {"$match": {"timestamp": {"$exists": True}}},
+            {"$project": {"t": "$timestamp", "v": "$properties.study_id", "w": "$answers.nope"}},
+        ]).to_list(length=None)
+        return found
+
+    assert run(backend, scenario) == [
+        {"_id": "s1", "timestamp": 2, "modules": [{"id": "m2", "n": 2}]},
+        {"_id": "s1"},
+        {"properties": {"study_id": "x"}},
+        {"modules": [{"id": "m1", "n": 1}]},
+        {"_id": "s1", "timestamp": 2, "properties": {"study_id": "x"}},
+        {"_id": "s1", "t": 2, "v": "x"},
+    ]
+
+
+def test_updates_and_upserts(backend):
+    async def scenario(coll):
+        counts = []
+
+        async def update(query, change, many=False, **kwargs):
+            method = coll.update_many if many else coll.update_one
+            r = await method(query, change, **kwargs)
+            counts.append((r.matched_count, r.modified_count, r.upserted_id is not None))
+
+        # services.ingest.store_response: only the first write of a key counts
+        await update({"key": "k"}, {"$setOnInsert": {"n": 1}}, upsert=True)
+        await update({"key": "k"}, {"$setOnInsert": {"n": 2}}, upsert=True)
+        # setting a field to the value it has is matched, not modified
+        await update({"key": "k"}, {"$set": {"n": 1}})
+        await update({"key": "k"}, {"$inc": {"c.x": 2}, "$unset": {"n": ""}})
+        await update({"key": {"$in": ["k", "j"]}}, {"$set": {"s": 1}}, many=True)
+        # an upsert is seeded from the equality parts of the filter only
+        await update({"key": "j", "a.b": 1, "v": {"$gt": 1}}, {"$set": {"w": 1}}, upsert=True)
+        await update({"key": "none"}, {"$set": {"w": 1}})
+
+        docs = await coll.find({}, {"_id": 0}).sort("key", -1).to_list(length=None)
+        try:
+            await coll.insert_one({"_id": "dup"})
+            await coll.insert_one({"_id": "dup"})
+        except DuplicateKeyError:
+            docs.append("duplicate")
+        return counts, docs
+
+    counts, docs = run(backend, scenario)
+    assert counts == [
+        (0, 0, True),
+        (1, 0, False),
+        (1, 0, False),
+        (1, 1, False),
+        (1, 1, False),
+        (0, 0, True),
+        (0, 0, False),
+    ]
+    assert docs == [
+        {"key": "k", "c": {"x": 2}, "s": 1},
+        {"key": "j", "a": {"b": 1}, "w": 1},
+        "duplicate",
+    ]
+
+
+@pytest.mark.mongo
+def test_log_counters_buckets():
+    # $group/$dateTrunc aren't in the stand-in; only a real mongod runs them
+    minute = datetime(2025, 5, 22, 12, 30)
+    rows = [
+        {"study_id": "s1", "minute": minute, "page": "home", "event": "open", "platform": "ios", "count": 2},
+        {"study_id": "s1", "minute": minute + timedelta(minutes=10), "page": "home", "event": "open",
+         "platform": "ios", "count": 3},
+        {"study_id": "s1", "minute": minute + timedelta(hours=1), "page": "home", "event": "open",
+         "platform": "ios", "count": 1},
+        {"study_id": "s2", "minute": minute, "page": "home", "event": "open", "platform": "ios", "count": 9},
+    ]
+
+    async def scenario(coll):
+        await coll.insert_many(rows)
+        return await logs.get_log_counters(
+            study_id="s1",
+            since=minute - timedelta(hours=1),
+            until=minute + timedelta(hours=2),
+            granularity="hour",
+            page=None,
+            event=None,
+            platform=None,
+            db={logs.COUNTERS: coll},
+        )
+
+    result = run("mongo", scenario)
+    assert [(c["bucket"].hour, c["count"]) for c in result["counters"]] == [(12, 5), (13, 1)]
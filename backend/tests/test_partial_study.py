@@ -0,0 +1,48 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+from bson import ObjectId
+
+
+@pytest.fixture
+def study(memory_db, memory_client):
+    doc = json.loads((Path(__file__).parent.parent / "studies" / "example_new.json").read_text())
+    older = {**doc, "_id": ObjectId(), "timestamp": 1, "modules": doc["modules"][:1]}
+    asyncio.run(memory_db["studies"].insert_one(older))
+    asyncio.run(memory_db["studies"].insert_one({**doc, "_id": ObjectId(), "timestamp": 2}))
+    return doc, memory_client
+
+
+def test_selected_modules_match_the_full_study(study):
+    doc, client = study
+    sid = doc["properties"]["study_id"]
+    full = client.get(f"/api/v2/studies/{sid}").json()
+    wanted = [m["id"] for m in doc["modules"][1:3]]
+
+    partial = client.get(f"/api/v2/studies/{sid}", params={"modules": ",".join(wanted)}).json()
+    assert partial["timestamp"] == 2
+    assert partial["properties"] == full["properties"]
+    assert partial["modules"] == [m for m in full["modules"] if m["id"] in wanted]
+
+    only = client.get(f"/api/v2/studies/{sid}", params={"fields": "properties"}).json()
+    assert "modules" not in only and only["properties"] == full["properties"]
+    assert client.get(f"/api/v2/studies/{sid}", params={"fields": "secrets"}).status_code == 400
+
+
+def test_module_and_section_endpoints(study):
+    doc, client = study
+    sid = doc["properties"]["study_id"]
+    full = client.get(f"/api/v2/studies/{sid}").json()
+    module = full["modules"][1]
+
+    r = client.get(f"/api/v2/studies/{sid}/modules/{module['id']}").json()
+    assert r["module"] == module and r["timestamp"] == 2
+
+    section = module["params"]["sections"][0]
+    r = client.get(f"/api/v2/studies/{sid}/modules/{module['id']}/sections/{section['id']}").json()
+    assert r["section"] == section
+
+    assert client.get(f"/api/v2/studies/{sid}/modules/nope").status_code == 404
+    assert client.get(f"/api/v2/studies/{sid}/modules/{module['id']}/sections/nope").status_code == 404
@@ -0,0 +1,77 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+from bson import ObjectId
+
+from models.response import ResponseEntry
+from services.ingest import stored_response
+from services.downsample import lttb
+
+
+def test_lttb_keeps_ends_and_peaks():
+    points = [(t, 0.0) for t in range(100)]
+    points[37] = (37, 50.0)
+    sampled = lttb(points, 10)
+    assert len(sampled) == 10
+    assert sampled[0] == points[0] and sampled[-1] == points[-1]
+    assert (37, 50.0) in sampled
+    assert lttb(points[:5], 10) == points[:5]
+
+
+def _response(ms, value):
+    return ResponseEntry(
+        data_type="survey_response", user_id="u1", study_id="s1", module_index=2,
+        platform="ios", module_id="morning", module_name="Morning",
+        responses=json.dumps({"quality": value}), entries=None,
+        response_time="", response_time_in_ms=ms, alert_time="",
+    )
+
+
+@pytest.fixture
+def client(memory_db, memory_client):
+    doc = json.loads((Path(__file__).parent.parent / "studies" / "example_new.json").read_text())
+    doc["properties"]["study_id"] = "s1"
+    module = doc["modules"][2]
+    module["id"] = "morning"
+    module["graph"] = {"display": True, "variable": "quality", "title": "Sleep quality",
+                       "blurb": "", "type": "line", "max_points": 5}
+    asyncio.run(memory_db["studies"].insert_one({**doc, "_id": ObjectId(), "timestamp": 1}))
+    return memory_db, memory_client
+
+
+def test_graph_series_is_downsampled_and_extended(client):
+    database, client = client
+
+    async def store(start, stop):
+        for i in range(start, stop):
+            await database["responses_backup"].insert_one(stored_response(_response(i * 1000, i % 3)))
+
+    asyncio.run(store(0, 8))
+    # stored before answers were parsed out: only the raw JSON
+    legacy = _response(8000, "7").dict()
+    asyncio.run(database["responses_backup"].insert_one(legacy))
+
+    url = "/api/v2/studies/s1/participants/u1/graph/morning"
+    r = client.get(url).json()
+    assert (r["variable"], r["title"], r["total"]) == ("quality", "Sleep quality", 9)
+    assert len(r["points"]) == 5
+    assert r["points"][0] == [0, 0.0] and r["points"][-1] == [8000, 7.0]
+
+    asyncio.run(store(9, 12))
+    again = client.get(url).json()
+    assert again["total"] == 12 and again["points"][-1] == [11000, 2.0]
+
+    assert client.get("/api/v2/studies/s1/participants/u1/graph/nope").status_code == 404
+    other = json.loads((Path(__file__).parent.parent / "studies" / "example_new.json").read_text())["modules"][0]["id"]
+    assert client.get(f"/api/v2/studies/s1/participants/u1/graph/{other}").status_code == 404
+
+
+def test_graph_by_permalink_reads_the_study_id_responses(client):
+    database, client = client
+    asyncio.run(database["responses_backup"].insert_one(stored_response(_response(1000, 2))))
+    study = asyncio.run(database["studies"].find_one({"properties.study_id": "s1"}))
+
+    r = client.get(f"/api/v2/studies/{study['_id']}/participants/u1/graph/morning").json()
+    assert r["total"] == 1 and r["points"] == [[1000, 2.0]]
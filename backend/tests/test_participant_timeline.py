@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+
+BASE = "/api/v2/studies/s1/participants/u1/responses"
+
+
+@pytest.fixture
+def timeline(memory_db, memory_client):
+    async def seed():
+        for i in range(7):
+            await memory_db["responses_backup"].insert_one({
+                "study_id": "s1", "user_id": "u1", "module_id": "m1" if i % 2 else "m2",
+                "module_name": "M", "module_index": 0, "platform": "ios", "data_type": "survey",
+                # two responses share a timestamp, the _id breaks the tie
+                "response_time_in_ms": 1_000 * min(i, 5), "response_time": str(i),
+                "alert_time": "", "responses": '{"q": 1}',
+            })
+        await memory_db["responses_backup"].insert_one({"study_id": "s1", "user_id": "u2",
+                                                       "response_time_in_ms": 0})
+
+    asyncio.run(seed())
+    return memory_client
+
+
+def _pages(client, **params):
+    pages, cursor = [], None
+    while True:
+        body = client.get(BASE, params={**params, **({"cursor": cursor} if cursor else {})}).json()
+        pages.append([item["response_time"] for item in body["items"]])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def test_pages_cover_the_history_once_in_order(timeline):
+    assert _pages(timeline, limit=3) == [["6", "5", "4"], ["3", "2", "1"], ["0"]]
+    assert _pages(timeline, limit=4, order="asc") == [["0", "1", "2", "3"], ["4", "5", "6"]]
+
+
+def test_module_filter_and_views(timeline):
+    assert _pages(timeline, module="m1") == [["5", "3", "1"]]
+    summary = timeline.get(BASE, params={"limit": 1}).json()["items"][0]
+    assert "responses" not in summary and "module_id" in summary
+    full = timeline.get(BASE, params={"limit": 1, "view": "full"}).json()["items"][0]
+    assert full["responses"] == '{"q": 1}'
+    assert timeline.get(BASE, params={"cursor": "garbage"}).status_code == 400
+
+
+def test_permalink_lists_the_study_id_responses(memory_db, timeline):
+    permalink = ObjectId()
+    asyncio.run(memory_db["studies"].insert_one(
+        {"_id": permalink, "properties": {"study_id": "s1"}, "timestamp": 1}
+    ))
+    body = timeline.get(BASE.replace("s1", str(permalink)), params={"limit": 3}).json()
+    assert [item["response_time"] for item in body["items"]] == ["6", "5", "4"]
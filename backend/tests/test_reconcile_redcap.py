@@ -0,0 +1,83 @@
+import argparse
+import asyncio
+import json
+
+import httpx
+
+import http_client
+from routers import redcap
+from services import study_lookup
+from tools import reconcile_redcap
+from tools.fake_redcap import FakeRedcap
+from memory_mongo import MemoryDatabase
+
+
+def _response(user_id, module_id, response_time):
+    return {
+        "data_type": "survey_response", "user_id": user_id, "study_id": "s1",
+        "module_index": 0, "platform": "ios", "module_id": module_id,
+        "module_name": "M", "responses": json.dumps({"q1": 3}), "entries": None,
+        "response_time": response_time, "response_time_in_ms": 1000,
+        "alert_time": "2026-01-01T08:00:00Z",
+    }
+
+
+def _args(**kw):
+    return argparse.Namespace(**{"dry_run": False, "page_size": 1, "batch_size": 2,
+                                 "rate": 1000.0, "retries": 0, **kw})
+
+
+def test_only_missing_responses_are_pushed(monkeypatch):
+    fake = FakeRedcap()
+    monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(transport=fake.transport()))
+    database = MemoryDatabase("test")
+    redcap._key_cache.clear()
+    study_lookup._url_cache.clear()
+
+    async def scenario():
+        created = await fake.handle({"token": "t", "content": "project",
+                                     "data": json.dumps([{"project_title": "S"}])})
+        token = created.body.decode()
+        await database["keys"].insert_one({"study_id": "s1", "api_key": token})
+        delivered = _response("u1", "m1", "2026-01-01T08:05:00Z")
+        await fake.handle({"token": token, "content": "record", "data": json.dumps(
+            [redcap._redcap_record(redcap.ResponseEntry(**delivered))])})
+        backups = [delivered, _response("u1", "m1", "2026-01-02T08:05:00Z"),
+                   _response("u2", "m1", "2026-01-01T08:07:00Z"),
+                   _response("u2", "m1", "2026-01-01T08:07:00Z")]  # backed up twice
+        for doc in backups:
+            await database["responses_backup"].insert_one(dict(doc))
+
+        dry = await reconcile_redcap.reconcile_study(database, "s1", _args(dry_run=True))
+        real = await reconcile_redcap.reconcile_study(database, "s1", _args())
+        again = await reconcile_redcap.reconcile_study(database, "s1", _args(dry_run=True))
+        return dry, real, again
+
+    dry, real, again = asyncio.run(scenario())
+    assert (dry["redcap_records"], dry["backups"], dry["missing"]) == (1, 4, 2)
+    assert "pushed" not in dry
+    assert (real["pushed"], real["failed"]) == (2, 0)
+    assert again["missing"] == 0
+    assert fake.stats()["records"] == 3
+
+
+def test_every_delivery_attempt_is_recorded(monkeypatch, memory_db):
+    fake = FakeRedcap()
+    monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(transport=fake.transport()))
+
+    async def scenario():
+        created = await fake.handle({"token": "t", "content": "project",
+                                     "data": json.dumps([{"project_title": "S"}])})
+        await memory_db["keys"].insert_one({"study_id": "s1", "api_key": created.body.decode()})
+        rsp = redcap.ResponseEntry(**_response("u1", "m1", "2026-01-01T08:05:00Z"))
+        # e.g. a retry after a timeout, then an outbox re-drive
+        for _ in range(2):
+            await redcap._submit_to_redcap(memory_db, rsp, "https://redcap.example/api/")
+        return await memory_db["responses_backup"].find({}).to_list(None)
+
+    attempts = asyncio.run(scenario())
+    # the REDCap record with the raw entry, which reconcile_redcap skips:
+    # it only reads the ingest copies, by study_id
+    assert len(attempts) == 2
+    assert all(a["field_record_id"] == "u1" and "raw" in a and "study_id" not in a for a in attempts)
+    assert fake.stats()["records"] == 2
@@ -1,4 +1,5 @@
 import json
+import uuid
 import pytest
 import httpx
 from httpx import HTTPStatusError
@@ -120,4 +121,33 @@ def test_response_also_saved_to_live_collection(client, test_db):
     })
     assert doc is not None
     assert doc["entries"] == [5,6,7]
-    assert doc["response_time_in_ms"] == 200
\ No newline at end of file
+    assert doc["response_time_in_ms"] == 200
+
+
+@pytest.mark.usefixtures("stub_external_calls")
+def test_retried_response_is_stored_once(client, test_db):
+    key = f"retry-{uuid.uuid4().hex}"
+    form = {
+        "data_type":           "survey",
+        "user_id":             "u3",
+        "study_id":            "s3",
+        "module_index":        "0",
+        "platform":            "ios",
+        "module_id":           "m3",
+        "module_name":         "Retry Module",
+        "responses":           json.dumps({"q1": "no"}),
+        "response_time":       "2025-06-02T10:00:00Z",
+        "response_time_in_ms": "300",
+        "alert_time":          "2025-06-02T09:59:00Z",
+    }
+    try:
+        r1 = client.post("/api/v2/response", data=form, headers={"Idempotency-Key": key})
+        r2 = client.post("/api/v2/response", data=form, headers={"Idempotency-Key": key})
+        assert r1.status_code == r2.status_code == 202
+        assert r1.json() == r2.json() == {"accepted": True}
+        assert r2.headers["Idempotent-Replayed"] == "true"
+        assert test_db.responses.count_documents({"idempotency_key": key}) == 1
+    finally:
+        test_db.responses.delete_many({"idempotency_key": key})
+        test_db.responses_backup.delete_many({"idempotency_key": key})
+        test_db.idempotency_keys.delete_one({"_id": key})
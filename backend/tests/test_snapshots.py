@@ -0,0 +1,38 @@
+import gzip
+import json
+from pathlib import Path
+
+import pytest
+from bson import ObjectId
+
+from services import compression, snapshots
+
+
+@pytest.fixture
+def stored_study():
+    doc = json.loads((Path(__file__).parent.parent / "studies" / "example_new.json").read_text())
+    doc["_id"] = ObjectId()
+    doc["timestamp"] = 1_700_000_000_000
+    return doc
+
+
+def test_publish_writes_precompressed_variants(tmp_path, stored_study):
+    snapshots.publish(stored_study, directory=str(tmp_path))
+
+    sid = stored_study["properties"]["study_id"]
+    body = (tmp_path / f"{sid}.json").read_bytes()
+    assert json.loads(body)["_id"] == str(stored_study["_id"])
+    assert (tmp_path / f"{stored_study['_id']}.json").read_bytes() == body
+    assert gzip.decompress((tmp_path / f"{sid}.json.gz").read_bytes()) == body
+    if compression.brotli is not None:
+        assert compression.brotli.decompress((tmp_path / f"{sid}.json.br").read_bytes()) == body
+    # no temp files left behind
+    assert not [p for p in tmp_path.iterdir() if p.name.startswith(".")]
+
+def test_unsafe_ids_are_not_used_as_file_names(tmp_path, stored_study):
+    stored_study["properties"]["study_id"] = "../escape"
+    snapshots.publish(stored_study, directory=str(tmp_path))
+    exts = ["", ".gz"] + ([".br"] if compression.brotli is not None else [])
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+        f"{stored_study['_id']}.json{ext}" for ext in exts
+    )
@@ -0,0 +1,53 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+from bson import ObjectId
+
+from services.assets import manifest
+
+STUDIES = Path(__file__).parent.parent / "studies"
+
+
+def test_manifest_lists_each_url_once():
+    doc = json.loads((STUDIES / "study.json").read_text())
+    found = manifest(doc)
+    urls = [a["url"] for a in found]
+    assert len(urls) == len(set(urls))
+    assert found[0] == {
+        "url": doc["properties"]["banner_url"], "type": "image", "refs": [{"field": "banner_url"}]
+    }
+
+    media = [
+        (m["id"], q)
+        for m in doc["modules"] for s in m["params"].get("sections", []) for q in s["questions"]
+        if q["type"] == "media"
+    ]
+    by_url = {a["url"]: a for a in found}
+    for module_id, q in media:
+        ref = {"module_id": module_id, "question_id": q["id"], "field": "src"}
+        assert ref in by_url[q["src"]]["refs"]
+        assert by_url[q["src"]]["type"] == q["subtype"]
+        if q.get("thumb"):
+            assert by_url[q["thumb"]]["type"] == "image"
+
+
+@pytest.fixture
+def client(memory_db, memory_client):
+    doc = json.loads((STUDIES / "study.json").read_text())
+    asyncio.run(memory_db["studies"].insert_one({**doc, "_id": ObjectId(), "timestamp": 1}))
+    return doc, memory_client
+
+
+def test_assets_endpoint(client):
+    doc, client = client
+    sid = doc["properties"]["study_id"]
+    r = client.get(f"/api/v2/studies/{sid}/assets")
+    assert r.status_code == 200
+    assert r.json()["assets"] == manifest(doc)
+    assert r.headers["etag"] == f'W/"{r.json()["content_hash"]}"'
+
+    cached = client.get(f"/api/v2/studies/{sid}/assets", headers={"If-None-Match": r.headers["etag"]})
+    assert cached.status_code == 304
+    assert client.get("/api/v2/studies/nope/assets").status_code == 404
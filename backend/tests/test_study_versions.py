@@ -0,0 +1,59 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+
+@pytest.fixture
+def client(memory_db, memory_client):
+    return memory_client, memory_db
+
+
+@pytest.fixture
+def doc():
+    doc = json.loads((Path(__file__).parent.parent / "studies" / "example_new.json").read_text())
+    doc["properties"]["study_id"] = "test_versions"
+    return doc
+
+
+def _versions(database):
+    return database["studies"].count_documents({"properties.study_id": "test_versions"})
+
+
+def test_identical_repost_reuses_the_version(client, doc):
+    client, database = client
+    first = client.post("/api/v2/studies", json=doc)
+    assert first.status_code == 201
+    assert first.headers["etag"] == f'W/"{first.json()["content_hash"]}"'
+
+    # key order doesn't change the content
+    again = client.post("/api/v2/studies", json=dict(reversed(list(doc.items()))))
+    assert again.status_code == 200
+    assert again.json()["permalink"] == first.json()["permalink"]
+    assert again.json()["content_hash"] == first.json()["content_hash"]
+
+    assert asyncio.run(_versions(database)) == 1
+
+    doc["properties"]["study_name"] = "Renamed"
+    changed = client.post("/api/v2/studies", json=doc)
+    assert changed.status_code == 201
+    assert changed.json()["content_hash"] != first.json()["content_hash"]
+    assert asyncio.run(_versions(database)) == 2
+
+
+def test_latest_version_etag(client, doc):
+    client, _ = client
+    created = client.post("/api/v2/studies", json=doc).json()
+
+    r = client.get("/api/v2/studies/test_versions")
+    assert r.status_code == 200
+    assert r.headers["etag"] == f'W/"{created["content_hash"]}"'
+    assert r.json()["content_hash"] == created["content_hash"]
+
+    cached = client.get("/api/v2/studies/test_versions", headers={"If-None-Match": r.headers["etag"]})
+    assert cached.status_code == 304 and cached.content == b""
+    assert cached.headers["etag"] == r.headers["etag"]
+
+    stale = client.get("/api/v2/studies/test_versions", headers={"If-None-Match": 'W/"0"'})
+    assert stale.status_code == 200
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import logging
+import time
+
+import pytest
+
+from services.delivery import RedcapDelivery
+from services.tracing import TraceLogFilter, Tracer, tracer
+
+
+def _tracer(tmp_path, **kw):
+    opts = dict(export="file", sample_rate=1.0, slow_ms=0, path=str(tmp_path / "t.jsonl"),
+                url=None, service="test", capacity=100, flush_interval_s=60)
+    return Tracer(**{**opts, **kw})
+
+
+def test_spans_nest_and_export_as_zipkin(tmp_path):
+    t = _tracer(tmp_path)
+    parent = "00-" + "a" * 32 + "-" + "b" * 16 + "-01"
+    with t.span("request", parent=parent, study_id="s1") as root:
+        with t.span("redcap.post", server="https://redcap.example/api/") as child:
+            assert t.traceparent() == child.traceparent
+    assert root.trace_id == child.trace_id == "a" * 32
+    assert root.parent_id == "b" * 16 and child.parent_id == root.span_id
+
+    assert asyncio.run(t.flush()) == 2
+    spans = [json.loads(line) for line in (tmp_path / "t.jsonl").read_text().splitlines()]
+    post = next(s for s in spans if s["name"] == "redcap.post")
+    # the study is inherited, so a lone slow POST is still attributable
+    assert post["tags"] == {"server": "https://redcap.example/api/", "study_id": "s1"}
+    assert post["parentId"] == root.span_id and post["localEndpoint"]["serviceName"] == "test"
+
+
+def test_unsampled_traces_keep_only_slow_spans(tmp_path):
+    t = _tracer(tmp_path, sample_rate=0.0, slow_ms=5)
+    with t.span("request"):
+        with t.span("fast"):
+            pass
+        with t.span("slow"):
+            time.sleep(0.01)
+    assert [s["name"] for s in t._spans] == ["slow", "request"]
+
+    off = _tracer(tmp_path, export="none")
+    with off.span("request") as span:
+        assert span is None
+    assert off.stats()["started"] == 0
+
+
+def test_queued_delivery_continues_the_request_trace(monkeypatch, tmp_path):
+    monkeypatch.setattr(tracer, "export", "file")
+    monkeypatch.setattr(tracer, "sample_rate", 1.0)
+    monkeypatch.setattr(tracer, "path", str(tmp_path / "t.jsonl"))
+    seen = []
+    records = []
+
+    class Capture(logging.Handler):
+        def emit(self, record):
+            records.append(record)
+
+    handler = Capture()
+    handler.addFilter(TraceLogFilter())
+    log = logging.getLogger("test_tracing")
+    log.addHandler(handler)
+
+    async def deliver(url, payload):
+        with tracer.span("redcap.post") as span:
+            seen.append(span)
+            log.warning("pushed")
+
+    async def run():
+        d = RedcapDelivery(handler=deliver, max_pending=10, max_pending_per_server=10,
+                           initial_concurrency=1, max_concurrency=1, drain_interval_s=60)
+        with tracer.span("request") as root:
+            for n in range(2):
+                assert d.reserve("u")
+                d.submit("u", {"n": n})
+        await asyncio.sleep(0.01)
+        return root
+
+    try:
+        root = asyncio.run(run())
+    finally:
+        log.removeHandler(handler)
+        tracer._spans.clear()
+    assert len(seen) == 2
+    assert all(s.trace_id == root.trace_id for s in seen)
+    assert [r.trace_id for r in records] == [root.trace_id] * 2
@@ -0,0 +1,82 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+from bson import ObjectId
+
+from models.study import StudyCreate
+from services.validation_pool import _validate_study
+from services.unlock_graph import compile_graph
+
+EXAMPLE = Path(__file__).parent.parent / "studies" / "example_new.json"
+
+
+def _m(id, after=(), condition="*"):
+    return {"id": id, "condition": condition, "unlock_after": list(after)}
+
+
+def test_topological_order_and_condition_sets():
+    graph = compile_graph(
+        [_m("c", ["a", "b"]), _m("a"), _m("b", ["a"], "Treatment"), _m("d", condition="Control")],
+        ["Control", "Treatment"],
+    )
+    assert graph["errors"] == []
+    assert graph["order"] == ["a", "d", "b", "c"]
+    assert graph["requires"]["c"] == ["a", "b"]
+    assert graph["unlocks"]["a"] == ["c", "b"]
+    assert graph["conditions"] == {"Control": ["a", "d", "c"], "Treatment": ["a", "b", "c"]}
+
+
+def test_cycles_and_dangling_ids_are_reported():
+    graph = compile_graph([_m("a", ["b"]), _m("b", ["a"]), _m("c", ["a"]), _m("d", ["x"]), _m("e", ["e"])], [])
+    assert graph["order"] == ["d"]
+    assert graph["errors"] == [
+        "Module 'd' unlocks after unknown module 'x'",
+        "Unlock cycle: 'a' -> 'b' -> 'a'",
+        "Unlock cycle: 'e' -> 'e'",
+    ]
+
+
+def test_saving_a_cyclic_study_is_rejected():
+    doc = json.loads(EXAMPLE.read_text())
+    first, second = doc["modules"][:2]
+    first["unlock_after"], second["unlock_after"] = [second["id"]], [first["id"]]
+    # the schema itself takes it, so stored versions keep loading
+    StudyCreate.model_validate(doc)
+    result, errors = _validate_study(json.dumps(doc).encode())
+    assert result is None
+    assert errors[0]["loc"] == ["modules"] and "Unlock cycle" in errors[0]["msg"]
+
+
+@pytest.fixture
+def client(memory_db, memory_client):
+    doc = json.loads(EXAMPLE.read_text())
+    asyncio.run(memory_db["studies"].insert_one({**doc, "_id": ObjectId(), "timestamp": 1}))
+    return doc, memory_client
+
+
+def test_unlock_graph_endpoint(client):
+    doc, client = client
+    r = client.get(f"/api/v2/studies/{doc['properties']['study_id']}/unlock-graph")
+    assert r.status_code == 200
+    graph = r.json()["graph"]
+    assert sorted(graph["order"]) == sorted(m["id"] for m in doc["modules"])
+    assert set(graph["conditions"]) == set(doc["properties"]["conditions"])
+    assert r.headers["etag"] == f'W/"{r.json()["content_hash"]}"'
+
+
+def test_graph_is_stored_with_the_version(memory_db, memory_client):
+    doc = json.loads(EXAMPLE.read_text())
+    r = memory_client.post("/api/v2/studies", json=doc)
+    assert r.status_code == 201
+    studies = memory_db["studies"]
+    stored = asyncio.run(studies.find_one({"_id": ObjectId(r.json()["permalink"])}))
+    assert stored["unlock_graph"]["errors"] == []
+    assert stored["branching"]["errors"] == []
+
+    # served from the version, not compiled again
+    asyncio.run(studies.update_one({"_id": stored["_id"]}, {"$set": {"unlock_graph.order": ["stored"]}}))
+    r = memory_client.get(f"/api/v2/studies/{doc['properties']['study_id']}/unlock-graph")
+    assert r.json()["graph"]["order"] == ["stored"]
+    assert r.json()["content_hash"] == stored["content_hash"]
@@ -0,0 +1,74 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+from fastapi.exceptions import RequestValidationError
+
+from services import validation_pool
+from services.validation_pool import StudyValidator
+
+
+@pytest.fixture
+def example_body():
+    return (Path(__file__).parent.parent / "studies" / "example_new.json").read_bytes()
+
+
+def make_validator(offload_bytes):
+    return StudyValidator(offload_bytes=offload_bytes, max_workers=1, max_pending=2, timeout_s=60)
+
+
+def test_large_body_is_validated_in_the_pool(example_body):
+    validator = make_validator(offload_bytes=1)
+    try:
+        result = asyncio.run(validator.validate(example_body))
+    finally:
+        validator.shutdown()
+    expected = json.loads(example_body)
+    assert result.study.properties.study_id == expected["properties"]["study_id"]
+    assert result.doc["properties"]["study_id"] == expected["properties"]["study_id"]
+    assert validator.stats()["offloaded"] == 1
+
+def test_errors_match_fastapi_body_errors(example_body):
+    broken = json.loads(example_body)
+    del broken["properties"]["study_id"]
+    validator = make_validator(offload_bytes=10**9)
+    with pytest.raises(RequestValidationError) as exc:
+        asyncio.run(validator.validate(json.dumps(broken).encode()))
+    assert exc.value.errors()[0]["loc"] == ("body", "properties", "study_id")
+    assert validator.stats()["inline"] == 1
+
+
+def test_timed_out_jobs_count_until_their_worker_is_free(monkeypatch):
+    release = threading.Event()
+
+    def stuck(body):
+        release.wait(5)
+        return None, [{"loc": (), "msg": "too late"}]
+
+    monkeypatch.setattr(validation_pool, "_validate_study", stuck)
+    validator = StudyValidator(offload_bytes=1, max_workers=1, max_pending=1, timeout_s=0.05)
+    validator._pool = ThreadPoolExecutor(max_workers=1)
+
+    async def run():
+        with pytest.raises(HTTPException, match="timed out"):
+            await validator.validate(b"{}")
+        # the worker is still busy, so the next large study is turned away
+        assert validator.stats()["pending"] == 1
+        with pytest.raises(HTTPException, match="Too many"):
+            await validator.validate(b"{}")
+        release.set()
+        for _ in range(100):
+            if not validator.stats()["pending"]:
+                break
+            await asyncio.sleep(0.01)
+        assert validator.stats()["pending"] == 0
+
+    try:
+        asyncio.run(run())
+    finally:
+        release.set()
+        validator.shutdown()
@@ -0,0 +1,295 @@
+"""
+In-memory stand-in for the REDCap API, for offline tests and load runs.
+
+    python -m tools.fake_redcap --port 8081
+    python -m tools.fake_redcap --port 8081 --latency-ms 80 --jitter-ms 40 \\
+        --error-rate 0.05 --rate-limit 50 --seed 1
+
+Point REDCAP_API_URL (or a study's redcap_server_api_url) at
+http://127.0.0.1:8081/api/. In tests, mount it in-process instead:
+
+    fake = FakeRedcap(super_token="t")
+    client = httpx.AsyncClient(transport=fake.transport())
+
+Implements the calls the backend makes: content=project|metadata|
+repeatingFormsEvents|user|record, each as an import (a `data` field is
+present) or an export. Projects are created with the super token and
+answered with a fresh project token, like the real server.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+
+logger = logging.getLogger("fake_redcap")
+
+RECORD_ID = "field_record_id"
+
+
+@dataclass
+class FakeRedcapConfig:
+    super_token: str = "t"
+    # each request sleeps latency_ms ± jitter_ms before answering
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    # share of requests answered with a 500 after the latency
+    error_rate: float = 0.0
+    # requests per second across all tokens, 0 = unlimited; excess gets a 429
+    rate_limit: float = 0.0
+    burst: int = 0
+    seed: Optional[int] = None
+
+
+@dataclass
+class _Project:
+    info: Dict[str, Any]
+    metadata: List[Dict[str, Any]] = field(default_factory=list)
+    repeating: List[Dict[str, Any]] = field(default_factory=list)
+    users: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    # (record id, repeat instrument, repeat instance) -> flat record
+    records: Dict[Tuple[str, str, int], Dict[str, Any]] = field(default_factory=dict)
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.capacity = max(burst, 1) if burst else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class FakeRedcap:
+    """
+    The fake server's state plus its ASGI app. Everything is kept in memory
+    and lost when the object goes away.
+    """
+
+    def __init__(self, config: Optional[FakeRedcapConfig] = None, **overrides: Any) -> None:
+        self.config = config or FakeRedcapConfig(**overrides)
+        self.projects: Dict[str, _Project] = {}
+        self.requests: Counter = Counter()
+        self._random = random.Random(self.config.seed)
+        self._bucket = (
+            _TokenBucket(self.config.rate_limit, self.config.burst)
+            if self.config.rate_limit > 0 else None
+        )
+        self.app = self._build_app()
+
+    def transport(self) -> httpx.ASGITransport:
+        """
+        Transport for an httpx.AsyncClient that talks to this fake in-process.
+        """
+        return httpx.ASGITransport(app=self.app)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "projects": len(self.projects),
+            "records":  sum(len(p.records) for p in self.projects.values()),
+            "requests": dict(self.requests),
+        }
+
+    # ─── request handling ───────────────────────────────────────────
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI(title="Fake REDCap API")
+
+        @app.get("/stats")
+        async def stats():
+            return self.stats()
+
+        # any path, so whatever REDCap URL a study points at can be served
+        @app.post("/{path:path}")
+        async def api(request: Request) -> Response:
+            form = dict(await request.form())
+            return await self.handle(form)
+
+        @app.head("/{path:path}")
+        async def head() -> Response:
+            return Response(status_code=200)
+
+        return app
+
+    async def handle(self, form: Dict[str, Any]) -> Response:
+        content = form.get("content", "")
+        action = "import" if "data" in form else "export"
+        self.requests[f"{content}:{action}"] += 1
+
+        if self._bucket is not None and not self._bucket.take():
+            self.requests["rate_limited"] += 1
+            return JSONResponse(
+                {"error": "API rate limit exceeded"}, status_code=429,
+                headers={"Retry-After": "1"},
+            )
+        delay = self.config.latency_ms + self._random.uniform(
+            -self.config.jitter_ms, self.config.jitter_ms
+        )
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if self._random.random() < self.config.error_rate:
+            self.requests["injected_errors"] += 1
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+
+        try:
+            data = json.loads(form["data"]) if action == "import" else None
+        except ValueError:
+            return _error("The data being imported is not formatted correctly")
+
+        token = form.get("token", "")
+        if content == "project" and action == "import":
+            if token != self.config.super_token:
+                return _error("You do not have permissions to use the API", 403)
+            return self._create_project(data)
+
+        project = self.projects.get(token)
+        if project is None:
+            return _error("You do not have permissions to use the API", 403)
+        handler = _HANDLERS.get((content, action))
+        if handler is None:
+            return _error("The value of the parameter \"content\" is not valid")
+        # imports get the parsed data, exports the raw form for their filters
+        return handler(self, project, data if action == "import" else form)
+
+    def _create_project(self, data: Any) -> Response:
+        if not isinstance(data, list) or not data or not data[0].get("project_title"):
+            return _error("The project_title field is required")
+        token = uuid.uuid4().hex.upper()
+        self.projects[token] = _Project(info={
+            "project_id": len(self.projects) + 1,
+            "creation_time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            **data[0],
+        })
+        return PlainTextResponse(token)
+
+    def _export_project(self, project: _Project, _form: Dict[str, Any]) -> Response:
+        return JSONResponse(project.info)
+
+    def _import_metadata(self, project: _Project, data: Any) -> Response:
+        if not isinstance(data, list):
+            return _error("The data being imported is not formatted correctly")
+        missing = [f for f in data if not f.get("field_name") or not f.get("form_name")]
+        if missing:
+            return _error("Every field needs a field_name and a form_name")
+        project.metadata = data
+        return JSONResponse(len(data))
+
+    def _export_metadata(self, project: _Project, _form: Dict[str, Any]) -> Response:
+        return JSONResponse(project.metadata)
+
+    def _import_repeating(self, project: _Project, data: Any) -> Response:
+        if not isinstance(data, list):
+            return _error("The data being imported is not formatted correctly")
+        project.repeating = data
+        return JSONResponse(len(data))
+
+    def _export_repeating(self, project: _Project, _form: Dict[str, Any]) -> Response:
+        return JSONResponse(project.repeating)
+
+    def _import_users(self, project: _Project, data: Any) -> Response:
+        if not isinstance(data, list) or any(not u.get("username") for u in data):
+            return _error("Every user needs a username")
+        for user in data:
+            project.users[user["username"]] = user
+        return JSONResponse(len(data))
+
+    def _export_users(self, project: _Project, _form: Dict[str, Any]) -> Response:
+        return JSONResponse(list(project.users.values()))
+
+    def _import_records(self, project: _Project, data: Any) -> Response:
+        if not isinstance(data, list):
+            return _error("The data being imported is not formatted correctly")
+        ids = set()
+        for rec in data:
+            rid = rec.get(RECORD_ID)
+            if not rid:
+                return _error(f"Every record needs a {RECORD_ID}")
+            form = rec.get("redcap_repeat_instrument", "")
+            instance = rec.get("redcap_repeat_instance", "")
+            if instance == "new":
+                instance = 1 + max(
+                    (i for (r, f, i) in project.records if r == rid and f == form),
+                    default=0,
+                )
+            key = (rid, form, int(instance or 0))
+            stored = project.records.setdefault(key, {})
+            stored.update(rec, redcap_repeat_instance=key[2] or "")
+            ids.add(rid)
+        return JSONResponse({"count": len(ids)})
+
+    def _export_records(self, project: _Project, form: Dict[str, Any]) -> Response:
+        # records[0]=..., fields[0]=... as sent by form-encoded API clients
+        ids = {v for k, v in form.items() if k.startswith("records[")}
+        fields = {v for k, v in form.items() if k.startswith("fields[")}
+        rows = [project.records[k] for k in sorted(project.records) if not ids or k[0] in ids]
+        if fields:
+            fields |= {RECORD_ID, "redcap_repeat_instrument", "redcap_repeat_instance"}
+            rows = [{f: v for f, v in row.items() if f in fields} for row in rows]
+        return JSONResponse(rows)
+
+
+_HANDLERS = {
+    ("project", "export"):              FakeRedcap._export_project,
+    ("metadata", "import"):             FakeRedcap._import_metadata,
+    ("metadata", "export"):             FakeRedcap._export_metadata,
+    ("repeatingFormsEvents", "import"): FakeRedcap._import_repeating,
+    ("repeatingFormsEvents", "export"): FakeRedcap._export_repeating,
+    ("user", "import"):                 FakeRedcap._import_users,
+    ("user", "export"):                 FakeRedcap._export_users,
+    ("record", "import"):               FakeRedcap._import_records,
+    ("record", "export"):               FakeRedcap._export_records,
+}
+
+
+def _error(message: str, status_code: int = 400) -> Response:
+    return JSONResponse({"error": message}, status_code=status_code)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--super-token", default="t", help="token accepted for project creation")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failed with a 500")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requests per second, 0 = unlimited")
+    parser.add_argument("--burst", type=int, default=0, help="rate limit bucket size (default: one second's worth)")
+    parser.add_argument("--seed", type=int, default=None, help="seed for latency jitter and error injection")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s | %(message)s")
+    fake = FakeRedcap(FakeRedcapConfig(
+        super_token=args.super_token,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        burst=args.burst,
+        seed=args.seed,
+    ))
+    logger.info("Fake REDCap API on http://%s:%d/api/", args.host, args.port)
+    uvicorn.run(fake.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
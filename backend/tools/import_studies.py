@@ -0,0 +1,170 @@
+"""
+Validate a directory of study JSON files against StudyCreate and upsert the
+valid ones into `studies`.
+
+    python -m tools.import_studies studies/ --dry-run
+    python -m tools.import_studies studies/ --workers 8
+    python -m tools.import_studies studies/ --force
+
+Files are validated in parallel and every error is reported per file. A
+version is keyed by (study_id, content_hash): files whose content matches
+the latest stored version are skipped unless --force is given, in which
+case the matching version just becomes the latest again.
+
+With SNAPSHOT_DIR set, the static snapshot of every imported study is
+rewritten from its latest version afterwards. Caddy serves an existing
+snapshot ahead of the API, so a skipped rewrite would keep serving the
+old version.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from pymongo import UpdateOne
+
+import db
+from config import settings
+from services import snapshots
+from services.study_hash import canonical_hash
+from services.validation_pool import _validate_study
+
+logger = logging.getLogger("import_studies")
+
+DEFAULT_DIR = Path(__file__).resolve().parents[1] / "studies"
+
+
+class FileResult(NamedTuple):
+    path:     str
+    study_id: Optional[str]
+    doc:      Optional[Dict[str, Any]]
+    errors:   List[str]
+
+
+def check_file(path: str) -> FileResult:
+    """
+    Runs in a worker process: parse, validate, serialize, hash and compile
+    one file.
+    """
+    try:
+        body = Path(path).read_bytes()
+    except OSError as e:
+        return FileResult(path, None, None, [str(e)])
+    result, errors = _validate_study(body)
+    if errors is not None:
+        return FileResult(path, None, None, [
+            f"{'.'.join(str(p) for p in err.get('loc', ())) or '<root>'}: {err.get('msg')}"
+            for err in errors
+        ])
+    doc = dict(result.doc)
+    doc["_type"] = "study"
+    doc["content_hash"] = canonical_hash(doc)
+    doc.update(result.views)
+    return FileResult(path, result.study.properties.study_id, doc, [])
+
+
+def validate_all(paths: List[Path], workers: int) -> List[FileResult]:
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(check_file, [str(p) for p in paths], chunksize=8))
+
+
+async def _latest_hashes(study_ids: List[str]) -> Dict[str, Optional[str]]:
+    pipeline = [
+        {"$match": {"properties.study_id": {"$in": study_ids}}},
+        {"$sort": {"timestamp": -1}},
+        {"$group": {"_id": "$properties.study_id", "hash": {"$first": "$content_hash"}}},
+    ]
+    rows = await db.get_db()["studies"].aggregate(pipeline).to_list(length=None)
+    return {row["_id"]: row.get("hash") for row in rows}
+
+
+async def upsert(valid: List[FileResult], force: bool) -> Dict[str, int]:
+    latest = await _latest_hashes(sorted({r.study_id for r in valid}))
+    now = int(time.time() * 1000)
+    ops = []
+    imported = set()
+    skipped = 0
+    for r in valid:
+        h = r.doc["content_hash"]
+        if not force and latest.get(r.study_id) == h:
+            skipped += 1
+            continue
+        ops.append(UpdateOne(
+            {"properties.study_id": r.study_id, "content_hash": h},
+            {"$setOnInsert": r.doc, "$set": {"timestamp": now}},
+            upsert=True,
+        ))
+        imported.add(r.study_id)
+        now += 1  # keep versions of the same study distinctly ordered
+    if not ops:
+        return {"inserted": 0, "updated": 0, "skipped": skipped}
+    result = await db.get_db()["studies"].bulk_write(ops, ordered=False)
+    counts = {
+        "inserted": result.upserted_count,
+        "updated":  result.modified_count,
+        "skipped":  skipped,
+    }
+    if settings.snapshot_dir:
+        counts["snapshots"] = await publish_latest(sorted(imported))
+    return counts
+
+
+async def publish_latest(study_ids: List[str]) -> int:
+    """
+    Snapshot the latest stored version of each study, like create_study
+    does for versions posted to the API. Returns how many were written.
+    """
+    studies = db.get_db()["studies"]
+    published = 0
+    for sid in study_ids:
+        doc = await studies.find_one({"properties.study_id": sid}, sort=[("timestamp", -1)])
+        if doc is not None:
+            await asyncio.to_thread(snapshots.publish, doc)
+            published += 1
+    return published
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("directory", nargs="?", type=Path, default=DEFAULT_DIR)
+    parser.add_argument("--workers", type=int, default=None, help="validation processes (default: CPUs)")
+    parser.add_argument("--dry-run", action="store_true", help="validate and report, write nothing")
+    parser.add_argument("--force", action="store_true", help="don't skip files matching the latest version")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s | %(message)s")
+    paths = sorted(args.directory.glob("*.json"))
+    if not paths:
+        raise SystemExit(f"No *.json files in {args.directory}")
+
+    t0 = time.perf_counter()
+    results = validate_all(paths, args.workers)
+    valid = [r for r in results if not r.errors]
+    for r in results:
+        if r.errors:
+            logger.error("%s: %d error(s)", r.path, len(r.errors))
+            for err in r.errors:
+                logger.error("    %s", err)
+        else:
+            logger.info("%s: ok (%s)", r.path, r.study_id)
+    logger.info(
+        "Validated %d files in %.2fs: %d valid, %d invalid",
+        len(results), time.perf_counter() - t0, len(valid), len(results) - len(valid),
+    )
+
+    if valid and not args.dry_run:
+        try:
+            counts = asyncio.run(upsert(valid, args.force))
+        finally:
+            db.close()
+        logger.info("Upserted: %s", counts)
+
+    sys.exit(1 if len(valid) < len(results) else 0)
+
+
+if __name__ == "__main__":
+    main()
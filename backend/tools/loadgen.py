@@ -0,0 +1,440 @@
+"""
+Simulate N participants of a study and report what one backend instance
+sustains: throughput, latency percentiles and error rates per endpoint.
+
+    python -m tools.loadgen studies/example_new.json --participants 500 --days 7
+    python -m tools.loadgen studies/example_new.json --target http://localhost:8200 \\
+        --participants 50 --speedup 600
+
+Prompt times come from each module's alert (absolute or relative schedule,
+repeats, extra times, random offsets). Absolute schedules are shifted so
+the study's first absolute alert falls on the simulated day 0. Every
+answered prompt produces UI log events and a ResponseEntry, with PVT
+reaction times as `entries`; `--speedup` compresses simulated time.
+
+Without --target the backend runs in this process on an in-memory Mongo
+stand-in (tests/memory_mongo.py) with REDCap replaced by tools.fake_redcap,
+so nothing but Python is needed. Client and server then share one event
+loop, so latencies include the generator's own overhead.
+"""
+import argparse
+import asyncio
+import calendar
+import json
+import logging
+import random
+import time
+import uuid
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+from pydantic import ValidationError
+
+from models.study import Alert, Module, StudyCreate
+
+logger = logging.getLogger("loadgen")
+
+API = "/api/v2"
+
+
+# ─── Schedule ────────────────────────────────────────────────────────
+
+def _add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    year = day.year + month // 12
+    month = month % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def _step(day: date, repeat: str, n: int) -> date:
+    if repeat == "daily":
+        return day + timedelta(days=n)
+    if repeat == "weekly":
+        return day + timedelta(weeks=n)
+    if repeat == "monthly":
+        return _add_months(day, n)
+    return _add_months(day, 12 * n)  # yearly
+
+
+def prompt_times(
+    alert:    Alert,
+    enrolled: datetime,
+    shift:    timedelta,
+    horizon:  datetime,
+    rng:      random.Random,
+) -> List[datetime]:
+    """
+    Notification times of one alert for a participant enrolled at `enrolled`,
+    up to `horizon`. `shift` moves absolute schedules into the simulation.
+    """
+    if alert.scheduleMode == "absolute":
+        first = alert.startDateTime
+        if first.tzinfo is None:
+            first = first.replace(tzinfo=timezone.utc)
+        first += shift
+        last = (
+            datetime.combine(alert.until, dtime.max, tzinfo=timezone.utc) + shift
+            if alert.until else horizon
+        )
+        max_repeats = None
+    else:
+        first = datetime.combine(
+            enrolled.date() + timedelta(days=alert.offsetDays),
+            dtime.fromisoformat(alert.offsetTime),
+            tzinfo=timezone.utc,
+        )
+        last = horizon
+        max_repeats = alert.repeatCount or 0
+
+    clock_times = [first.timetz()] + [
+        dtime.fromisoformat(t).replace(tzinfo=timezone.utc) for t in alert.times
+    ]
+    out: List[datetime] = []
+    n = 0
+    while True:
+        day = _step(first.date(), alert.repeat, n * alert.interval) if n else first.date()
+        if datetime.combine(day, dtime.min, tzinfo=timezone.utc) > min(last, horizon):
+            break
+        for clock in clock_times:
+            at = datetime.combine(day, clock)
+            if alert.random and alert.randomInterval:
+                at += timedelta(minutes=rng.uniform(-alert.randomInterval, alert.randomInterval))
+            if enrolled <= at <= min(last, horizon):
+                out.append(at)
+        n += 1
+        if alert.repeat == "never" or (max_repeats is not None and n > max_repeats):
+            break
+    return sorted(out)
+
+
+# ─── Synthetic traffic ───────────────────────────────────────────────
+
+@dataclass(order=True)
+class PlannedRequest:
+    at_s:    float
+    kind:    str = field(compare=False)
+    path:    str = field(compare=False)
+    json:    Any = field(default=None, compare=False)
+    form:    Optional[Dict[str, Any]] = field(default=None, compare=False)
+
+
+def _answer(question: Any, rng: random.Random) -> Any:
+    qtype = question.question_type
+    subtype = getattr(question, "subtype", None)
+    if qtype == "text":
+        return rng.randint(0, 100) if subtype == "numeric" else "synthetic answer"
+    if qtype == "datetime":
+        if subtype == "time":
+            return f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}"
+        return date.today().isoformat()
+    if qtype == "yesno":
+        return rng.random() < 0.5
+    if qtype == "slider":
+        return rng.randint(int(question.min), int(question.max))
+    if qtype == "multi":
+        return rng.choice(question.options) if question.options else None
+    return None  # instructions, media, photos: nothing to answer
+
+
+def _log(at: datetime, user_id: str, study_id: str, index: int, platform: str, page: str, event: str) -> Dict[str, Any]:
+    return {
+        "data_type":       "log",
+        "user_id":         user_id,
+        "study_id":        study_id,
+        "module_index":    index,
+        "platform":        platform,
+        "page":            page,
+        "event":           event,
+        "timestamp":       at.isoformat(),
+        "timestamp_in_ms": int(at.timestamp() * 1000),
+    }
+
+
+def _session(
+    study:   StudyCreate,
+    index:   int,
+    module:  Module,
+    user_id: str,
+    alert:   datetime,
+    start:   datetime,
+    rng:     random.Random,
+) -> List[PlannedRequest]:
+    """
+    One answered prompt: open, one log per section or PVT trial, submit
+    and the response itself.
+    """
+    sid = study.properties.study_id
+    platform = rng.choice(["ios", "android"])
+    at = alert + timedelta(minutes=rng.expovariate(1 / 10))
+    page = module.params.type
+    events = [(at, "open")]
+    entries = None
+    responses: Dict[str, Any] = {}
+    if module.params.type == "pvt":
+        p = module.params
+        entries = [rng.randint(150, p.max_reaction) for _ in range(p.trials)]
+        for rt in entries:
+            at += timedelta(milliseconds=rng.randint(p.min_waiting, p.max_waiting) + rt)
+            events.append((at, "trial"))
+    else:
+        for section in module.params.sections:
+            for q in section.questions:
+                value = _answer(q, rng)
+                if value is not None:
+                    responses[q.id] = value
+            at += timedelta(seconds=rng.uniform(5, 60))
+            events.append((at, "next_section"))
+    events.append((at, "submit"))
+
+    out = [
+        PlannedRequest((t - start).total_seconds(), "log", f"{API}/log",
+                json=_log(t, user_id, sid, index, platform, page, event))
+        for t, event in events
+    ]
+    form = {
+        "data_type":           f"{module.params.type}_response",
+        "user_id":             user_id,
+        "study_id":            sid,
+        "module_index":        index,
+        "platform":            platform,
+        "module_id":           module.id,
+        "module_name":         module.name,
+        "response_time":       at.isoformat(),
+        "response_time_in_ms": int(at.timestamp() * 1000),
+        "alert_time":          alert.isoformat(),
+    }
+    if module.params.type == "pvt":
+        form["entries"] = json.dumps(entries)
+    else:
+        form["responses"] = json.dumps(responses)
+    out.append(PlannedRequest((at - start).total_seconds(), "response", f"{API}/response", form=form))
+    return out
+
+
+def build_plan(
+    study:        StudyCreate,
+    participants: int,
+    days:         float,
+    enroll_over_h: float,
+    compliance:   float,
+    rng:          random.Random,
+) -> List[PlannedRequest]:
+    """
+    Every request the simulated participants will make, ordered by time.
+    """
+    start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    horizon = start + timedelta(days=days)
+    absolute = [
+        m.alerts.startDateTime for m in study.modules
+        if m.alerts.scheduleMode == "absolute" and m.alerts.startDateTime
+    ]
+    anchor = min(absolute).astimezone(timezone.utc) if absolute else start
+    shift = start - anchor.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    plan: List[PlannedRequest] = []
+    for n in range(participants):
+        user_id = f"loadgen-{n:05d}"
+        enrolled = start + timedelta(hours=rng.uniform(0, enroll_over_h))
+        for index, module in enumerate(study.modules):
+            for alert_at in prompt_times(module.alerts, enrolled, shift, horizon, rng):
+                if rng.random() < compliance:
+                    plan.extend(_session(study, index, module, user_id, alert_at, start, rng))
+    plan.sort()
+    return [r for r in plan if r.at_s < days * 86400]
+
+
+# ─── Running and reporting ───────────────────────────────────────────
+
+class Report:
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.max_lag_s = 0.0
+        self.started = time.perf_counter()
+        self.elapsed_s = 0.0
+
+    def record(self, kind: str, status: Any, ms: float) -> None:
+        self.latencies[kind].append(ms)
+        self.statuses[kind][status] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        total = sum(len(v) for v in self.latencies.values())
+        out: Dict[str, Any] = {
+            "requests":   total,
+            "elapsed_s":  round(self.elapsed_s, 2),
+            "throughput": round(total / self.elapsed_s, 1) if self.elapsed_s else 0.0,
+            "max_lag_s":  round(self.max_lag_s, 3),
+            "endpoints":  {},
+        }
+        for kind, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            statuses = self.statuses[kind]
+            errors = sum(n for s, n in statuses.items() if not (isinstance(s, int) and s < 400))
+            out["endpoints"][kind] = {
+                "count":      len(values),
+                "error_rate": round(errors / len(values), 4),
+                "p50_ms":     round(_percentile(values, 50), 2),
+                "p95_ms":     round(_percentile(values, 95), 2),
+                "p99_ms":     round(_percentile(values, 99), 2),
+                "max_ms":     round(values[-1], 2),
+                "statuses":   {str(s): n for s, n in statuses.items()},
+            }
+        return out
+
+
+def _percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+async def _send(client: httpx.AsyncClient, req: PlannedRequest, report: Report) -> None:
+    t0 = time.perf_counter()
+    try:
+        r = await client.post(req.path, json=req.json, data=req.form)
+        status: Any = r.status_code
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    report.record(req.kind, status, (time.perf_counter() - t0) * 1000)
+
+
+async def run_plan(
+    client:        httpx.AsyncClient,
+    plan:          List[PlannedRequest],
+    speedup:       float,
+    max_in_flight: int,
+) -> Report:
+    """
+    Open loop: each request goes out at its scheduled (compressed) time,
+    whether or not earlier ones have finished, up to `max_in_flight`.
+    """
+    report = Report()
+    loop = asyncio.get_running_loop()
+    t0 = loop.time()
+    slots = asyncio.Semaphore(max_in_flight)
+    tasks = set()
+
+    async def send(req: PlannedRequest) -> None:
+        try:
+            await _send(client, req, report)
+        finally:
+            slots.release()
+
+    for req in plan:
+        due = t0 + req.at_s / speedup
+        if due > loop.time():
+            await asyncio.sleep(due - loop.time())
+        await slots.acquire()
+        report.max_lag_s = max(report.max_lag_s, loop.time() - due)
+        task = asyncio.create_task(send(req))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    report.elapsed_s = time.perf_counter() - report.started
+    return report
+
+
+async def run_in_process(doc: Dict[str, Any], plan: List[PlannedRequest], args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Run the real app against the in-memory Mongo and the fake REDCap.
+    """
+    import db
+    import http_client
+    from config import settings
+    from main import app
+    from routers import redcap
+    from tools.fake_redcap import FakeRedcap, FakeRedcapConfig
+    from tests.memory_mongo import MemoryClient
+
+    fake = FakeRedcap(FakeRedcapConfig(
+        latency_ms=args.redcap_latency_ms,
+        jitter_ms=args.redcap_latency_ms / 2,
+        error_rate=args.redcap_error_rate,
+        rate_limit=args.redcap_rate_limit,
+        seed=args.seed,
+    ))
+    # swap the shared clients before anything creates the real ones
+    db._client = MemoryClient()
+    http_client._client = httpx.AsyncClient(transport=fake.transport())
+
+    sid = doc["properties"]["study_id"]
+    store = db.get_db()
+    await store["studies"].insert_one({**doc, "timestamp": int(time.time() * 1000)})
+    created = await fake.handle({
+        "token": fake.config.super_token, "content": "project",
+        "data": json.dumps([{"project_title": doc["properties"]["study_name"]}]),
+    })
+    await store["keys"].insert_one({"study_id": sid, "api_key": created.body.decode()})
+
+    async with app.router.lifespan_context(app):
+        while not app.state.ready:
+            await asyncio.sleep(0.01)
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://backend"
+        ) as client:
+            report = await run_plan(client, plan, args.speedup, args.max_in_flight)
+        # let queued REDCap pushes finish before reading the fake's counters
+        deadline = time.monotonic() + args.drain_timeout
+        while redcap.delivery.stats()["pending"] and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        summary = report.summary()
+        summary["redcap_delivery"] = redcap.delivery.stats()
+    summary["fake_redcap"] = fake.stats()
+    summary["log_collection"] = await store[settings.log_collection].count_documents({})
+    return summary
+
+
+async def run_remote(plan: List[PlannedRequest], args: argparse.Namespace) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.max_in_flight)
+    async with httpx.AsyncClient(base_url=args.target, limits=limits, timeout=30.0) as client:
+        report = await run_plan(client, plan, args.speedup, args.max_in_flight)
+    return report.summary()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("study", type=Path, help="study JSON, e.g. studies/example_new.json")
+    parser.add_argument("--participants", type=int, default=100)
+    parser.add_argument("--days", type=float, default=1.0, help="simulated study days")
+    parser.add_argument("--speedup", type=float, default=3600.0, help="simulated seconds per real second")
+    parser.add_argument("--enroll-over-h", type=float, default=0.0, help="spread enrollments over this many hours")
+    parser.add_argument("--compliance", type=float, default=0.8, help="share of prompts that get answered")
+    parser.add_argument("--max-in-flight", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--target", help="base URL of a running backend; default: run it in-process")
+    parser.add_argument("--redcap-latency-ms", type=float, default=50.0)
+    parser.add_argument("--redcap-error-rate", type=float, default=0.0)
+    parser.add_argument("--redcap-rate-limit", type=float, default=0.0)
+    parser.add_argument("--drain-timeout", type=float, default=30.0, help="seconds to wait for REDCap pushes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s | %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    doc = json.loads(args.study.read_text())
+    try:
+        study = StudyCreate.model_validate(doc)
+    except ValidationError as e:
+        raise SystemExit(f"{args.study} is not a valid study:\n{e}")
+    if not args.target:
+        # a fresh id per run, so repeated runs never collide
+        doc["properties"]["study_id"] = f"{study.properties.study_id}_load_{uuid.uuid4().hex[:8]}"
+        study.properties.study_id = doc["properties"]["study_id"]
+
+    plan = build_plan(study, args.participants, args.days, args.enroll_over_h,
+                      args.compliance, random.Random(args.seed))
+    logger.info("Replaying %d requests from %d participants over %.1f simulated days (x%.0f)",
+                len(plan), args.participants, args.days, args.speedup)
+    if args.target:
+        summary = asyncio.run(run_remote(plan, args))
+    else:
+        summary = asyncio.run(run_in_process(doc, plan, args))
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Copy UI events from the old plain `logs` collection into the time-series
+collection configured by LOG_COLLECTION.
+
+    python -m tools.migrate_logs --dry-run
+    python -m tools.migrate_logs --batch-size 5000 --drop-source
+
+Time-series collections have no unique _id index, so an interrupted run
+should be continued with --resume-after <last _id logged>, not restarted.
+--drop-source only drops the source once the target holds exactly as many
+events over the source's _id range, and exits non-zero otherwise.
+"""
+import argparse
+import asyncio
+import logging
+from typing import Optional, Tuple
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+import db
+from config import settings
+from services import log_store
+
+logger = logging.getLogger("migrate_logs")
+
+
+async def migrate(
+    source:       str,
+    batch_size:   int,
+    dry_run:      bool,
+    drop_source:  bool,
+    resume_after: Optional[str] = None,
+) -> int:
+    database = db.get_db()
+    if source == settings.log_collection:
+        raise SystemExit("Source and target collection are the same")
+
+    total = await database[source].estimated_document_count()
+    logger.info("%d events in %s → %s", total, source, settings.log_collection)
+    if dry_run:
+        return 0
+
+    await log_store.provision(database)
+    target = database[settings.log_collection]
+    query = {"_id": {"$gt": ObjectId(resume_after)}} if resume_after else {}
+    copied = failed = 0
+    batch = []
+    async for doc in database[source].find(query, sort=[("_id", 1)], batch_size=batch_size):
+        batch.append(log_store.to_document(doc))
+        if len(batch) >= batch_size:
+            inserted, errors = await _insert(target, batch)
+            copied, failed = copied + inserted, failed + errors
+            logger.info("%d / %d copied, last _id %s", copied, total, batch[-1]["_id"])
+            batch = []
+    if batch:
+        inserted, errors = await _insert(target, batch)
+        copied, failed = copied + inserted, failed + errors
+
+    logger.info("Copied %d events", copied)
+    if drop_source:
+        await _check_complete(database[source], target, failed)
+        await database[source].drop()
+        logger.info("Dropped %s", source)
+    return copied
+
+
+async def _insert(target, batch) -> Tuple[int, int]:
+    """
+    (inserted, failed) for one batch.
+    """
+    try:
+        await target.insert_many(batch, ordered=False)
+        return len(batch), 0
+    except BulkWriteError as e:
+        failed = len(e.details.get("writeErrors", []))
+        logger.error("%d events in this batch failed to insert", failed)
+        return e.details.get("nInserted", 0), failed
+
+
+async def _check_complete(source, target, failed: int) -> None:
+    """
+    Exit before dropping unless this run had no write errors and the target
+    has as many events as the source up to its newest _id, so events copied
+    by earlier --resume-after runs are checked too.
+    """
+    if failed:
+        raise SystemExit(f"{failed} events failed to copy, not dropping {source.name}")
+    expected = await source.count_documents({})
+    newest = await source.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    found = await target.count_documents({"_id": {"$lte": newest["_id"]}}) if newest else 0
+    if found != expected:
+        raise SystemExit(
+            f"{source.name} has {expected} events but {target.name} has {found} of them "
+            f"(events older than LOG_RETENTION_DAYS expire there), not dropping {source.name}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--source", default="logs")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--drop-source", action="store_true")
+    parser.add_argument("--resume-after", help="continue after this source _id")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s | %(message)s")
+    try:
+        asyncio.run(migrate(
+            args.source, args.batch_size, args.dry_run, args.drop_source, args.resume_after
+        ))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+(Re)build the static study snapshots in SNAPSHOT_DIR from Mongo: the latest
+version of every study_id, plus every version under its permalink.
+
+    python -m tools.publish_snapshots
+    python -m tools.publish_snapshots --latest-only
+"""
+import argparse
+import asyncio
+import logging
+
+import db
+from config import settings
+from services import snapshots
+
+logger = logging.getLogger("publish_snapshots")
+
+
+async def publish_all(latest_only: bool) -> int:
+    studies = db.get_db()["studies"]
+    count = 0
+    # oldest first, so the newest version of each study_id is written last
+    async for doc in studies.find({}).sort("timestamp", 1):
+        if latest_only:
+            newer = await studies.find_one(
+                {"properties.study_id": doc["properties"]["study_id"],
+                 "timestamp": {"$gt": doc["timestamp"]}},
+                {"_id": 1},
+            )
+            if newer:
+                continue
+        await asyncio.to_thread(snapshots.publish, doc)
+        count += 1
+    return count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latest-only", action="store_true", help="skip superseded versions")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s | %(message)s")
+    if not settings.snapshot_dir:
+        raise SystemExit("SNAPSHOT_DIR is not set")
+    try:
+        count = asyncio.run(publish_all(args.latest_only))
+    finally:
+        db.close()
+    logger.info("Published %d study versions to %s", count, settings.snapshot_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Find responses that are in `responses_backup` but never reached REDCap,
+and push them again.
+
+    python -m tools.reconcile_redcap --dry-run
+    python -m tools.reconcile_redcap --study my_study --batch-size 200 --rate 2
+
+For each study with a REDCap project, the REDCap records are exported in
+pages of --page-size record ids and indexed by (record id, instrument,
+response time); REDCap numbers repeat instances itself, so the response
+time is what identifies an instance we pushed. The backups of the study are
+then streamed from Mongo, and those missing from the index are imported in
+batches of --batch-size, at most --rate batches per second, backing off on
+429s, 5xx and open circuits. Nothing is written to Mongo.
+"""
+import argparse
+import asyncio
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+import db
+import http_client
+from models.response import ResponseEntry
+from routers.redcap import _get_api_key, _get_codebook, _redcap_post, _redcap_record
+from services.breaker import CircuitOpenError
+from services.study_lookup import redcap_url
+
+logger = logging.getLogger("reconcile_redcap")
+
+Key = Tuple[str, str, str]
+_TIME_PREFIX = "field_response_time_"
+
+
+def _row_key(row: Dict[str, Any]) -> Optional[Key]:
+    for field, value in row.items():
+        if field.startswith(_TIME_PREFIX) and not field.startswith(_TIME_PREFIX + "in_ms_") and value:
+            return (str(row.get("field_record_id")), row.get("redcap_repeat_instrument") or "", str(value))
+    return None
+
+
+def _response_key(rsp: ResponseEntry) -> Key:
+    return (rsp.user_id, f"module_{rsp.module_id}", rsp.response_time)
+
+
+async def _export(url: str, payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    r = await _redcap_post(url, {"content": "record", "format": "json", "type": "flat", **payload}, timeout=120.0)
+    r.raise_for_status()
+    return r.json()
+
+
+async def redcap_index(
+    url:       str,
+    token:     str,
+    modules:   Optional[int],
+    page_size: int,
+) -> Set[Key]:
+    """
+    (record id, instrument, response time) of every repeat instance in REDCap.
+    """
+    rows = await _export(url, {"token": token, "fields[0]": "field_record_id"})
+    ids = list(dict.fromkeys(str(r["field_record_id"]) for r in rows if r.get("field_record_id")))
+    fields: Dict[str, str] = {}
+    if modules is not None:
+        names = ["field_record_id"] + [f"{_TIME_PREFIX}{i}" for i in range(modules)]
+        fields = {f"fields[{i}]": name for i, name in enumerate(names)}
+
+    index: Set[Key] = set()
+    for start in range(0, len(ids), page_size):
+        page = ids[start:start + page_size]
+        records = {f"records[{i}]": rid for i, rid in enumerate(page)}
+        for row in await _export(url, {"token": token, **records, **fields}):
+            key = _row_key(row)
+            if key is not None:
+                index.add(key)
+    return index
+
+
+async def missing_responses(
+    database: AsyncIOMotorDatabase,
+    study_id: str,
+    present:  Set[Key],
+    stats:    Dict[str, int],
+) -> AsyncIterator[ResponseEntry]:
+    """
+    Stream the study's backups and yield each response REDCap doesn't have,
+    once, even if it was backed up more than once.
+    """
+    cursor = database["responses_backup"].find({"study_id": study_id}, {"_id": 0}).sort("_id", 1)
+    async for doc in cursor:
+        stats["backups"] += 1
+        try:
+            rsp = ResponseEntry(**doc)
+        except Exception:
+            stats["unreadable"] += 1
+            continue
+        key = _response_key(rsp)
+        if key in present:
+            continue
+        present.add(key)
+        yield rsp
+
+
+async def _push(url: str, token: str, batch: List[Dict[str, Any]], retries: int) -> bool:
+    payload = {
+        "token":   token,
+        "content": "record",
+        "format":  "json",
+        "type":    "flat",
+        "data":    json.dumps(batch),
+    }
+    delay = 1.0
+    for attempt in range(retries + 1):
+        try:
+            r = await _redcap_post(url, payload, timeout=120.0)
+            if r.status_code < 400:
+                return True
+            if r.status_code != 429 and r.status_code < 500:
+                logger.error("REDCap rejected a batch of %d: %s", len(batch), r.text.strip())
+                return False
+            delay = float(r.headers.get("Retry-After", delay))
+        except CircuitOpenError:
+            pass
+        except httpx.TransportError as e:
+            logger.warning("Pushing a batch of %d failed: %r", len(batch), e)
+        if attempt < retries:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60.0)
+    return False
+
+
+async def reconcile_study(
+    database: AsyncIOMotorDatabase,
+    study_id: str,
+    args:     argparse.Namespace,
+) -> Dict[str, Any]:
+    token = await _get_api_key(database, study_id)
+    if not token:
+        return {"study_id": study_id, "skipped": "no REDCap project"}
+    url = await redcap_url(database, study_id)
+    book = await _get_codebook(database, study_id)
+    study = await database["studies"].find_one(
+        {"properties.study_id": study_id}, {"modules.id": 1}, sort=[("timestamp", -1)]
+    )
+    modules = len(study.get("modules", [])) if study else None
+
+    present = await redcap_index(url, token, modules, args.page_size)
+    stats = {"backups": 0, "unreadable": 0}
+    report: Dict[str, Any] = {"study_id": study_id, "redcap_records": len(present)}
+    missing: List[Key] = []
+    batch: List[Dict[str, Any]] = []
+    pushed = failed = 0
+
+    async def flush() -> None:
+        nonlocal pushed, failed, batch
+        if await _push(url, token, batch, args.retries):
+            pushed += len(batch)
+        else:
+            failed += len(batch)
+        batch = []
+        await asyncio.sleep(1 / args.rate)
+
+    async for rsp in missing_responses(database, study_id, present, stats):
+        missing.append(_response_key(rsp))
+        if args.dry_run:
+            continue
+        batch.append(_redcap_record(rsp, book))
+        if len(batch) >= args.batch_size:
+            await flush()
+    if batch:
+        await flush()
+
+    report.update(stats, missing=len(missing), sample=[list(k) for k in missing[:10]])
+    if not args.dry_run:
+        report.update(pushed=pushed, failed=failed)
+    return report
+
+
+async def reconcile(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    database = db.get_db()
+    study_ids = args.study or await database["keys"].distinct("study_id")
+    reports = []
+    try:
+        for study_id in study_ids:
+            try:
+                report = await reconcile_study(database, study_id, args)
+            except (httpx.HTTPError, CircuitOpenError) as e:
+                report = {"study_id": study_id, "error": repr(e)}
+            logger.info("%s", report)
+            reports.append(report)
+    finally:
+        await http_client.close()
+    return reports
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--study", action="append", help="study id (repeatable); default: every study with a REDCap project")
+    parser.add_argument("--dry-run", action="store_true", help="only report what is missing")
+    parser.add_argument("--page-size", type=int, default=500, help="record ids per REDCap export")
+    parser.add_argument("--batch-size", type=int, default=100, help="records per REDCap import")
+    parser.add_argument("--rate", type=float, default=2.0, help="max import batches per second")
+    parser.add_argument("--retries", type=int, default=5, help="attempts per batch after the first")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s | %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    try:
+        reports = asyncio.run(reconcile(args))
+    finally:
+        db.close()
+    print(json.dumps(reports, indent=2))
+    if any(r.get("failed") or r.get("error") for r in reports):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()